@@ -12,27 +12,39 @@ def check_row_consistency(x, df, policy_id_column_name, main_column_contract_dat
     """Checks if the line should be kept in the data or not  
         Arguments --> the row, the dataframe, the policy, contract start and claim occurrence dates columns,
             The value associated to rows for which we do not have enough information, and the number of days for each contract (usually 365)  
-        Returns --> a boolean with 1 if the row is consistent and 0 otherwise
+        Returns --> 1 if the row is inconsistent and 0 otherwise (see check_rows_consistency)
     """
 
-    row = df.loc[x]
-    policy_id = row[policy_id_column_name]
-    year_name = main_column_contract_date
-    result = 0
-    effective_date = row[year_name]
-    effective_dates = df[df[policy_id_column_name]==policy_id][year_name]
+    # The rules are the ones of check_rows_consistency, which checks all the rows at once
+    return int(check_rows_consistency(df, policy_id_column_name, main_column_contract_date, claim_occurrence_date, unknown_row_name, number_of_days).loc[x])
+
+
+def check_rows_consistency(df, policy_id_column_name, main_column_contract_date, claim_occurrence_date, unknown_row_name, number_of_days, policy_index=None):
+    """Checks for all the rows at once if they should be kept in the data or not   
+        Arguments --> the dataframe, the policy, contract start and claim occurrence dates columns,   
+            The value associated to rows for which we do not have enough information, and the number of days for each contract (usually 365)   
+            and the portfolio policy index (see index_functions.PolicyIndex), if given the contract amendments are looked for in the portfolio instead of the dataframe   
+        Returns --> a pandas serie with 1 if the row is inconsistent and 0 otherwise
+    """
+
+    effective_dates = df[main_column_contract_date]
+    occurrence_dates = df[claim_occurrence_date]
+
+    # The latest contract start date of each policy is derived once for all the rows of the policy
+    if policy_index is None:
+        latest_effective_dates = df.groupby(policy_id_column_name, sort=False)[main_column_contract_date].transform('max')
+    else:
+        latest_effective_dates = policy_index.get_latest_effective_dates(df[policy_id_column_name])
+
+    # Contract started after the claim occurrence
+    started_after_claim = effective_dates > occurrence_dates
+    # The claim did not occurr during the yearly contract cover and there is a contract amendment
+    claim_out_of_cover = (effective_dates + pd.Timedelta(days=number_of_days) <= occurrence_dates) & (effective_dates < latest_effective_dates)
 
-    # For policy_id with UNKNOWN value, we keep all claims because we cannot link them to a policy but we group them in an UNKNOWN block so that we don't understimate the total cost
-    if policy_id != unknown_row_name:
-        # Contract started after the claim occurrence
-        if effective_date > row[claim_occurrence_date]:
-            result = 1
-        # The claim did not occurr during the yearly contract cover;
-        # By prudency, also checks if there is a contract amendment. if not we assume it is a date mistake and we do not set the cost to 0
-        elif effective_date + timedelta(number_of_days) <= row[claim_occurrence_date] and effective_date < effective_dates.max():
-            result = 1
+    # For policy_id with UNKNOWN value, we keep all claims because we cannot link them to a policy
+    mask = (df[policy_id_column_name] != unknown_row_name) & (started_after_claim | claim_out_of_cover)
 
-    return result
+    return mask.astype('int64')
 
 
 def add_back_lines(df, df_removed, main_column_contract_date, claim_id_column_name, claim_occurrence_date_column_name):
@@ -48,23 +60,25 @@ def add_back_lines(df, df_removed, main_column_contract_date, claim_id_column_na
     # To find these claims we look at the claims that were in the original claims data but are not in the newly created
     wrongly_removed = df_removed[~df_removed[claim_id_column_name].isin(df[claim_id_column_name])].drop_duplicates(subset=claim_id_column_name, keep='last')
 
+    # Changes the dates so that it is now consistent. It means there might be cost overestimation for some occurrence year, but it won't have any impact overall
+    wrongly_removed = wrongly_removed.assign(**{claim_occurrence_date_column_name: wrongly_removed[year_name] + timedelta(days=1)})
+
     # We add them back in our claims because we prefer being wrong in the occurrence dates rather than reducing the total costs
     new_df = pd.concat((df, wrongly_removed), sort=False).reset_index(drop=True)
 
-    # Changes the dates so that it is now consistent. It means there might be cost overestimation for some occurrence year, but it won't have any impact overall
-    new_df.loc[new_df.shape[0]-wrongly_removed.shape[0]:, claim_occurrence_date_column_name] = new_df.loc[new_df.shape[0]-wrongly_removed.shape[0]:, year_name] + timedelta(days=1)
-
     return new_df
 
 
 
-def find_wrong_lines(df, main_column_contract_date, lines_ro_remove_name, number_of_days=None, remove=False):
+def find_wrong_lines(df, main_column_contract_date, lines_ro_remove_name, number_of_days=None, remove=False, policy_id_column_name='policy_id', claim_occurrence_date_column_name='occurrence_date', unknown_row_name='UNKNOWN', policy_index=None):
     """
         Finds the lines that seem to be wrong either because they are duplicates or because a date inconsistency has been detected   
         Arguments --> the df on which we are doing the check, the constract start date columns,   
             the name that will be given to the rows flagged as wrong, the number of days that should serve to check dates consistency (usually 365 for yearly contracts)   
             i.e. for a given policy and its effective date, a claim occurring beyond that number of days should not be associate to it (usually 365 for yearly contracts),   
-            and a remove argument that if set to True means all the lines considered wrong are removed from the df   
+            a remove argument that if set to True means all the lines considered wrong are removed from the df,   
+            the policy id and claim occurrence date columns names, the policy id given to the claims that cannot be linked to a policy   
+            and the portfolio policy index (see check_rows_consistency)   
         Returns --> 2 dataframes, one which will be either with a flag for wrong lines or with all these lines removed,   
                     and a new one which contains only the removed lines
     """
@@ -72,7 +86,7 @@ def find_wrong_lines(df, main_column_contract_date, lines_ro_remove_name, number
     new_df = deepcopy(df)
     number_of_days = 365 if number_of_days is None else number_of_days
 
-    new_df[lines_ro_remove_name] = new_df.index.to_frame()[0].apply(lambda x: check_row_consistency(x, new_df, main_column_contract_date, number_of_days))
+    new_df[lines_ro_remove_name] = check_rows_consistency(new_df, policy_id_column_name, main_column_contract_date, claim_occurrence_date_column_name, unknown_row_name, number_of_days, policy_index)
 
     if remove == True:
         df_removed_lines = new_df[new_df[lines_ro_remove_name] == 1]
@@ -87,140 +101,209 @@ Retreat these lines, then run again this function with the remove argument set t
 
 
 
-def create_unknown_policy(df_portfolio, df_claims, features_analysis, policy_id_column_name='policy_id', unknown_row_name='UNKNOWN'):
+def create_unknown_policy(df_portfolio, df_claims, features_analysis, policy_id_column_name='policy_id', unknown_row_name='UNKNOWN', policy_index=None):
     """ Finds policies that are in the claims data but not in the porfolio, and generates a new policy on the portfolio data to represent these unknown policies   
         Arguments -> the portfolio and claims dataframes, the features for which we will impute a value for the identified policies,   
             (since the policies are added in the porfolio, a value has to be assumed for each of their features)   
             the policy id column name to use and the policy id name we will give to these policies found in the claims but not in the porfolio   
-        Returns --> a new portfolio and claims dataframe with the new policy name given to the identified policies  
+            and the portfolio policy index (see index_functions.PolicyIndex) used to find the claimants instead of looking for them in the portfolio   
+        Returns --> a new portfolio and claims dataframe with the new policy name given to the identified policies   
+            (the integer features of the analysis become floats in the portfolio as the new row gets their average)  
     """
 
-    new_df_portfolio, new_df_claims = deepcopy(df_portfolio), deepcopy(df_claims)
-
     # Finds the claimants that do not exist in the portfolio data
-    mask = ~new_df_claims[policy_id_column_name].isin(new_df_portfolio[policy_id_column_name])
-    df_not_existing_policies = new_df_claims[mask]
+    mask = ~df_claims[policy_id_column_name].isin(df_portfolio[policy_id_column_name]) if policy_index is None else ~policy_index.contains(df_claims[policy_id_column_name])
+
+    # Only the policy id column is replaced, the other columns are shared with the original claims df instead of being copied
+    new_df_claims = df_claims.copy(deep=False)
+    policy_id_position = new_df_claims.columns.get_loc(policy_id_column_name)
+    del new_df_claims[policy_id_column_name]
+    new_df_claims.insert(policy_id_position, policy_id_column_name, df_claims[policy_id_column_name].where(~mask, unknown_row_name))
 
-    new_df_claims.loc[df_not_existing_policies.index, policy_id_column_name] = unknown_row_name
+    # The new row gets the last row values, the mode of the text features and the average of the numerical ones
+    new_row_df = df_portfolio.iloc[[-1]].copy()
+    new_row_df[policy_id_column_name] = unknown_row_name
 
-    # Reseting df index just in case to be sure we take the last row using shape
-    new_df_portfolio = new_df_portfolio.reset_index(drop=True)
-    # Gets the last row values and affect them to a new row
-    new_row_df = new_df_portfolio.loc[new_df_portfolio.shape[0]-1]
-    new_df_portfolio.loc[new_df_portfolio.shape[0]] = new_row_df
-    new_df_portfolio.loc[new_df_portfolio.shape[0]-1:, [policy_id_column_name]] = unknown_row_name
+    text_features = [feature for feature in features_analysis if pd.api.types.is_string_dtype(df_portfolio[feature].dtype) == True]
+    numerical_features = [feature for feature in features_analysis if df_portfolio[feature].dtype in ['float64', 'int64', 'int32']]
 
-    # For each feature, derives the mode or the average and assigns it to the new row (a simple fillna might be faster)
-    for feature in features_analysis:
-        if new_df_portfolio[feature].dtype in ['object']:
-            new_df_portfolio.loc[new_df_portfolio.shape[0]-1:, feature] = new_df_portfolio[feature].mode()[0]
-        elif new_df_portfolio[feature].dtype in ['float64', 'int64', 'int32']:
-            new_df_portfolio.loc[new_df_portfolio.shape[0]-1:, feature] = new_df_portfolio[feature].mean()
+    # The mode and the average are derived with the new row still holding the last row values, as they used to be derived after the last row was duplicated
+    df_features = pd.concat((df_portfolio[text_features + numerical_features], df_portfolio[text_features + numerical_features].iloc[[-1]]))
+    new_row_df = new_row_df.assign(**{feature: df_features[feature].mode()[0] for feature in text_features}, **df_features[numerical_features].mean().to_dict())
 
-    print('There are {} policies in the claims that cannot be found in the porfolio data'.format(df_not_existing_policies.shape[0]))
+    new_df_portfolio = pd.concat((df_portfolio, new_row_df), ignore_index=True)
+
+    print('There are {} policies in the claims that cannot be found in the porfolio data'.format(mask.sum()))
 
     return new_df_portfolio, new_df_claims
 
 
 
-def find_outliers(df, columns=None, method='interquartile', z_score_threshold=3, interquartile_lower_bound=0.25, interquartile_upper_bound=0.75):
+def find_outliers_positions(df, columns=None, method='interquartile', z_score_threshold=3, interquartile_lower_bound=0.25, interquartile_upper_bound=0.75, group_by=None):
     """
-        Finds outliers for the specified features   
-        Arguments --> the dataframe on which to find outliers, the features as a name or list of names and the method to use to find outliers (either interquartile or z-score)   
-            the z-score and the interquartile thresholds to use   
-        Returns --> the initial dataframe, the dataframe with only outliers and the new df without the outliers
+        Finds the rows having an outlier value in at least one of the specified features, with all the bounds derived in one pass   
+        Arguments --> the dataframe on which to find outliers, the features as a name or list of names (all the numerical ones if not specified)   
+            the method to use to find outliers (either interquartile or z-score), the z-score and the interquartile thresholds to use   
+            and the features (either a list or a string) defining the segments (e.g. the guarantee) in which the bounds are derived, the bounds being derived on all the data if not specified   
+        Returns --> an array with the positions of the outlier rows (missing values being considered as outliers)
     """
 
-    new_df = deepcopy(df)
+    new_columns = df.select_dtypes('number').columns.tolist() if columns is None else [columns] if isinstance(columns, str) == True else columns
+    values = df[new_columns]
 
-    if method == 'interquartile':
-        new_columns = [columns] if isinstance(columns, str) == True else columns
+    # Each row gets the number of its segment so that the bounds of all segments are derived together and then broadcast to the rows
+    segments = np.zeros(len(df), dtype='int64') if group_by is None else df.groupby(group_by, sort=False, dropna=False).ngroup().values
+    grouped_values = values.groupby(segments)
 
-        for column in new_columns:
-            quantile_25 = df[column].quantile(interquartile_lower_bound)
-            quantile_75 = df[column].quantile(interquartile_upper_bound)
+    if method == 'interquartile':
+        quantiles = grouped_values.quantile([interquartile_lower_bound, interquartile_upper_bound])
+        quantile_25 = quantiles.xs(interquartile_lower_bound, level=-1).values[segments]
+        quantile_75 = quantiles.xs(interquartile_upper_bound, level=-1).values[segments]
 
-            interquartile_range = quantile_75 - quantile_25
-            lower_bound = quantile_25 - 1.5 * interquartile_range
-            upper_bound = quantile_75 + 1.5 * interquartile_range
+        interquartile_range = quantile_75 - quantile_25
+        lower_bound = quantile_25 - 1.5 * interquartile_range
+        upper_bound = quantile_75 + 1.5 * interquartile_range
 
-            new_df = new_df[(new_df[column] >= lower_bound) & (new_df[column] <= upper_bound)]
+        kept = (values.values >= lower_bound) & (values.values <= upper_bound)
 
     else:
+        # As scipy zscore, the population standard deviation is used and a segment with a missing value has no z-score
+        means = grouped_values.mean().mask(values.isna().groupby(segments).any())
+        standard_deviations = grouped_values.std(ddof=0)
+
+        z_score = np.abs(values.values - means.values[segments]) / standard_deviations.values[segments]
+        kept = z_score < z_score_threshold
+
+    return np.flatnonzero(~kept.all(axis=1))
+
+
+
+def find_outliers(df, columns=None, method='interquartile', z_score_threshold=3, interquartile_lower_bound=0.25, interquartile_upper_bound=0.75, group_by=None):
+    """
+        Finds outliers for the specified features   
+        Arguments --> the dataframe on which to find outliers, the features as a name or list of names and the method to use to find outliers (either interquartile or z-score)   
+            the z-score and the interquartile thresholds to use and the features defining the segments in which the bounds are derived (see find_outliers_positions)   
+        Returns --> the initial dataframe, the dataframe with only outliers and the new df without the outliers
+    """
 
-        z_score = np.abs(stats.zscore(df[columns]))
-        new_df = new_df[z_score<3] if isinstance(columns, str) == True else new_df[(z_score<3).all(axis=1)]
+    outliers_positions = find_outliers_positions(df, columns, method, z_score_threshold, interquartile_lower_bound, interquartile_upper_bound, group_by)
+    kept = np.ones(len(df), dtype='bool')
+    kept[outliers_positions] = False
 
-    df_outliers = df[~df.index.isin(new_df.index)]
+    df_outliers = df.iloc[outliers_positions]
     proportion_outliers = len(df_outliers) / len(df)
 
     if proportion_outliers > 0.05:
         print("Outliers represent a high proportion of the data: {}%. We should not remove them all".format(proportion_outliers))
-        return deepcopy(df), df_outliers, df
+        return df.copy(), df_outliers, df
     else:
         print('{} rows have been removed'.format(df_outliers.shape[0]))
-        return deepcopy(df), df_outliers, new_df
+        return df.copy(), df_outliers, df[kept]
     
     
 
-def perform_sense_check(df, new_cell_name=None, **kwargs):
+class SenseCheckRules:
+    """
+        Set of comparison rules compiled once and evaluated on all the rows in a single pass   
+        The result of the evaluation is a bitmask: the bit i of a row is set if the row meets the comparison of the rule i (i.e. the rule flags it),   
+        the bits being stored in 64 bits words so that any number of rules can be used   
+        Arguments --> kwargs --> tuples like (column1, column2, comparison_to_do, strict_comparison)   
+            or (column1, integer, comparison_to_do) ; comparison_to_do must be 0 for ==, 1 for <=, 2 for >=   
+            if strict_comparison is True, then the comparison must be strict (> or <)
+    """
+
+    def __init__(self, **kwargs):
+
+        self.rules_names = list(kwargs.keys())
+        self.operators, self.expressions, self.values = [], [], {}
+
+        for rule_number, value in enumerate(kwargs.values()):
+            strict = len(value) >= 4 and value[3] == True
+            operator = '==' if value[2] == 0 else ('<' if strict == True else '<=') if value[2] == 1 else ('>' if strict == True else '>=')
+
+            # The second element of the tuple being a column name, the comparison is made with the column, otherwise with the number itself
+            if isinstance(value[1], str) == True:
+                compare_expression = '`{}`'.format(value[1])
+            else:
+                compare_expression = '@rule_value_{}'.format(rule_number)
+                self.values['rule_value_{}'.format(rule_number)] = value[1]
+
+            self.operators.append((value[0], value[1], operator))
+            self.expressions.append('`{}` {} {}'.format(value[0], operator, compare_expression))
+
+
+    def evaluate(self, df, use_eval=False):
+        """
+            Evaluates all the rules on the dataframe   
+            Arguments --> the dataframe and a boolean indicating if the rules are evaluated with DataFrame.eval (which uses numexpr when it is installed)   
+            Returns --> an array of unsigned 64 bits integers with a row per dataframe row and a column per group of 64 rules
+        """
+
+        bitmask = np.zeros((len(df), (len(self.expressions) + 63) // 64), dtype='uint64')
+
+        for rule_number, mask in enumerate(self._evaluate_masks(df, use_eval)):
+            bitmask[:, rule_number // 64] |= mask.astype('uint64') << np.uint64(rule_number % 64)
+
+        return bitmask
+
+
+    def flagged_rules(self, bitmask):
+        """
+            Gets the rules flagging each row from the bitmask   
+            Arguments --> the bitmask returned by evaluate   
+            Returns --> a boolean dataframe with a column per rule
+        """
+
+        masks = {rule_name: (bitmask[:, rule_number // 64] >> np.uint64(rule_number % 64)) & np.uint64(1) == 1 for rule_number, rule_name in enumerate(self.rules_names)}
+
+        return pd.DataFrame(masks)
+
+
+    def _evaluate_masks(self, df, use_eval):
+        """ Yields the boolean array of each rule"""
+
+        for expression, (column, compare, operator) in zip(self.expressions, self.operators):
+            if use_eval == True:
+                mask = df.eval(expression, local_dict=self.values)
+            else:
+                compare = df[compare] if isinstance(compare, str) == True else compare
+                mask = df[column] == compare if operator == '==' else df[column] < compare if operator == '<' else df[column] <= compare if operator == '<=' \
+                    else df[column] > compare if operator == '>' else df[column] >= compare
+
+            yield np.asarray(mask, dtype='bool')
+
+
+
+def perform_sense_check(df, new_cell_name=None, use_eval=False, **kwargs):
     """
        Finds data which is inconsistent on the columns specified in the kwargs   
        Arguments --> the dataframe, the name of the new column created to flag if the row is consistent or not,   
             if not specified, then the function creates a new df composed of the rows for which the comparison check is true   
+            a boolean indicating if the rules are evaluated with DataFrame.eval (see SenseCheckRules)   
             kwargs --> tuples like (column1, column2, comparison_to_do, strict_comparison)   
             or (column1, integer, comparison_to_do) ; comparison_to_do must be 0 for ==, 1 for <=, 2 for >=   
             if strict_comparison is True, then the comparison must be strict (> or <)   
        Returns --> either a new dataframe containing all rows that meet the comparison check or the current dataframe with a new cell that flags them
    """
 
-    # Defines if the second argument to compare with is a integer/float or a pandas serie   
-    # Returns --> the right element that must be used for the comparison
-    def get_compare():
-
-        if isinstance(value[1], str) == True:
-            # The second element of the tuple being a column name, we get the pandas serie
-            compare = df[value[1]]            
-        else:
-            # The second element of the tuple being a number, we just retrieve the number itself
-            compare = value[1]
-            
-
-        return compare
-
-    #Returns the concatenated dataframe validating the check or updates the df column used to flag if the comparison is true or not
-    def create_new_cell_or_df(): 
-
-        # Cell name not being defined, it means the function must create a dataframe
-        if new_cell_name is None:
-            # As several checks can be done, a concatenation between the previous check and the new one is made
-            return pd.concat((df_check, df[mask]), axis=0).drop_duplicates(keep='first')
-        else:
-            # The original df is modified with a new column that will have true/false value. If there are several checks performed, the row will be flagged true if it validates at least 1 check
-            df[new_cell_name] = df[new_cell_name] | mask if new_cell_name in df.columns else mask
-
-         
-    df_check = pd.DataFrame()
-    
-    # Loops trough the kwargs
-    for value in kwargs.values():
-
-        # These lines checks the comparison operation to do
-        if value[2] == 0:
-            compare = get_compare()           
-            mask = df[value[0]] == compare
-
-        elif value[2] == 1:
-            compare = get_compare()
-            mask = df[value[0]] <= compare if len(value) < 4 or value[3] == False else df[value[0]] < compare
-            
-        else:
-            compare = get_compare()
-            mask = df[value[0]] >= compare if len(value) < 4 or value[3] == False else df[value[0]] > compare
-        
-        df_check = create_new_cell_or_df()
-            
+    bitmask = SenseCheckRules(**kwargs).evaluate(df, use_eval)
+    mask = (bitmask != 0).any(axis=1)
+
+    # Cell name not being defined, it means the function must create a dataframe
     if new_cell_name is None:
+        # The rows are ordered by the first check they meet, then as in the dataframe
+        flagged_positions = np.flatnonzero(mask)
+        first_rules = np.zeros(len(flagged_positions), dtype='int64')
+
+        for word in range(bitmask.shape[1] - 1, -1, -1):
+            words = bitmask[flagged_positions, word]
+            lowest_bits = words & (~words + np.uint64(1))
+            first_rules = np.where(words != 0, word * 64 + np.log2(lowest_bits.astype('float64'), where=words != 0, out=np.zeros(len(words))).astype('int64'), first_rules)
+
+        df_check = df.iloc[flagged_positions[np.argsort(first_rules, kind='stable')]].drop_duplicates(keep='first')
         print('There are {} rows concerned'.format(df_check.shape[0]))
+
         return df_check
-    
\ No newline at end of file
+    else:
+        # The original df is modified with a new column that will have true/false value. The row is flagged true if it validates at least 1 check
+        df[new_cell_name] = df[new_cell_name] | mask if new_cell_name in df.columns else pd.Series(mask, index=df.index)
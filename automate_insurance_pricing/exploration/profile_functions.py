@@ -0,0 +1,252 @@
+import pandas as pd
+import numpy as np
+
+from automate_insurance_pricing.preprocessing.sketch_functions import *
+from automate_insurance_pricing.exploration.checks_functions import *
+
+
+class DataProfiler:
+    """
+        Profiles the data quality of all the columns in a single pass, the data being fed chunk by chunk (e.g. pd.read_csv with chunksize)   
+        For each column, it counts the missing values and estimates the number of unique values (see sketch_functions.DistinctCountSketch),   
+        for the numerical ones it also derives min, max, mean, standard deviation, quantiles and outliers counts (see sketch_functions.QuantileSketch)   
+        and for the dates min and max. The kinds of the columns are checked on each chunk and the values which are not numbers (or dates) are considered missing   
+        As in find_outliers, the missing values of the numerical columns are counted as outliers. The rows flagged by the sense check rules are counted as well (see checks_functions.SenseCheckRules)   
+        Profilers built by other workers on other parts of the data can be merged   
+        Arguments --> the columns to profile (all the columns of the first chunk if not specified), the quantiles to derive,   
+            the method to use to count the outliers (either interquartile or z-score), the z-score and the interquartile thresholds to use (see checks_functions.find_outliers),   
+            the sense check rules, a dictionnary like the perform_sense_check kwargs, the precision of the distinct count sketches,   
+            and the size of the compactors (bigger than the sketches default as the outliers counts depend on the accuracy of both the quantiles and the tails ranks) and the seed of the quantile sketches
+    """
+
+    def __init__(self, columns=None, quantiles=(0.25, 0.5, 0.75), method='interquartile', z_score_threshold=3, interquartile_lower_bound=0.25, interquartile_upper_bound=0.75, rules=None, precision=14, k=1000, random_state=42):
+
+        self.columns = [columns] if isinstance(columns, str) == True else columns
+        self.quantiles = list(quantiles)
+        self.method = method
+        self.z_score_threshold = z_score_threshold
+        self.interquartile_lower_bound, self.interquartile_upper_bound = interquartile_lower_bound, interquartile_upper_bound
+        self.rules = SenseCheckRules(**rules) if rules is not None else None
+        self.precision, self.k, self.random_state = precision, k, random_state
+
+        self.rows_count = 0
+        self.rules_violations = pd.Series(0, index=self.rules.rules_names if self.rules is not None else [], dtype='int64')
+        self.rows_violating_rules = 0
+
+
+    def update(self, chunk):
+        """
+            Adds a chunk of data to the profile   
+            Arguments --> the dataframe chunk   
+            Returns --> the profiler itself
+        """
+
+        if not hasattr(self, 'null_counts'):
+            self._initialize(chunk)
+
+        # A column can get a numerical or date dtype in a later chunk only (e.g. pd.read_csv gives object to a chunk with only missing values)
+        self._add_columns_kinds(chunk[self.columns].dtypes.to_dict())
+
+        self.rows_count += len(chunk)
+        self.null_counts += chunk[self.columns].isna().sum()
+
+        for column in self.columns:
+            self.distinct_sketches[column].update(chunk[column])
+
+        for column in self.numerical_columns:
+            values = pd.to_numeric(chunk[column], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+            values = values[~np.isnan(values)]
+            self.quantile_sketches[column].update(values)
+
+            # The mean and the variance are combined with the ones of the previous chunks (parallel algorithm of Chan et al.)
+            self._combine_moments(column, len(values), values.mean() if len(values) > 0 else 0, ((values - values.mean())**2).sum() if len(values) > 0 else 0)
+
+        for column in self.date_columns:
+            dates = chunk[column] if pd.api.types.is_datetime64_any_dtype(chunk[column].dtype) == True else pd.to_datetime(chunk[column], errors='coerce')
+            self.dates_min[column] = min(filter(pd.notna, (self.dates_min[column], dates.min())), default=pd.NaT)
+            self.dates_max[column] = max(filter(pd.notna, (self.dates_max[column], dates.max())), default=pd.NaT)
+
+        if self.rules is not None:
+            bitmask = self.rules.evaluate(chunk)
+            self.rules_violations += self.rules.flagged_rules(bitmask).sum().values
+            self.rows_violating_rules += int((bitmask != 0).any(axis=1).sum())
+
+        return self
+
+
+    def merge(self, other):
+        """
+            Merges another profiler (e.g. built by another worker on another part of the data) into this one   
+            Arguments --> the other profiler, built with the same arguments   
+            Returns --> the profiler itself
+        """
+
+        if not hasattr(self, 'null_counts'):
+            self._initialize(other)
+
+        self._add_columns_kinds({column: other.dtypes[column] for column in other.numerical_columns + other.date_columns})
+
+        self.rows_count += other.rows_count
+        self.null_counts += other.null_counts
+        self.rules_violations += other.rules_violations
+        self.rows_violating_rules += other.rows_violating_rules
+
+        for column in self.columns:
+            self.distinct_sketches[column].merge(other.distinct_sketches[column])
+
+        for column in self.numerical_columns:
+            if column in other.quantile_sketches:
+                self.quantile_sketches[column].merge(other.quantile_sketches[column])
+                self._combine_moments(column, *other.moments[column])
+
+        for column in self.date_columns:
+            if column not in other.dates_min:
+                continue
+
+            self.dates_min[column] = min(filter(pd.notna, (self.dates_min[column], other.dates_min[column])), default=pd.NaT)
+            self.dates_max[column] = max(filter(pd.notna, (self.dates_max[column], other.dates_max[column])), default=pd.NaT)
+
+        return self
+
+
+    def get_profile(self):
+        """
+            Builds the report of the data profiled so far   
+            Returns --> a DataProfile object
+        """
+
+        df_summary = pd.DataFrame(index=pd.Index(self.columns, name='feature'))
+        df_summary['dtype'] = pd.Series(self.dtypes)
+        df_summary['null_count'] = self.null_counts
+        df_summary['null_proportion'] = self.null_counts / self.rows_count if self.rows_count > 0 else np.nan
+        df_summary['number_of_uniques'] = pd.Series({column: self.distinct_sketches[column].count() for column in self.columns})
+
+        numerical_stats = {}
+
+        for column in self.numerical_columns:
+            sketch = self.quantile_sketches[column]
+            count, mean, squares_sum = self.moments[column]
+            column_stats = {'min': sketch.min_value if sketch.count > 0 else np.nan, 'max': sketch.max_value if sketch.count > 0 else np.nan, 'mean': mean if count > 0 else np.nan, 'std': np.sqrt(squares_sum / count) if count > 0 else np.nan}
+            column_stats.update({'{:g}%'.format(quantile * 100): value for quantile, value in zip(self.quantiles, np.atleast_1d(sketch.quantile(self.quantiles)))})
+
+            # As in find_outliers, the missing values are outliers and with the z-score method a missing value leaves all the rows without z-score
+            missing_count = self.rows_count - count
+
+            if self.method != 'interquartile' and missing_count > 0:
+                column_stats['outliers_count'] = self.rows_count
+            else:
+                lower_bound, upper_bound = self._get_outliers_bounds(column)
+                column_stats['outliers_count'] = missing_count + (sketch.rank(lower_bound) + sketch.count - sketch.rank(upper_bound, inclusive=True) if sketch.count > 0 else 0)
+            numerical_stats[column] = column_stats
+
+        for column in self.date_columns:
+            numerical_stats[column] = {'min': self.dates_min[column], 'max': self.dates_max[column]}
+
+        df_summary = df_summary.join(pd.DataFrame.from_dict(numerical_stats, orient='index'))
+
+        return DataProfile(self.rows_count, df_summary, self.rules_violations.copy(), self.rows_violating_rules)
+
+
+    def _initialize(self, chunk_or_profiler):
+        """ Defines the columns to profile and creates the sketches, from the first chunk or from another profiler"""
+
+        if isinstance(chunk_or_profiler, DataProfiler) == True:
+            self.columns = chunk_or_profiler.columns
+            self.dtypes = dict(chunk_or_profiler.dtypes)
+        else:
+            self.columns = chunk_or_profiler.columns.tolist() if self.columns is None else self.columns
+            self.dtypes = chunk_or_profiler[self.columns].dtypes.to_dict()
+
+        self.null_counts = pd.Series(0, index=self.columns, dtype='int64')
+        self.distinct_sketches = {column: DistinctCountSketch(self.precision) for column in self.columns}
+        self.numerical_columns, self.quantile_sketches, self.moments = [], {}, {}
+        self.date_columns, self.dates_min, self.dates_max = [], {}, {}
+
+
+    def _add_columns_kinds(self, dtypes):
+        """ Adds the columns having a numerical or a date dtype which are not profiled as such yet, with their sketches"""
+
+        for column, dtype in dtypes.items():
+            if column in self.numerical_columns or column in self.date_columns:
+                continue
+
+            if pd.api.types.is_numeric_dtype(dtype) == True and pd.api.types.is_bool_dtype(dtype) == False:
+                self.numerical_columns.append(column)
+                self.quantile_sketches[column] = QuantileSketch(self.k, self.random_state)
+                self.moments[column] = (0, 0.0, 0.0)
+                self.dtypes[column] = dtype
+
+            elif pd.api.types.is_datetime64_any_dtype(dtype) == True:
+                self.date_columns.append(column)
+                self.dates_min[column], self.dates_max[column] = pd.NaT, pd.NaT
+                self.dtypes[column] = dtype
+
+
+    def _combine_moments(self, column, count, mean, squares_sum):
+        """ Combines the count, mean and sum of squared deviations of a column with the ones of new values"""
+
+        previous_count, previous_mean, previous_squares_sum = self.moments[column]
+        total_count = previous_count + count
+
+        if total_count > 0:
+            delta = mean - previous_mean
+            self.moments[column] = (total_count, previous_mean + delta * count / total_count, previous_squares_sum + squares_sum + delta**2 * previous_count * count / total_count)
+
+
+    def _get_outliers_bounds(self, column):
+        """ Gets the values below and above which a value is an outlier, the same way find_outliers does"""
+
+        if self.method == 'interquartile':
+            quantile_25, quantile_75 = self.quantile_sketches[column].quantile([self.interquartile_lower_bound, self.interquartile_upper_bound])
+            interquartile_range = quantile_75 - quantile_25
+
+            return quantile_25 - 1.5 * interquartile_range, quantile_75 + 1.5 * interquartile_range
+
+        count, mean, squares_sum = self.moments[column]
+        standard_deviation = np.sqrt(squares_sum / count) if count > 0 else np.nan
+
+        return mean - self.z_score_threshold * standard_deviation, mean + self.z_score_threshold * standard_deviation
+
+
+
+class DataProfile:
+    """
+        Report produced by the data profiler   
+        Attributes --> the number of rows profiled, a dataframe with a row per column and the statistics as columns,   
+            a pandas serie with the number of rows flagged by each sense check rule and the number of rows flagged by at least one rule   
+        The numbers of unique values, the quantiles and the outliers counts are estimates, see sketch_functions for their accuracy
+    """
+
+    def __init__(self, rows_count, df_summary, rules_violations, rows_violating_rules):
+
+        self.rows_count = rows_count
+        self.df_summary = df_summary
+        self.rules_violations = rules_violations
+        self.rows_violating_rules = rows_violating_rules
+
+
+    def __repr__(self):
+
+        report = 'Data profile of {} rows\n\n{}'.format(self.rows_count, self.df_summary.to_string())
+
+        if len(self.rules_violations) > 0:
+            report += '\n\nSense checks: {} rows flagged by at least one rule\n{}'.format(self.rows_violating_rules, self.rules_violations.to_string())
+
+        return report
+
+
+
+def profile_data(chunks, columns=None, quantiles=(0.25, 0.5, 0.75), method='interquartile', z_score_threshold=3, interquartile_lower_bound=0.25, interquartile_upper_bound=0.75, rules=None, precision=14, k=1000, random_state=42):
+    """
+        Profiles the data quality of the columns while going through the data chunk by chunk (e.g. pd.read_csv with chunksize)   
+        Arguments --> the iterable of dataframes (or a single dataframe) and the profiler arguments (see DataProfiler)   
+        Returns --> a DataProfile object with the number of rows, the statistics per column and the sense check rules violations
+    """
+
+    chunks = [chunks] if isinstance(chunks, pd.DataFrame) == True else chunks
+    profiler = DataProfiler(columns, quantiles, method, z_score_threshold, interquartile_lower_bound, interquartile_upper_bound, rules, precision, k, random_state)
+
+    for chunk in chunks:
+        profiler.update(chunk)
+
+    return profiler.get_profile()
@@ -5,7 +5,9 @@ from sklearn.utils import resample
 from copy import deepcopy
 from datetime import date, timedelta, datetime
 from calendar import isleap
+from concurrent.futures import ProcessPoolExecutor
 import math
+import os
 import random
 
 from automate_insurance_pricing.standard_functions import *
@@ -65,6 +67,127 @@ def create_bins(df_portfolio, cut_func='pd.cut', column_to_use=None, df_claims=N
     
     return portfolio_new_column
 
+
+
+class FeatureBinner:
+    """
+        Bucketizes features values with bins found once on a dataframe (usually the portfolio) and stored per feature,   
+        so that the exact same bins can be applied to any number of other dataframes (claims, new quotes, etc.) without being derived again   
+        The object can be pickled to be reused at scoring time   
+        Arguments --> the function to split in bucket (pd.cut or pd.qcut), the number of bins we want and their names,   
+            a boolean indicating if the bins are inclusive on the right (pd.cut only, pd.qcut bins are always inclusive on the right)   
+            a duplicates params (either drop or raise) indicating what to do if non-unique bins are created   
+        If the bins labels are set to False, the buckets are their integer positions as with pd.cut, i.e. floats with NaN for the values out of the bins when there are some
+    """
+
+    def __init__(self, cut_func='pd.cut', bins=5, bins_labels=None, right=False, duplicates='raise'):
+
+        self.cut_func = cut_func
+        self.bins = bins
+        self.bins_labels = bins_labels
+        self.right = right if cut_func == 'pd.cut' else True
+        self.duplicates = duplicates
+        self.edges = {}
+        self.categories = {}
+
+
+    def fit(self, df, columns):
+        """
+            Finds the bins edges of each feature   
+            Arguments --> the dataframe and the features to bucketize (either a list or a string)   
+            Returns --> the binner itself
+        """
+
+        columns = [columns] if isinstance(columns, str) == True else columns
+
+        for column in columns:
+            if self.cut_func == 'pd.cut':
+                new_column, edges = pd.cut(df[column], self.bins, labels=self.bins_labels, right=self.right, duplicates=self.duplicates, retbins=True)
+            else:
+                new_column, edges = pd.qcut(df[column], self.bins, labels=self.bins_labels, duplicates=self.duplicates, retbins=True)
+
+            self.edges[column] = edges
+            # The categories are kept as produced by pandas, so that the buckets have the same names than with create_bins (without labels pandas gives the buckets positions)
+            self.categories[column] = new_column.cat.categories if self.bins_labels is not False else None
+
+        return self
+
+
+    def fit_sketches(self, sketches):
+        """
+            Finds the pd.qcut like bins edges of each feature from quantile sketches, so that the bins can be derived on data processed out-of-core   
+            Arguments --> a dictionnary with the features as keys and their quantile sketches as values (see sketch_functions.create_quantile_sketches)   
+            Returns --> the binner itself
+        """
+
+        for column, sketch in sketches.items():
+            quantiles = np.linspace(0, 1, self.bins + 1) if isinstance(self.bins, int) == True else self.bins
+            edges = np.asarray(sketch.quantile(quantiles), dtype='float64')
+
+            # Same checks as pd.qcut on the edges that are not unique
+            if len(np.unique(edges)) < len(edges):
+                if self.duplicates == 'raise':
+                    raise ValueError('Bin edges of {} must be unique: {}. You can drop duplicate edges by setting the duplicates argument to drop'.format(column, edges))
+                edges = np.unique(edges)
+
+            if isinstance(self.bins_labels, (list, tuple, np.ndarray, pd.Index)) == True and len(self.bins_labels) != len(edges) - 1:
+                raise ValueError('{} bins labels were given but {} bins remain for {} once the duplicate edges are dropped'.format(len(self.bins_labels), len(edges) - 1, column))
+
+            self.edges[column] = edges
+            # Cutting the edges themselves gives the same categories names as pd.qcut
+            self.categories[column] = pd.cut(edges, edges, labels=self.bins_labels, include_lowest=True).categories if self.bins_labels is not False else None
+
+        return self
+
+
+    def transform(self, df, columns=None):
+        """
+            Bucketizes the features values with the stored bins   
+            Arguments --> the dataframe and the features to bucketize (all the fitted features if not specified)   
+            Returns --> a dataframe with a categorical column of buckets for each feature
+        """
+
+        columns = list(self.edges.keys()) if columns is None else [columns] if isinstance(columns, str) == True else columns
+
+        return pd.DataFrame({column: self.transform_column(df[column], column) for column in columns}, index=df.index)
+
+
+    def transform_column(self, values, column):
+        """
+            Bucketizes the values of a single feature with a binary search over its stored bins   
+            Arguments --> the values (pandas serie or array) and the feature name they correspond to   
+            Returns --> the categorical buckets, as a pandas serie if a serie was given
+        """
+
+        edges = self.edges[column]
+        array = np.asarray(values, dtype='float64')
+
+        codes = np.searchsorted(edges, array, side='left' if self.right == True else 'right') - 1
+
+        # pd.qcut includes the lowest value in the first bucket
+        if self.cut_func == 'pd.qcut':
+            codes[array == edges[0]] = 0
+
+        codes[(codes < 0) | (codes >= len(edges) - 1) | np.isnan(array)] = -1
+
+        if self.categories[column] is None:
+            buckets = np.where(codes == -1, np.nan, codes) if (codes == -1).any() == True else codes
+        else:
+            buckets = pd.Categorical.from_codes(codes, categories=self.categories[column], ordered=True)
+
+        if isinstance(values, pd.Series) == True:
+            return pd.Series(buckets, index=values.index, name=values.name)
+
+        return buckets
+
+
+    def fit_transform(self, df, columns):
+        """ Finds the bins edges of each feature and bucketizes the dataframe with them"""
+
+        return self.fit(df, columns).transform(df)
+
+
+
 def derive_policy_totals(row, start_business_year, extraction_year, column_to_use):
     """
         Sums the earned amounts (premium, commission, etc.) in a same row   
@@ -82,34 +205,204 @@ def derive_policy_totals(row, start_business_year, extraction_year, column_to_us
 
 
 
-def derive_yearly_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier'):
+def derive_yearly_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier', long_format=False):
     """
         Derives the earned amounts (premium, commission, etc.) for each occurrence year   
         Arguments --> the dataframe row, the business start year, the data extraction date, the contract start and end columns names   
                     a flag indicating if the portfolio has a unique row for the full policy contract or a row per yearly amendment,   
                     a flag indicating if a day must be added to the end date to derive the dates differences,   
                     the columns names to use for premium and for the number of times premiums was paid   
-        Returns --> the modified dataframe with the amounts by occurrence year 
+                    a flag indicating if the amounts must be returned as a long table (see derive_yearly_amounts_long) instead of new columns per year   
+        Returns --> the modified dataframe with the amounts by occurrence year, or the long table if long_format is True 
     """
 
+    if long_format == True:
+        return derive_yearly_amounts_long(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, row_per_each_contract_year, add_one_day, written_premium_column_name, number_paid_premium_column_name)
+
     df_copy = deepcopy(df)
     extraction_year = extraction_date.year
+
+    # All the exposures are derived at once on the dates arrays, which is much faster than applying derive_annual_exposure row by row
+    df_exposures = derive_yearly_exposures(df_copy, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, add_one_day)
     
     if row_per_each_contract_year == True:
         for year in range(start_business_year, extraction_year + 1):
-            df_copy['exposure_in_{}'.format(year)] = df_copy.apply(lambda x: derive_annual_exposure(x, year, extraction_date, contract_start_date_column_name, contract_end_date, add_one_day), axis=1)
+            df_copy['exposure_in_{}'.format(year)] = df_exposures['exposure_in_{}'.format(year)]
             df_copy['asif_earned_premium_in_{}'.format(year)] = df_copy['exposure_in_{}'.format(year)] * df_copy[written_premium_column_name]
 
     else:
+        # Same for the written premiums that are split per year on the whole portfolio at once instead of using derive_yearly_amount row by row
+        df_written_premiums = derive_yearly_written_amounts(df_copy, start_business_year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name)
+
         for year in range(start_business_year, extraction_year + 1):
-            df_copy['exposure_in_{}'.format(year)] = df_copy.apply(lambda x: derive_annual_exposure(x, year, extraction_date, contract_start_date_column_name, contract_end_date, add_one_day), axis=1)
-            df_copy['asif_written_premium_in_{}'.format(year)] = df_copy.apply(lambda x: derive_yearly_amount(x, year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name), axis=1)
+            df_copy['exposure_in_{}'.format(year)] = df_exposures['exposure_in_{}'.format(year)]
+            df_copy['asif_written_premium_in_{}'.format(year)] = df_written_premiums['asif_written_premium_in_{}'.format(year)]
             df_copy['asif_earned_premium_in_{}'.format(year)] = df_copy['exposure_in_{}'.format(year)] * df_copy[written_premium_column_name] / df_copy[number_paid_premium_column_name]
 
     return df_copy
 
 
 
+def update_yearly_amounts(df_previous, start_business_year, previous_extraction_date, extraction_date, contract_start_date_column_name, contract_end_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier', actual_contract_length_column_name='actual_contract_length', df_new_business=None):
+    """
+        Updates the amounts by occurrence year of a portfolio already processed by derive_yearly_amounts when the extraction date moves forward   
+        Only the contracts still running at the previous extraction date can have new amounts, and only from the previous extraction year,   
+        so only these rows and years are derived again (plus the new business rows)   
+        The actual end dates of these contracts are capped again with the new extraction date (see derive_actual_contract_end_date) and, if the portfolio has a unique row per contract,   
+        their contract lengths (number of started years, see derive_years_from_two_dates) and written multipliers (see derive_premium_multiplier) are derived again, as well as all their years amounts   
+        Arguments --> the dataframe returned by derive_yearly_amounts at the previous extraction date, the business start year, the previous and new extraction dates,   
+            the contract start and (not capped) end columns names, the actual contract end date column name (i.e. capped by the extraction date),   
+            a flag indicating if the portfolio has a unique row for the full policy contract or a row per yearly amendment,   
+            a flag indicating if a day must be added to the end date to derive the dates differences, the columns names to use for premium and for the number of times premiums was paid,   
+            the contract length column name and the new contracts written since the previous extraction (without amounts by occurrence year)   
+        Returns --> the updated dataframe, same as the one derive_yearly_amounts would produce on the full portfolio with the new extraction date
+    """
+
+    new_df = df_previous.copy()
+    # With the additional day, the previous extraction date could also cap the exposure of the year before when it is a January 1
+    first_year = (previous_extraction_date - timedelta(days=1) * add_one_day).year
+    first_year = max(start_business_year, first_year)
+    years = range(first_year, extraction_date.year + 1)
+    amounts_names = ['exposure_in_{}', 'asif_earned_premium_in_{}'] if row_per_each_contract_year == True else ['exposure_in_{}', 'asif_written_premium_in_{}', 'asif_earned_premium_in_{}']
+    earned_premium_factors = new_df[written_premium_column_name] if row_per_each_contract_year == True else new_df[written_premium_column_name] / new_df[number_paid_premium_column_name]
+
+    # Contracts that ended before the previous extraction date have no exposure in the new years
+    for year in range(previous_extraction_date.year + 1, extraction_date.year + 1):
+        for amount_name in amounts_names:
+            new_df[amount_name.format(year)] = 0.0 if 'earned' not in amount_name else new_df['exposure_in_{}'.format(year)] * earned_premium_factors
+
+    # The actual end dates are capped by the previous extraction date, so the contracts still running are found with their original end dates
+    end_dates = to_datetime64(new_df[contract_end_date_column_name])
+    positions = np.flatnonzero(~(end_dates <= to_datetime64(previous_extraction_date)))
+
+    if len(positions) > 0:
+        df_in_force = new_df.iloc[positions].copy()
+        updated_columns = []
+
+        if contract_end_date != contract_end_date_column_name:
+            df_in_force[contract_end_date] = derive_actual_contract_end_date(df_in_force, contract_end_date_column_name, extraction_date)
+            updated_columns.append(contract_end_date)
+
+        if actual_contract_length_column_name in df_in_force.columns:
+            df_in_force[actual_contract_length_column_name] = np.ceil(derive_years_from_two_dates(df_in_force, contract_start_date_column_name, contract_end_date_column_name, extraction_date=extraction_date))
+            updated_columns.append(actual_contract_length_column_name)
+
+        # The number of premiums paid depends on the contract length, so it changes all the years written and earned premiums
+        if row_per_each_contract_year == False:
+            df_in_force[number_paid_premium_column_name] = derive_premium_multiplier(df_in_force, contract_start_date_column_name, row_per_each_contract_year, actual_contract_length_column_name, contract_end_date)
+            updated_columns.append(number_paid_premium_column_name)
+            years = range(start_business_year, extraction_date.year + 1)
+
+        df_in_force = derive_yearly_amounts(df_in_force, years[0], extraction_date, contract_start_date_column_name, contract_end_date, row_per_each_contract_year, add_one_day, written_premium_column_name, number_paid_premium_column_name)
+        updated_columns += [amount_name.format(year) for year in years for amount_name in amounts_names]
+
+        for column in updated_columns:
+            values = new_df[column].to_numpy(dtype='float64' if '_in_' in column else None, copy=True)
+            values[positions] = df_in_force[column].to_numpy()
+            new_df[column] = values
+
+    if df_new_business is not None and df_new_business.shape[0] > 0:
+        df_new_business = derive_yearly_amounts(df_new_business, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, row_per_each_contract_year, add_one_day, written_premium_column_name, number_paid_premium_column_name)
+        new_df = pd.concat([new_df, df_new_business])
+
+    return new_df
+
+
+
+def derive_yearly_amounts_long(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier', year_column_name='occurrence_year'):
+    """
+        Derives the amounts by occurrence year as a long table, with one row per policy row and year having some exposure or written premium   
+        Most policies are only exposed a few years, so this table is much smaller than the exposure_in_{year} / asif_earned_premium_in_{year} columns added by derive_yearly_amounts   
+        Arguments --> the dataframe, the business start year, the data extraction date, the contract start and end columns names   
+            a flag indicating if the portfolio has a unique row for the full policy contract or a row per yearly amendment,   
+            a flag indicating if a day must be added to the end date to derive the dates differences,   
+            the columns names to use for premium and for the number of times premiums was paid, and the name of the year column to create   
+        Returns --> a dataframe with the policy_row (position of the row in the original dataframe) and year keys, the exposure, the asif earned premium   
+            and the asif written premium if the portfolio has a unique row per contract
+    """
+
+    # The amounts are derived one year at a time and only the rows with amounts are kept, so the wide policies x years amounts are never built
+    yearly_exposures = iterate_yearly_exposures(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, add_one_day)
+    written_premiums = df[written_premium_column_name].values
+
+    if row_per_each_contract_year == False:
+        yearly_written_amounts = iterate_yearly_written_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name)
+        written_premiums = (df[written_premium_column_name] / df[number_paid_premium_column_name]).values
+
+    yearly_tables = []
+
+    for year, exposures in yearly_exposures:
+        mask = exposures > 0
+
+        if row_per_each_contract_year == False:
+            yearly_written_premiums = next(yearly_written_amounts)[1]
+            mask = mask | (yearly_written_premiums != 0)
+
+        positions = np.flatnonzero(mask)
+        yearly_table = {'policy_row': positions.astype('int32'), year_column_name: np.full(len(positions), year, dtype='int16'), 'exposure': exposures[positions], 'asif_earned_premium': exposures[positions] * written_premiums[positions]}
+
+        if row_per_each_contract_year == False:
+            yearly_table['asif_written_premium'] = yearly_written_premiums[positions]
+
+        yearly_tables.append(pd.DataFrame(yearly_table))
+
+    return pd.concat(yearly_tables, ignore_index=True)
+
+
+
+def derive_yearly_amounts_by_chunks(chunks, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier', long_format=False, inflation_rate=None, columns_to_inflate=None, latest_premium=True, dates_format='%d/%m/%Y'):
+    """
+        Derives the as-if amounts and the amounts by occurrence year on a portfolio read by chunks (e.g. pd.read_csv with chunksize), so that only one chunk is in memory at a time   
+        Arguments --> the iterable of portfolio dataframes, the business start year, the data extraction date, the contract start and end columns names   
+            a flag indicating if the portfolio has a unique row for the full policy contract or a row per yearly amendment,   
+            a flag indicating if a day must be added to the end date to derive the dates differences,   
+            the columns names to use for premium and for the number of times premiums was paid   
+            a flag indicating if the amounts must be returned as a long table (the policy_row key then refers to the position in the whole portfolio),   
+            the average inflation rate and a dictionnary with the new columns names as keys and the columns to inflate as values, e.g. {'asif_written_premium_excl_taxes': 'written_premium_excl_taxes'},   
+            if the premiums are the latest one or at inception (see inflate_amounts),   
+            and the format of the contract dates when the chunks have them as strings (see check_create_datetimes)   
+        Returns --> a generator of processed chunks
+    """
+
+    # Each chunk is inflated then split by occurrence year, the rows offset keeps the long table positions consistent over the whole portfolio
+    rows_offset = 0
+
+    for chunk in chunks:
+        # Readers such as pd.read_csv give the dates as strings, so the contract dates are converted in each chunk
+        chunk = check_create_datetimes([chunk], [contract_start_date_column_name, contract_end_date], format=dates_format)[0]
+
+        if inflation_rate is not None:
+            chunk = chunk.assign(**{new_column: inflate_amounts(chunk, extraction_date.year, contract_start_date_column_name, inflation_rate, row_per_each_contract_year=row_per_each_contract_year, latest_premium=latest_premium, number_paid_premium_column_name=number_paid_premium_column_name, column_to_use=column) for new_column, column in columns_to_inflate.items()})
+
+        processed_chunk = derive_yearly_amounts(chunk, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, row_per_each_contract_year, add_one_day, written_premium_column_name, number_paid_premium_column_name, long_format)
+
+        if long_format == True:
+            processed_chunk['policy_row'] += rows_offset
+
+        rows_offset += chunk.shape[0]
+
+        yield processed_chunk
+
+
+
+def write_yearly_amounts_by_chunks(chunks, output_file_path, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', row_per_each_contract_year=True, add_one_day=False, written_premium_column_name='asif_written_premium_excl_taxes', number_paid_premium_column_name='written_multiplier', long_format=False, inflation_rate=None, columns_to_inflate=None, latest_premium=True, dates_format='%d/%m/%Y'):
+    """
+        Derives the amounts on a portfolio read by chunks as derive_yearly_amounts_by_chunks does and appends each processed chunk to a csv file   
+        Arguments --> the iterable of portfolio dataframes, the csv file path to write to and the derive_yearly_amounts_by_chunks arguments   
+        Returns --> the number of rows written
+    """
+
+    processed_chunks = derive_yearly_amounts_by_chunks(chunks, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, row_per_each_contract_year, add_one_day, written_premium_column_name, number_paid_premium_column_name, long_format, inflation_rate, columns_to_inflate, latest_premium, dates_format)
+    number_of_rows = 0
+
+    for index, processed_chunk in enumerate(processed_chunks):
+        processed_chunk.to_csv(output_file_path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+        number_of_rows += processed_chunk.shape[0]
+
+    return number_of_rows
+
+
+
 # Function that must be re-worked, not time efficient so far
 # def derive_yearly_amounts(row, start_business_year, extraction_year, contract_start_date_column_name, incl_gwp_per_year=False, inflation_rate=None):
 #     """
@@ -162,6 +455,48 @@ def derive_yearly_amount(row, year, extraction_date, contract_start_date_column_
 
 
 
+def derive_yearly_written_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name):
+    """
+        Derives the written premium per year for all the occurrence years in one go if the data has a single row per contract    
+        Each condition of derive_yearly_amount is evaluated as a mask over the whole portfolio, so the results are the same as applying it row by row   
+        Arguments --> the dataframe, the business start year, the extraction date   
+            the contract start date, the written premium column name on which we perform calculations, the contract end date    
+            the number of yearly payments (i.e. the number of contract years an insured started, even if he didn't make it till the end)   
+        Returns --> a dataframe with a column asif_written_premium_in_{year} per occurrence year, indexed as the original dataframe
+    """
+
+    written_amounts = {'asif_written_premium_in_{}'.format(year): amounts for year, amounts in iterate_yearly_written_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name)}
+
+    return pd.DataFrame(written_amounts, index=df.index)
+
+
+
+def iterate_yearly_written_amounts(df, start_business_year, extraction_date, contract_start_date_column_name, written_premium_column_name, contract_end_date, number_paid_premium_column_name):
+    """
+        Derives the written premium per year one occurrence year at a time, so that only one year of amounts is in memory (see derive_yearly_written_amounts)   
+        Arguments --> same as derive_yearly_written_amounts   
+        Returns --> a generator of (year, array of written premiums in the year) tuples
+    """
+
+    multipliers = df[number_paid_premium_column_name].values
+    written_premiums = df[written_premium_column_name].values
+    start_dates, end_dates = to_datetime64(df[contract_start_date_column_name]), to_datetime64(df[contract_end_date])
+    start_years, end_years = pd.DatetimeIndex(start_dates).year.values, pd.DatetimeIndex(end_dates).year.values
+
+    amounts = np.zeros(len(df))
+    np.divide(written_premiums, multipliers, out=amounts, where=multipliers > 0)
+
+    # The anniversary conditions only matter in the contract end year, so they are derived once for each row
+    last_paid_anniversaries = add_years_to_dates(start_dates, multipliers - 1)
+    next_anniversaries = add_years_to_dates(start_dates, multipliers)
+    nil_in_end_year = np.where(end_years < start_years + multipliers, end_dates <= last_paid_anniversaries, (end_dates <= next_anniversaries) | (to_datetime64(extraction_date) < next_anniversaries))
+
+    for year in range(start_business_year, extraction_date.year + 1):
+        nil_amount = (year < start_years) | (year > end_years) | ((year == end_years) & nil_in_end_year)
+        yield year, np.where(nil_amount, 0, amounts)
+
+
+
 # def derive_yearly_written_premium(row, year, extraction_year):
 
 #     multiplier = 1
@@ -209,6 +544,42 @@ def derive_annual_exposure(row, year, extraction_date, contract_start_date_colum
 
 
 
+def derive_yearly_exposures(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', add_one_day=False):
+    """
+        Derives the annual exposures for all the occurrence years in one go, working on the contract dates arrays instead of row by row   
+        Gives the same results as derive_annual_exposure applied on each row and each year   
+        Arguments --> the dataframe, the business start year, the data extraction date, the contract start and end columns names   
+            a flag indicating if a day must be added to the end date to derive the dates differences   
+        Returns --> a dataframe with a column exposure_in_{year} per occurrence year, indexed as the original dataframe
+    """
+
+    exposures = {'exposure_in_{}'.format(year): year_exposures for year, year_exposures in iterate_yearly_exposures(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date, add_one_day)}
+
+    return pd.DataFrame(exposures, index=df.index)
+
+
+
+def iterate_yearly_exposures(df, start_business_year, extraction_date, contract_start_date_column_name, contract_end_date='actual_contract_end_date', add_one_day=False):
+    """
+        Derives the annual exposures one occurrence year at a time, so that only one year of exposures is in memory (see derive_yearly_exposures)   
+        Arguments --> same as derive_yearly_exposures   
+        Returns --> a generator of (year, array of exposures in the year) tuples
+    """
+
+    effective_dates = to_datetime64(df[contract_start_date_column_name])
+    # The extraction date caps the contract end date whatever the year, so this minimum is derived only once
+    # fmin / fmax ignore the missing dates as python min / max do in derive_annual_exposure, e.g. a contract without end date runs up to the extraction date
+    end_dates = np.fmin(to_datetime64(df[contract_end_date]), to_datetime64(extraction_date))
+    one_day = np.timedelta64(1, 'D')
+
+    for year in range(start_business_year, extraction_date.year + 1):
+        start_dates = np.fmax(to_datetime64(datetime(year, 1, 1)), effective_dates)
+        year_end_dates = np.minimum(end_dates, to_datetime64(datetime(year + 1, 1, 1)) + one_day * add_one_day)
+        total_days = 366 if isleap(year) == True else 365
+        yield year, np.maximum(0, days_between(start_dates, year_end_dates) / total_days)
+
+
+
 def inflate_amounts(df, extraction_year, contract_start_date_column_name, inflation_rate, portfolio=True, row_per_each_contract_year=True, latest_premium=True, number_paid_premium_column_name='written_multiplier', occurrence_date_column_name='occurrence_date', column_to_use='written_premium_excl_taxes', only_positive=None):
     """
         Derives as-if amounts due to inflation rate   
@@ -253,20 +624,20 @@ def derive_premium_multiplier(df, contract_start_date_column_name, row_per_each_
         Returns --> The total premium depending on the contract length
     """ 
 
-    def derive_length(row):
-        """ Calculate the length of the contract """
+    def derive_length():
+        """ Calculate the length of the contracts on the whole dataframe at once """
 
-        contract_length = row[actual_contract_length_column_name]
+        contract_lengths = df[actual_contract_length_column_name].values
+        start_dates, end_dates = to_datetime64(df[contract_start_date_column_name]), to_datetime64(df[actual_contract_end_date_column_name])
 
-        derived_end = addYears(row[contract_start_date_column_name], contract_length - 1)
+        derived_ends = add_years_to_dates(start_dates, contract_lengths - 1)
+        lengths = np.where(derived_ends < end_dates, contract_lengths, np.maximum(1, contract_lengths - 1))
+        lengths = np.where((contract_lengths == 0) | (end_dates == start_dates), 0, lengths)
 
-        if contract_length == 0 or row[actual_contract_end_date_column_name] == row[contract_start_date_column_name]:
-            return 0
-        else:
-            return contract_length if derived_end < row[actual_contract_end_date_column_name] else max(1, contract_length - 1) 
+        return pd.Series(lengths, index=df.index)
 
     if row_per_each_contract_year == False and annual_premium == True:
-        multipliers = df.apply(lambda x: derive_length(x), axis=1)
+        multipliers = derive_length()
     else:
         multipliers = [1 for row in df.index]
         
@@ -344,7 +715,57 @@ def check_create_datetime(df, column, format='%d/%m/%Y'):
         check = df[column].dt.year
         return df[column]
     except:
-        return df[column].apply(pd.to_datetime, format=format)
+        return parse_dates(df[column], format=format)
+
+
+
+def parse_dates(values, format='%d/%m/%Y'):
+    """
+        Converts dates stored as strings into datetimes, parsing each distinct string only once (extracts usually have few distinct dates compared to their number of rows)   
+        Arguments --> the pandas serie to convert and the date format   
+        Returns --> the pandas serie in a datetime format
+    """
+
+    codes, unique_values = pd.factorize(values)
+    unique_dates = pd.to_datetime(unique_values, format=format)
+
+    return _take_dates(unique_dates, codes, values)
+
+
+
+def check_create_datetimes(dfs, columns, format='%d/%m/%Y'):
+    """
+        Checks and converts several dates columns of several dataframes at once (e.g. the portfolio and the claims dates),   
+        the distinct strings of all the columns being parsed together only once   
+        Arguments --> the list of dataframes, the list of columns to check (each column is converted in the dataframes that have it), and the date format of these columns   
+        Returns --> a list of new dataframes with the columns in a datetime format
+    """
+
+    columns = [columns] if isinstance(columns, str) == True else columns
+    columns_to_parse = [(index, column) for index, df in enumerate(dfs) for column in columns if column in df.columns and pd.api.types.is_datetime64_any_dtype(df[column]) == False]
+
+    # Every column is encoded against the same set of distinct strings, which is then parsed in one go
+    unique_values = pd.unique(np.concatenate([dfs[index][column].dropna().unique().astype('object') for index, column in columns_to_parse] + [np.empty(0, dtype='object')]))
+    unique_dates = pd.to_datetime(unique_values, format=format)
+    unique_index = pd.Index(unique_values)
+
+    new_columns = [{} for df in dfs]
+
+    for index, column in columns_to_parse:
+        values = dfs[index][column]
+        new_columns[index][column] = _take_dates(unique_dates, unique_index.get_indexer(values), values)
+
+    return [df.assign(**new_columns[index]) if len(new_columns[index]) > 0 else df for index, df in enumerate(dfs)]
+
+
+
+def _take_dates(unique_dates, codes, values):
+    """ Builds the datetime serie from the parsed distinct dates and the position of each value in them (-1 for missing values)"""
+
+    # NaT is appended last so that the -1 codes of missing values take it, even when there is no distinct date at all
+    dates = np.append(unique_dates.values.astype('datetime64[ns]'), np.datetime64('NaT', 'ns'))[codes]
+
+    return pd.Series(dates, index=values.index, name=values.name)
 
 
 
@@ -356,9 +777,65 @@ def derive_years_from_two_dates(df, start_date, end_date, year_number_of_days=36
         Returns --> difference in days between the two dates
     """
 
-    if extraction_date is not None: 
-        contract_length = df.apply(lambda x: (min(extraction_date, x[end_date]) + timedelta(1) - x[start_date]).days / year_number_of_days, axis=1)
+    end_dates = to_datetime64(derive_actual_contract_end_date(df, end_date, extraction_date))
+    contract_length = days_between(to_datetime64(df[start_date]), end_dates + np.timedelta64(1, 'D')) / year_number_of_days
+
+    return pd.Series(contract_length, index=df.index)
+
+
+
+def derive_actual_contract_end_date(df, end_date, extraction_date=None):
+    """
+        Derives the date up to which the contracts have actually run, i.e. their end date capped by the extraction date   
+        Arguments --> the dataframe, the contract end date column name and the extraction date   
+        Returns --> the actual contract end dates
+    """
+
+    if extraction_date is None:
+        return df[end_date]
+
+    # As python min does, fmin ignores the missing end dates, so the contracts without end date run up to the extraction date
+    return pd.Series(np.fmin(to_datetime64(df[end_date]), to_datetime64(extraction_date)), index=df.index, name=df[end_date].name)
+
+
+
+def run_steps_in_parallel(df, steps, n_jobs=None, policy_id_column_name='policy_id'):
+    """
+        Runs a chain of preparation steps (e.g. derive_years_from_two_dates, derive_premium_multiplier, derive_yearly_amounts, inflate_amounts) on several cores   
+        The portfolio is split by hashing the policy ids, so all the rows of a policy are processed together and the split is the same from one run to another   
+        Arguments --> the portfolio dataframe, the list of steps to run in order, each step being a tuple (function, dictionnary of keyword arguments, column name)   
+            the function is called with the dataframe as first argument, its output is stored in the column name or, if the column name is None, replaces the dataframe   
+            (the steps must keep one row per portfolio row, i.e. derive_yearly_amounts cannot be used with long_format set to True)   
+            the number of processes to use (all the cores if not specified) and the policy id column name   
+        Returns --> the prepared dataframe, with the rows in the same order as the original one
+    """
+
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    partitions = pd.util.hash_pandas_object(df[policy_id_column_name], index=False).values % n_jobs
+    partitions_positions = [np.flatnonzero(partitions == partition) for partition in range(n_jobs)]
+    partitions_positions = [positions for positions in partitions_positions if len(positions) > 0]
+    df_partitions = [df.iloc[positions] for positions in partitions_positions]
+
+    if n_jobs == 1:
+        results = [_run_steps(df_partition, steps) for df_partition in df_partitions]
     else:
-        contract_length = df.apply(lambda x: (x[end_date] + timedelta(1) - x[start_date]).days / year_number_of_days, axis=1)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_run_steps, df_partitions, [steps] * len(df_partitions)))
+
+    # Puts back the rows in their original order
+    original_order = np.argsort(np.concatenate(partitions_positions), kind='stable')
+
+    return pd.concat(results).iloc[original_order]
+
+
+
+def _run_steps(df, steps):
+    """ Runs the preparation steps on a portfolio partition, see run_steps_in_parallel"""
+
+    for function, kwargs, column_name in steps:
+        if column_name is None:
+            df = function(df, **kwargs)
+        else:
+            df = df.assign(**{column_name: function(df, **kwargs)})
 
-    return contract_length
+    return df
@@ -1,4 +1,9 @@
 import pandas as pd
+import numpy as np
+
+from scipy import sparse
+
+from automate_insurance_pricing.preprocessing.sketch_functions import *
 
 
 def derive_termination_rate_year(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name):
@@ -8,41 +13,98 @@ def derive_termination_rate_year(df, start_business_year, extraction_year, main_
         Returns --> a dictionnary with the termination rates per year and the overall one
     """
 
-    df_previous_year = df[df[main_column_contract_date].dt.year == start_business_year].drop_duplicates(subset=policy_id_column_name, keep='first')
-    policies_previous_year = df_previous_year[policy_id_column_name]
-    termination_rates = {}
-    gwp_year = df_previous_year[column_to_sum_name].sum()
-    total_gwp = gwp_year
-    weighted_rates = 0
+    presence, amounts, policies = build_presence_matrix(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name)
+
+    # A policy is retained from one year to the next if it is present in both years
+    policies_per_year = np.asarray(presence.sum(axis=0)).ravel()
+    policies_retained = np.asarray(presence[:, :-1].multiply(presence[:, 1:]).sum(axis=0)).ravel()
+    gwp_per_year = np.asarray(amounts.sum(axis=0)).ravel()
+
+    termination_rates_values = (policies_per_year[:-1] - policies_retained) / policies_per_year[:-1]
+    termination_rates = {year: termination_rate for year, termination_rate in zip(range(start_business_year, extraction_year), termination_rates_values)}
+    termination_rates['weighted_average'] = (termination_rates_values * gwp_per_year[:-1]).sum() / gwp_per_year.sum()
+
+    return termination_rates
 
-    for year in range(start_business_year+1, extraction_year+1):
 
-        df_next_year = df[df[main_column_contract_date].dt.year == year].drop_duplicates(subset=policy_id_column_name, keep='first')
-        policies_next_year = df_next_year[policy_id_column_name]
 
-        policies_from_previous_year = df_next_year[df_next_year[policy_id_column_name].isin(policies_previous_year)]
+def build_presence_matrix(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name=None):
+    """
+        Builds the policies x years matrix indicating in which years each policy has a contract, in one pass over the data   
+        Arguments --> the dataframe, the business starting year, the extraction year   
+            the contracts start date and policy ids columns names and the column with the amounts to sum (e.g. the written premium)   
+        The rows without policy id are ignored   
+        Returns --> the boolean sparse matrix with a row per policy and a column per year, a sparse matrix with the amount of the first contract of each policy and year (if the amounts column is given)   
+            and the policies ids corresponding to the rows
+    """
 
-        termination_rate = (len(policies_previous_year) - len(policies_from_previous_year)) / len(policies_previous_year)
-        termination_rates[year-1] = termination_rate
+    years = df[main_column_contract_date].dt.year.values
+    # The rows without policy id cannot be linked to any policy, so they are left out
+    in_period = (years >= start_business_year) & (years <= extraction_year) & df[policy_id_column_name].notna().values
+    df_policy_years = pd.DataFrame({'policy': df[policy_id_column_name].values[in_period], 'year': years[in_period] - start_business_year})
 
-        weighted_rates += termination_rate * gwp_year
-        gwp_year = df_next_year[column_to_sum_name].sum()
-        total_gwp += gwp_year
+    if column_to_sum_name is not None:
+        df_policy_years['amount'] = df[column_to_sum_name].values[in_period]
 
-        policies_previous_year = policies_next_year
+    # Only the first contract of a policy in a year is taken into account, as a policy is counted once per year
+    df_policy_years = df_policy_years.drop_duplicates(subset=['policy', 'year'], keep='first')
+    codes, policies = pd.factorize(df_policy_years['policy'])
+    shape = (len(policies), extraction_year - start_business_year + 1)
 
-    termination_rates['weighted_average'] = weighted_rates / total_gwp
+    presence = sparse.csr_matrix((np.ones(len(codes), dtype='bool'), (codes, df_policy_years['year'].values)), shape=shape)
+    amounts = sparse.csr_matrix((df_policy_years['amount'].values.astype('float64'), (codes, df_policy_years['year'].values)), shape=shape) if column_to_sum_name is not None else None
 
-    return termination_rates
+    return presence, amounts, policies
 
 
 
-def create_df_unique_values(df, features):
+def derive_retention_cohorts(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name):
+    """
+        Derives the retention curves of each cohort of policies (the policies that joined the portfolio the same year)   
+        Arguments --> the dataframe, the business starting year, the extraction year   
+            the contracts start date and policy ids columns names and the column with the amounts to weight the cohorts (e.g. the written premium)   
+        Returns --> a dataframe with the cohorts years as index and the number of years since joining as columns, giving the proportion of the cohort policies still in the portfolio   
+            and a pandas serie with the average retention per number of years since joining, weighted by the cohorts amounts in their first year
+    """
+
+    presence, amounts, policies = build_presence_matrix(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name)
+    number_years = presence.shape[1]
+
+    policy_rows, policy_years = presence.nonzero()
+    first_years = np.full(presence.shape[0], number_years)
+    np.minimum.at(first_years, policy_rows, policy_years)
+
+    # Counts the policies of each cohort present after each number of years
+    cohort_counts = np.bincount(first_years[policy_rows] * number_years + policy_years - first_years[policy_rows], minlength=number_years**2).reshape(number_years, number_years).astype('float64')
+    cohort_amounts = np.bincount(first_years, np.asarray(amounts[np.arange(presence.shape[0]), first_years]).ravel(), minlength=number_years)
+
+    # A cohort cannot be observed beyond the extraction year
+    observed = np.add.outer(np.arange(number_years), np.arange(number_years)) < number_years
+    retention = np.where(observed, cohort_counts / cohort_counts[:, [0]], np.nan)
+
+    df_retention = pd.DataFrame(retention, index=pd.Index(range(start_business_year, extraction_year + 1), name='cohort'), columns=pd.Index(range(number_years), name='years_since_joining'))
+    weights = np.where(observed & (cohort_counts[:, [0]] > 0), cohort_amounts[:, np.newaxis], 0)
+    weighted_retention = pd.Series((np.nan_to_num(retention) * weights).sum(axis=0) / weights.sum(axis=0), index=df_retention.columns, name='weighted_average')
+
+    return df_retention, weighted_retention
+
+
+
+def create_df_unique_values(df, features, approximate=False, precision=14):
     """
         Gets the unique values of features and the number of these unique values (mainly useful for categorical feature)   
-        Arguments --> the dataframe and the list of features (either a list or a string)
+        Arguments --> the dataframe and the list of features (either a list or a string)   
+            a boolean indicating if the numbers of unique values are estimated with distinct count sketches (see sketch_functions.DistinctCountSketch),   
+            in which case the dataframe can also be an iterable of dataframes (e.g. pd.read_csv with chunksize), and the precision of the sketches
         Returns --> A new df with features and number of unique values for each
     """
 
-    df_feature_unique_values = pd.DataFrame.from_dict({'feature': features, 'number_of_uniques': df[features].nunique().values})
+    if approximate == True:
+        features = [features] if isinstance(features, str) == True else features
+        sketches = create_distinct_count_sketches(df, features, precision)
+        number_of_uniques = [sketches[feature].count() for feature in features]
+    else:
+        number_of_uniques = df[features].nunique().values
+
+    df_feature_unique_values = pd.DataFrame.from_dict({'feature': features, 'number_of_uniques': number_of_uniques})
     return df_feature_unique_values.reset_index()
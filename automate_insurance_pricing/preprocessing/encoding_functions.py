@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from scipy import sparse
+
 from copy import deepcopy
 from datetime import date, timedelta, datetime
 
@@ -21,13 +23,31 @@ def min_max_scale(df, features, min_max_scaler):
     return new_df, min_max_scaler
 
 
-def hot_encode(df, features, features_hot_encoded, encoder):
+def hot_encode(df, features, features_hot_encoded, encoder, sparse_output=False):
     """
         Hot encodes the features   
         Arguments --> the dataframe, the features to encode, the names to give to the new features encoded and the encoder   
-        Returns --> A new df with features hot encoded
+            a boolean indicating if the encoded columns must be kept as a scipy sparse matrix instead of being added to the df (for features with many values)   
+        Returns --> A new df with features hot encoded, or if sparse_output is True, a new df without the features, the encoder   
+            and a tuple with the sparse matrix, the names of its columns and a dictionnary with the column dropped for each feature
     """
 
+    if sparse_output == True:
+        encoder.fit(df[features].astype('str'))
+        blocks = []
+
+        # The encoded columns are built directly in the sparse format from the values codes (sorted values as the encoder does), so the dense encoding is never created
+        for feature in features:
+            codes, values = pd.factorize(df[feature].astype('str'), sort=True)
+            blocks.append(sparse.csr_matrix((np.ones(df.shape[0]), (np.arange(df.shape[0]), codes)), shape=(df.shape[0], len(values))))
+
+        data_encoded = sparse.hstack(blocks, format='csr')
+        # Drops the first value of each encoded feature as it can be directly infered from the other values
+        cols_to_remove = {feature: feature + '_' + str(df[feature].unique()[0]) for feature in features}
+        columns_to_keep = [index for index, column in enumerate(features_hot_encoded) if column not in cols_to_remove.values()]
+
+        return df.drop(columns=features), encoder, (data_encoded[:, columns_to_keep], [features_hot_encoded[index] for index in columns_to_keep], cols_to_remove)
+
     data_encoded = pd.DataFrame(encoder.fit_transform(df[features].astype('str')), columns=features_hot_encoded)
 
     new_df = pd.concat([df, data_encoded], axis=1, join='inner').reindex()
@@ -42,6 +62,102 @@ def hot_encode(df, features, features_hot_encoded, encoder):
     return new_df, encoder
 
 
+def hash_encode(df, features, n_features=2**18, alternate_sign=False, categorize=True):
+    """
+        Encodes the features with the hashing trick: each feature value is hashed directly to a column of a fixed-width sparse matrix   
+        No vocabulary is learnt, so new values (new vehicle models, broker codes, etc.) are encoded the same way at training and at scoring time   
+        Arguments --> the dataframe, the features to encode (either a list or a string), the number of columns of the matrix,   
+            a boolean indicating if the values are set to -1 or 1 depending on the hash, so that collisions tend to cancel out instead of adding up   
+            and a boolean indicating if each distinct value is hashed only once (faster when the values repeat, see pd.util.hash_array), the encoding being the same either way   
+        Returns --> a sparse matrix with one non zero value per feature on each row
+    """
+
+    features = [features] if isinstance(features, str) == True else features
+    rows = np.tile(np.arange(df.shape[0]), len(features))
+    hashes = []
+
+    for feature in features:
+        # The feature name is mixed in the hash so that a same value in two features does not go to the same column
+        feature_hash = pd.util.hash_array(np.array([feature], dtype='object'))[0]
+        hashes.append(pd.util.hash_array(df[feature].astype('str').values.astype('object'), categorize=categorize) ^ feature_hash)
+
+    hashes = np.concatenate(hashes) if len(hashes) > 0 else np.empty(0, dtype='uint64')
+    columns = (hashes % np.uint64(n_features)).astype('int64')
+    values = 1 - 2 * (hashes >> np.uint64(63)).astype('float64') if alternate_sign == True else np.ones(len(hashes))
+
+    # Duplicated coordinates (collisions on a same row) are summed when converting to the compressed format
+    return sparse.coo_matrix((values, (rows, columns)), shape=(df.shape[0], n_features)).tocsr()
+
+
+def target_encode(df, features, target_column, weight_column=None, n_splits=5, smoothing=10, random_state=42):
+    """
+        Encodes the features with the weighted mean of the target per feature value (e.g. claims count over exposure for a frequency, cost over claims count for a severity)   
+        To avoid leaking the target, each row is encoded with the means derived on the other folds (out-of-fold encoding)   
+        The means are shrunk towards the overall mean, the less weight a value has the more it is shrunk   
+        Arguments --> the dataframe, the features to encode (either a list or a string), the target column and the weight column (each row weighs 1 if not specified),   
+            the number of folds, the smoothing weight given to the overall mean and the seed used to split the folds   
+        Returns --> a new df with a column feature_target_enc for each feature, and a dictionnary with the features as keys and as values a tuple   
+            with the encodings derived on the whole data and the overall mean, to be used with apply_target_encoding on new data
+    """
+
+    features = [features] if isinstance(features, str) == True else features
+    targets = df[target_column].values.astype('float64')
+    weights = np.ones(df.shape[0]) if weight_column is None else df[weight_column].values.astype('float64')
+    folds = np.random.RandomState(random_state).permutation(df.shape[0]) % n_splits
+    encoded_columns, encodings = {}, {}
+
+    # Totals per fold, the out-of-fold totals being the overall ones minus the fold ones
+    fold_targets, fold_weights = np.bincount(folds, targets, minlength=n_splits), np.bincount(folds, weights, minlength=n_splits)
+    out_of_fold_means = (fold_targets.sum() - fold_targets) / (fold_weights.sum() - fold_weights)
+    overall_mean = targets.sum() / weights.sum()
+
+    for feature in features:
+        codes, values = pd.factorize(df[feature])
+        number_values = len(values)
+        known = codes >= 0
+
+        # A single grouped sum gives the target and weight totals of every fold and feature value
+        group_codes = folds[known] * number_values + codes[known]
+        level_targets = np.bincount(group_codes, targets[known], minlength=n_splits * number_values).reshape(n_splits, number_values)
+        level_weights = np.bincount(group_codes, weights[known], minlength=n_splits * number_values).reshape(n_splits, number_values)
+
+        out_of_fold_targets = level_targets.sum(axis=0) - level_targets
+        out_of_fold_weights = level_weights.sum(axis=0) - level_weights
+        # A value not seen in the other folds gets their mean, even without smoothing
+        out_of_fold_encodings = np.broadcast_to(out_of_fold_means[:, np.newaxis], out_of_fold_weights.shape).copy()
+        np.divide(out_of_fold_targets + smoothing * out_of_fold_means[:, np.newaxis], out_of_fold_weights + smoothing, out=out_of_fold_encodings, where=out_of_fold_weights > 0)
+
+        encoded_columns[feature + '_target_enc'] = np.where(known, out_of_fold_encodings[folds, np.maximum(codes, 0)], out_of_fold_means[folds])
+
+        full_encodings = (level_targets.sum(axis=0) + smoothing * overall_mean) / (level_weights.sum(axis=0) + smoothing)
+        encodings[feature] = (pd.Series(full_encodings, index=values), overall_mean)
+
+    return df.assign(**encoded_columns), encodings
+
+
+def apply_target_encoding(df, encodings):
+    """
+        Encodes new data (e.g. new business quotes) with the target encodings derived by target_encode   
+        Arguments --> the dataframe and the encodings dictionnary returned by target_encode   
+        Returns --> a new df with a column feature_target_enc for each feature, the values not seen before being encoded with the overall mean
+    """
+
+    return df.assign(**{feature + '_target_enc': df[feature].map(level_encodings).fillna(overall_mean).values for feature, (level_encodings, overall_mean) in encodings.items()})
+
+
+def combine_sparse_features(df, features, sparse_matrix, sparse_columns):
+    """
+        Builds a sparse matrix gathering the dense features of the df and hot encoded features kept as a sparse matrix, ready to be used by the models fitting functions   
+        Arguments --> the dataframe, its numerical features to add, the sparse matrix and the names of its columns (e.g. as returned by hot_encode with sparse_output)   
+        Returns --> the sparse matrix with all the features and the list of their names
+    """
+
+    features = [features] if isinstance(features, str) == True else features
+    matrix = sparse.hstack([sparse.csr_matrix(df[features].values.astype('float64')), sparse_matrix], format='csr')
+
+    return matrix, features + list(sparse_columns)
+
+
 def label_encode(df, features, encoder, sort_features=None):
     """
         Label encodes the features   
@@ -70,4 +186,137 @@ def label_encode(df, features, encoder, sort_features=None):
         else:
             new_df[new_feature] = encoder.fit_transform(new_df[feature].astype('str'))
 
-    return new_df, encoder
\ No newline at end of file
+    return new_df, encoder
+
+
+class EncodingPipeline:
+    """
+        Learns in one go the label encodings, hot encodings and min-max scalings of the features (same encodings as label_encode, hot_encode and min_max_scale),   
+        then applies them to any dataframe without fitting again, e.g. to score new business quotes batch by batch   
+        Arguments --> the features to label encode, to hot encode and to rescale (either lists or strings)
+    """
+
+    def __init__(self, label_features=None, hot_features=None, scale_features=None):
+
+        self.label_features = [] if label_features is None else [label_features] if isinstance(label_features, str) == True else label_features
+        self.hot_features = [] if hot_features is None else [hot_features] if isinstance(hot_features, str) == True else hot_features
+        self.scale_features = [] if scale_features is None else [scale_features] if isinstance(scale_features, str) == True else scale_features
+        self.label_classes = {}
+        self.hot_categories = {}
+        self.hot_dropped_values = {}
+        self.scale_min_max = {}
+
+
+    def fit(self, df):
+        """
+            Learns the encodings of all the features   
+            Arguments --> the dataframe   
+            Returns --> the pipeline itself
+        """
+
+        for feature in self.label_features:
+            # Classes are sorted as the label encoder does
+            self.label_classes[feature] = np.unique(df[feature].values.astype('str'))
+
+        for feature in self.hot_features:
+            values = df[feature].values.astype('str')
+            self.hot_categories[feature] = np.unique(values)
+            # As in hot_encode, the first value of the feature is dropped as it can be directly infered from the other values
+            self.hot_dropped_values[feature] = values[0]
+
+        for feature in self.scale_features:
+            self.scale_min_max[feature] = (df[feature].min(), df[feature].max())
+
+        return self
+
+
+    def transform(self, df, inplace=False):
+        """
+            Applies the learnt encodings, the hot encoded features being replaced by their encoded columns   
+            Values not seen when fitting get the label -1 and 0 in all the hot encoded columns   
+            Arguments --> the dataframe, a boolean indicating if the encoded columns must be added directly to the dataframe instead of creating a new one   
+                (the given dataframe is then modified, its hot encoded features being removed)   
+            Returns --> the dataframe with the features encoded
+        """
+
+        encoded_columns = self._encode(df)
+
+        if inplace == True:
+            for feature in self.hot_features:
+                del df[feature]
+
+            for column, values in encoded_columns.items():
+                df[column] = values
+
+            return df
+
+        return pd.concat([df.drop(columns=self.hot_features), pd.DataFrame(encoded_columns, index=df.index)], axis=1)
+
+
+    def transform_sparse(self, df, features=None):
+        """
+            Applies the learnt encodings and gathers them in a sparse matrix, the hot encoded columns being built directly in the sparse format   
+            Arguments --> the dataframe and other numerical features of the dataframe to add to the matrix   
+            Returns --> the sparse matrix and the list of its columns names
+        """
+
+        features = [] if features is None else [features] if isinstance(features, str) == True else features
+        blocks, names = [], []
+        encoded_columns = self._encode(df, hot_encode=False)
+
+        if len(features) + len(encoded_columns) > 0:
+            dense_values = [df[feature].values for feature in features] + list(encoded_columns.values())
+            blocks.append(sparse.csr_matrix(np.column_stack(dense_values).astype('float64')))
+            names += features + list(encoded_columns.keys())
+
+        for feature in self.hot_features:
+            categories = [category for category in self.hot_categories[feature] if category != self.hot_dropped_values[feature]]
+            # The dropped and unseen values get no column, i.e. a -1 code that is filtered out
+            codes = pd.Categorical(df[feature].values.astype('str'), categories=categories).codes
+            rows = np.flatnonzero(codes >= 0)
+            blocks.append(sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows])), shape=(df.shape[0], len(categories))))
+            names += [feature + '_' + category for category in categories]
+
+        return sparse.hstack(blocks, format='csr'), names
+
+
+    def _encode(self, df, hot_encode=True):
+        """ Derives the encoded columns (the hot encoded ones only if hot_encode is True) and returns them in a dictionnary"""
+
+        encoded_columns = {}
+
+        for feature in self.label_features:
+            encoded_columns[feature + '_label_enc'] = pd.Categorical(df[feature].values.astype('str'), categories=self.label_classes[feature]).codes.astype('int64')
+
+        if hot_encode == True:
+            for feature in self.hot_features:
+                values = df[feature].values.astype('str')
+
+                for category in self.hot_categories[feature]:
+                    if category != self.hot_dropped_values[feature]:
+                        encoded_columns[feature + '_' + category] = (values == category).astype('float64')
+
+        for feature in self.scale_features:
+            min_value, max_value = self.scale_min_max[feature]
+            # A constant feature is only shifted, as the min-max scaler does
+            encoded_columns[feature + '_scaled'] = (df[feature].values - min_value) / (max_value - min_value if max_value != min_value else 1)
+
+        return encoded_columns
+
+
+    def fit_transform(self, df, inplace=False):
+        """ Learns the encodings of all the features and applies them to the dataframe"""
+
+        return self.fit(df).transform(df, inplace)
+
+
+    def transform_chunks(self, chunks, inplace=False):
+        """
+            Applies the learnt encodings to data coming by batches (e.g. new quotes read with pd.read_csv and chunksize)   
+            Arguments --> the iterable of dataframes and a boolean indicating if the chunks can be encoded in place (see transform),   
+                which saves a copy of each chunk when they are not used elsewhere (e.g. read with pd.read_csv)   
+            Returns --> a generator of encoded dataframes
+        """
+
+        for chunk in chunks:
+            yield self.transform(chunk, inplace)
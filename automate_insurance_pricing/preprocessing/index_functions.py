@@ -0,0 +1,93 @@
+import pandas as pd
+import numpy as np
+
+
+class PolicyIndex:
+    """
+        Index of the portfolio policies built once and shared by the checks and the analysis functions to link claims to policies with hash lookups instead of merges   
+        It stores for each policy its rows positions in the portfolio, its latest and earliest rows (by contract start date) and its latest contract start date   
+        The positions refer to the portfolio rows order, so the index must be rebuilt if the portfolio rows are filtered or reordered   
+        Only the positions are stored, not the portfolio itself, so the rows are taken from the dataframe given to get_policy_rows   
+        Arguments --> the portfolio dataframe, the policy id and contract start date columns names
+    """
+
+    def __init__(self, df_portfolio, policy_id_column_name='policy_id', main_column_contract_date=None):
+
+        self.policy_id_column_name = policy_id_column_name
+        self.main_column_contract_date = main_column_contract_date
+
+        # Each row gets the number of its policy, the missing policy ids getting -1
+        self.codes, self.policies = pd.factorize(df_portfolio[policy_id_column_name])
+        self.policies = pd.Index(self.policies)
+
+        # The rows are grouped by policy so that the rows of a policy are contiguous
+        self.rows_order = np.argsort(self.codes, kind='stable')
+        self.rows_order = self.rows_order[self.codes[self.rows_order] >= 0]
+        self.rows_offsets = np.searchsorted(self.codes[self.rows_order], np.arange(len(self.policies) + 1))
+
+        if main_column_contract_date is not None:
+            # Within a policy the rows are sorted by contract start date, so the first and last rows of each policy are its earliest and latest contracts
+            dates = df_portfolio[main_column_contract_date].values
+            dates_order = np.lexsort((dates, self.codes))
+            dates_order = dates_order[self.codes[dates_order] >= 0]
+
+            self.earliest_rows = dates_order[self.rows_offsets[:-1]]
+            self.latest_rows = dates_order[self.rows_offsets[1:] - 1]
+
+            # As the missing dates are sorted last, the latest contract start date is derived separately to ignore them
+            known_policies = self.codes >= 0
+            self.latest_effective_dates = pd.Series(dates[known_policies]).groupby(self.codes[known_policies]).max().reindex(range(len(self.policies))).values
+
+
+    def get_positions(self, policy_ids):
+        """
+            Gets the position of each policy in the index   
+            Arguments --> the policy ids (pandas serie, array or list)   
+            Returns --> an array with the position of each policy, -1 for the policies that are not in the portfolio
+        """
+
+        return self.policies.get_indexer(policy_ids)
+
+
+    def contains(self, policy_ids):
+        """
+            Checks which policies are in the portfolio   
+            Arguments --> the policy ids (pandas serie, array or list)   
+            Returns --> a boolean array
+        """
+
+        return self.get_positions(policy_ids) >= 0
+
+
+    def get_latest_effective_dates(self, policy_ids):
+        """
+            Gets the latest contract start date of each policy   
+            Arguments --> the policy ids (pandas serie, array or list)   
+            Returns --> an array of dates, NaT for the policies that are not in the portfolio
+        """
+
+        positions = self.get_positions(policy_ids)
+        found = positions >= 0
+
+        # The dates are only taken for the policies found, so that an empty portfolio gives NaT to all the policies
+        latest_effective_dates = np.full(len(positions), np.datetime64('NaT'), dtype=self.latest_effective_dates.dtype)
+        latest_effective_dates[found] = self.latest_effective_dates[positions[found]]
+
+        return latest_effective_dates
+
+
+    def get_policy_rows(self, df, keep='last', sort=True):
+        """
+            Gets a row per policy, i.e. its latest or earliest contract with its features   
+            Arguments --> the dataframe to take the rows from, which must have the same rows as the portfolio the index was built on (e.g. the portfolio itself or after rates adjustments),   
+                which contract to keep ('last' for the latest one, 'first' for the earliest one)   
+                and a boolean indicating if the rows are sorted by contract start date as sort_values followed by drop_duplicates would do (otherwise they are in the index order)   
+            Returns --> a dataframe with a row per policy
+        """
+
+        rows = self.latest_rows if keep == 'last' else self.earliest_rows
+
+        if sort == True:
+            rows = rows[np.argsort(df[self.main_column_contract_date].values[rows], kind='stable')]
+
+        return df.iloc[rows]
@@ -0,0 +1,306 @@
+import pandas as pd
+import numpy as np
+
+import math
+
+
+class QuantileSketch:
+    """
+        Approximate quantiles of a numerical feature that can be fed chunk by chunk and merged with sketches built by other workers (KLL sketch)   
+        The values are kept in a hierarchy of compactors: when a level is full, its values are sorted and one out of two is promoted to the next level with a doubled weight,   
+        so the memory used stays around 3 * k values whatever the data size   
+        Error bound: each compaction of a level with weight w moves the rank of any value by at most w. The sketch adds up these weights,   
+        so rank_error_bound gives a guaranteed bound (not only a probabilistic one) on the normalised rank error of the quantiles, i.e. a returned 0.3 quantile   
+        has a true rank between 0.3 - bound and 0.3 + bound. In practice the error is much lower since the compaction errors compensate each other   
+        Arguments --> the size k of the compactors (the higher, the more accurate and the more memory used) and the seed used to choose the values promoted
+    """
+
+    def __init__(self, k=200, random_state=42):
+
+        self.k = k
+        self.random_state = random_state
+        self.compactors = [np.empty(0)]
+        self.count = 0
+        self.rank_error = 0
+        self.min_value, self.max_value = np.inf, -np.inf
+        self._random_generator = np.random.default_rng(random_state)
+
+
+    def update(self, values):
+        """
+            Adds values to the sketch   
+            Arguments --> the values (pandas serie, array or list), missing values are ignored   
+            Returns --> the sketch itself
+        """
+
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+
+        if len(values) > 0:
+            self.count += len(values)
+            self.min_value, self.max_value = min(self.min_value, values.min()), max(self.max_value, values.max())
+            self.compactors[0] = np.concatenate((self.compactors[0], values))
+            self._compress()
+
+        return self
+
+
+    def merge(self, other):
+        """
+            Merges another sketch (e.g. built by another worker on another part of the data) into this one   
+            Arguments --> the other sketch   
+            Returns --> the sketch itself
+        """
+
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+
+        for level, values in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate((self.compactors[level], values))
+
+        self.count += other.count
+        self.rank_error += other.rank_error
+        self.min_value, self.max_value = min(self.min_value, other.min_value), max(self.max_value, other.max_value)
+        self._compress()
+
+        return self
+
+
+    def quantile(self, q):
+        """
+            Gets approximate quantiles   
+            Arguments --> the quantile or the list of quantiles to get, between 0 and 1   
+            Returns --> the quantile value or an array of values
+        """
+
+        if self.count == 0:
+            return np.nan if np.ndim(q) == 0 else np.full(len(q), np.nan)
+
+        values = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(level_values), 2**level) for level, level_values in enumerate(self.compactors)])
+        order = np.argsort(values, kind='stable')
+        values, cumulative_weights = values[order], np.cumsum(weights[order])
+
+        ranks = np.asarray(q, dtype='float64') * cumulative_weights[-1]
+        quantiles = values[np.minimum(np.searchsorted(cumulative_weights, ranks, side='left'), len(values) - 1)]
+
+        # The extreme values are known exactly
+        quantiles = np.where(np.asarray(q) <= 0, self.min_value, np.where(np.asarray(q) >= 1, self.max_value, quantiles))
+
+        return quantiles if np.ndim(q) > 0 else float(quantiles)
+
+
+    def rank(self, value, inclusive=False):
+        """
+            Gets the approximate number of values lower than a value   
+            Arguments --> the value and a boolean indicating if the values equal to it are counted as well   
+            Returns --> the approximate number of values, within count * rank_error_bound of the true one
+        """
+
+        if self.count == 0:
+            return 0
+
+        values = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(level_values), 2**level) for level, level_values in enumerate(self.compactors)])
+        mask = values <= value if inclusive == True else values < value
+
+        return int(weights[mask].sum())
+
+
+    def bin_edges(self, bins):
+        """
+            Gets the edges of buckets having approximately the same number of values, as pd.qcut would do   
+            Arguments --> the number of buckets or the list of quantiles delimiting them   
+            Returns --> an array with the unique edges
+        """
+
+        quantiles = np.linspace(0, 1, bins + 1) if isinstance(bins, int) == True else bins
+
+        return np.unique(self.quantile(quantiles))
+
+
+    def rank_error_bound(self):
+        """ Gets the maximum normalised rank error of the quantiles returned by the sketch"""
+
+        return self.rank_error / self.count if self.count > 0 else 0
+
+
+    def _compress(self):
+        """ Compacts the levels that are over their capacity, from the lowest to the highest"""
+
+        level = 0
+
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+
+                values = np.sort(self.compactors[level])
+                # With an odd number of values, the last one stays at its level
+                kept_values = values[len(values) - len(values) % 2:]
+                offset = self._random_generator.integers(0, 2)
+
+                self.compactors[level + 1] = np.concatenate((self.compactors[level + 1], values[offset:len(values) - len(values) % 2:2]))
+                self.compactors[level] = kept_values
+                self.rank_error += 2**level
+
+            level += 1
+
+
+    def _capacity(self, level):
+        """ Gets the number of values a level can store, the highest levels (with the biggest weights) having the biggest capacities"""
+
+        return max(2, math.ceil(self.k * (2 / 3)**(len(self.compactors) - 1 - level)))
+
+
+
+def create_quantile_sketches(chunks, columns, k=200, random_state=42):
+    """
+        Builds a quantile sketch for each feature while going through the data chunk by chunk (e.g. pd.read_csv with chunksize)   
+        Arguments --> the iterable of dataframes (or a single dataframe), the numerical features (either a list or a string),   
+            the size of the compactors and the seed of the sketches (see QuantileSketch)   
+        Returns --> a dictionnary with the features as keys and the sketches as values
+    """
+
+    columns = [columns] if isinstance(columns, str) == True else columns
+    chunks = [chunks] if isinstance(chunks, pd.DataFrame) == True else chunks
+    sketches = {column: QuantileSketch(k, random_state) for column in columns}
+
+    for chunk in chunks:
+        for column in columns:
+            sketches[column].update(chunk[column])
+
+    return sketches
+
+
+
+class DistinctCountSketch:
+    """
+        Approximate number of distinct values of a feature that can be fed chunk by chunk and merged with sketches built by other workers (HyperLogLog)   
+        Each value is hashed on 64 bits: the first bits choose a register and each register keeps the maximum position of the first 1 bit in the rest of the hash,   
+        so the memory used is 2**precision bytes whatever the data size   
+        Error: the relative standard error of the count is around 1.04 / sqrt(2**precision), i.e. 0.8% with the default precision   
+        Arguments --> the precision, i.e. the number of bits used to choose the register (between 4 and 18)
+    """
+
+    def __init__(self, precision=14):
+
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype='uint8')
+
+
+    def update(self, values):
+        """
+            Adds values to the sketch   
+            Arguments --> the values (pandas serie, array or list), missing values are ignored as in pandas nunique   
+            Returns --> the sketch itself
+        """
+
+        values = pd.Series(values).dropna()
+
+        if len(values) > 0:
+            hashes = _hash_values(values)
+            register_positions = (hashes >> np.uint64(64 - self.precision)).astype('int64')
+            remaining_bits = hashes & np.uint64(2**(64 - self.precision) - 1)
+
+            ranks = (64 - self.precision) - _bit_length(remaining_bits) + 1
+            np.maximum.at(self.registers, register_positions, ranks.astype('uint8'))
+
+        return self
+
+
+    def merge(self, other):
+        """
+            Merges another sketch (e.g. built by another worker on another part of the data) into this one   
+            Arguments --> the other sketch, which must have the same precision   
+            Returns --> the sketch itself
+        """
+
+        if other.precision != self.precision:
+            raise ValueError('Only sketches with the same precision can be merged')
+
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+        return self
+
+
+    def count(self):
+        """ Gets the approximate number of distinct values added to the sketch"""
+
+        number_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / number_registers)
+        estimate = alpha * number_registers**2 / np.sum(2.0**-self.registers.astype('float64'))
+        empty_registers = np.sum(self.registers == 0)
+
+        # For small cardinalities, counting the empty registers is more accurate (linear counting)
+        if estimate <= 2.5 * number_registers and empty_registers > 0:
+            estimate = number_registers * math.log(number_registers / empty_registers)
+
+        return int(round(estimate))
+
+
+    def relative_error(self):
+        """ Gets the relative standard error of the count"""
+
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+
+def _hash_values(values):
+    """
+        Hashes the values with the same hash for equal values whatever their dtype, as pd.util.hash_pandas_object hashes depend on the dtype   
+        (e.g. pd.read_csv gives floats instead of integers to the chunks with missing values, and object to the ones with a typo, so 5, 5.0 and an object 5 must get the same hash)   
+        The categorical values are replaced by their categories values, the numbers (and booleans) are hashed as floats and the dates as nanoseconds   
+        Arguments --> the pandas serie of values, without missing values   
+        Returns --> an array with the unsigned 64 bits hashes of the values
+    """
+
+    if isinstance(values.dtype, pd.CategoricalDtype) == True:
+        values = pd.Series(np.asarray(values))
+
+    if pd.api.types.is_numeric_dtype(values.dtype) == True:
+        # Adding 0 turns -0.0 into 0.0, the two values being equal but having different bits
+        return pd.util.hash_pandas_object(values.astype('float64') + 0.0, index=False).values
+
+    if pd.api.types.is_datetime64_dtype(values.dtype) == True:
+        return pd.util.hash_pandas_object(values.astype('datetime64[ns]'), index=False).values
+
+    if values.dtype == object:
+        is_number = np.fromiter((isinstance(value, (int, float, np.number, np.bool_)) for value in values), dtype='bool', count=len(values))
+
+        if is_number.any() == True:
+            hashes = np.empty(len(values), dtype='uint64')
+            hashes[is_number] = _hash_values(values[is_number].astype('float64'))
+            hashes[~is_number] = pd.util.hash_pandas_object(values[~is_number], index=False).values
+            return hashes
+
+    return pd.util.hash_pandas_object(values, index=False).values
+
+
+
+def _bit_length(values):
+    """ Gets the number of bits needed to write each unsigned 64 bits integer, computed on its two 32 bits halves so the float conversion is exact"""
+
+    high_bits, low_bits = values >> np.uint64(32), values & np.uint64(2**32 - 1)
+    high_length, low_length = np.frexp(high_bits.astype('float64'))[1], np.frexp(low_bits.astype('float64'))[1]
+
+    return np.where(high_bits > 0, 32 + high_length, low_length)
+
+
+
+def create_distinct_count_sketches(chunks, columns, precision=14):
+    """
+        Builds a distinct count sketch for each feature while going through the data chunk by chunk (e.g. pd.read_csv with chunksize)   
+        Arguments --> the iterable of dataframes (or a single dataframe), the features (either a list or a string) and the precision of the sketches (see DistinctCountSketch)   
+        Returns --> a dictionnary with the features as keys and the sketches as values
+    """
+
+    columns = [columns] if isinstance(columns, str) == True else columns
+    chunks = [chunks] if isinstance(chunks, pd.DataFrame) == True else chunks
+    sketches = {column: DistinctCountSketch(precision) for column in columns}
+
+    for chunk in chunks:
+        for column in columns:
+            sketches[column].update(chunk[column])
+
+    return sketches
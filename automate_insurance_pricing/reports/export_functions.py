@@ -1,7 +1,5 @@
 import pandas as pd
 
-import openpyxl
-
 from automate_insurance_pricing.standard_functions import *
 
 def export_glm_coefs_to_excel(features_coefs, features, glm_file_path):
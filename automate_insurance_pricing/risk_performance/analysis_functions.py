@@ -7,6 +7,7 @@ from copy import deepcopy
 
 from automate_insurance_pricing.risk_prediction.charts_functions import *
 from automate_insurance_pricing.preprocessing.charts_functions import *
+from automate_insurance_pricing.preprocessing.index_functions import *
     
 def compare_to_mean_by_feature(df_analysis, target_column, mean_target, features, rebase_on='exposure', rebase_to_value=100, plot_chart=True, figsize=(12, 8), save=False, prefix_name_fig=None, folder='Charts', title=None):
     """
@@ -67,7 +68,7 @@ def style_df(df, currency='€'):
     return new_df.style.format(formatters)
 
 
-def run_multi_analysis_by_feature(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, exposure_column_name='exposure', written_premium_column_name='asif_written_premium_excl_taxes', earned_premium_column_name='asif_earned_premium', occurrence_date_column_name='occurrence_date', claims_column_name='asif_total_capped_cost', full_claims_column_name='asif_total_cost', capped_claims_column_name='asif_total_capped_cost', claim_count_column_name='count_claim', guarantees=None, guarantee_column_name='guarantee_impacted', analysis_year_level=None, features=None, parent_features=None, triangle_costs=None, triangle_counts=None, style_format=False, currency='€'):
+def run_multi_analysis_by_feature(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, exposure_column_name='exposure', written_premium_column_name='asif_written_premium_excl_taxes', earned_premium_column_name='asif_earned_premium', occurrence_date_column_name='occurrence_date', claims_column_name='asif_total_capped_cost', full_claims_column_name='asif_total_cost', capped_claims_column_name='asif_total_capped_cost', claim_count_column_name='count_claim', guarantees=None, guarantee_column_name='guarantee_impacted', analysis_year_level=None, features=None, parent_features=None, triangle_costs=None, triangle_counts=None, style_format=False, currency='€', rate_increase_params=None, policy_index=None):
     """
         Generates the summary tables that displays the portfolio performance by feature   
         Arguments --> portfolio and claims df to work on, the portfolio and claims kpis (exposure, premiums, costs, etc.),   
@@ -83,6 +84,7 @@ def run_multi_analysis_by_feature(df_portfolio, df_claims, portfolio_kpis, claim
             the segmentation, i.e. on which features the analysis will be performed, and features for a higher level of segmentation (typically the formula as most analysis will be relevant only for a specific formula and not overall)   
             the claims amounts and counts triangles that will be used,   
             the style format (produces a prettier table if set to true ) and currency used (only if style format set to true)   
+            the rates adjustments to apply to the premiums and the portfolio policy index (see build_table)   
         Returns --> a dictionnary with the features names as keys and the performance summary tables as values
     """
 
@@ -95,9 +97,26 @@ def run_multi_analysis_by_feature(df_portfolio, df_claims, portfolio_kpis, claim
         guarantees = [guarantees] if isinstance(guarantees, str) == True else guarantees
         new_df_claims = df_claims[df_claims[guarantee_column_name].isin(guarantees)]
 
+    # Except by occurrence year, the portfolio and claims are aggregated only once by all the features, each feature table being then derived from this aggregation
+    if analysis_year_level != 'occurrence':
+        df_portfolio_cube, df_claims_cube, year_group_by = build_analysis_cube(df_portfolio, new_df_claims, portfolio_kpis, claims_kpis, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, row_per_each_contract_year, written_premium_column_name, earned_premium_column_name, analysis_year_level, features, rate_increase_params, policy_index)
+
     for feature in features:
-        df_analysis_feature = build_table(df_portfolio, new_df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, exposure_column_name, written_premium_column_name, earned_premium_column_name, occurrence_date_column_name, full_claims_column_name, capped_claims_column_name, claim_count_column_name, table_for_prediction=False, analysis_year_level=analysis_year_level, portfolio_group_by_columns=feature, triangle_costs=triangle_costs, triangle_counts=triangle_counts, style_format=style_format, currency=currency)
-                                            
+
+        if analysis_year_level == 'occurrence':
+            df_analysis_feature = build_table(df_portfolio, new_df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, exposure_column_name, written_premium_column_name, earned_premium_column_name, occurrence_date_column_name, full_claims_column_name, capped_claims_column_name, claim_count_column_name, table_for_prediction=False, analysis_year_level=analysis_year_level, portfolio_group_by_columns=feature, triangle_costs=triangle_costs, triangle_counts=triangle_counts, rate_increase_params=rate_increase_params, style_format=style_format, currency=currency, policy_index=policy_index)
+
+        else:
+            portfolio_group_by = [feature] if isinstance(feature, str) == True else feature
+            df_policy_claims = roll_up_analysis_cube(df_portfolio_cube, df_claims_cube, year_group_by + portfolio_group_by, portfolio_kpis, claims_kpis)
+
+            # Same steps as the end of build_table for a summary table
+            df_analysis_feature = produce_df_for_analysis(df_policy_claims, analysis_year_level, portfolio_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, exposure_column_name, earned_premium_column_name, full_claims_column_name, capped_claims_column_name, claim_count_column_name, table_for_prediction=False, triangle_costs=triangle_costs, triangle_counts=triangle_counts, portfolio_group_by=portfolio_group_by, claims_group_by=[])
+            df_analysis_feature = df_analysis_feature.drop(columns=claims_kpis, errors='ignore')
+
+            if style_format == True:
+                df_analysis_feature = style_df(df_analysis_feature, currency)
+
         if isinstance(feature, list) == True:
             feature = tuple(feature)
 
@@ -142,7 +161,7 @@ def run_all_analysis_by_year(df_portfolio, df_claims, portfolio_kpis, claims_kpi
     return df_analysis_occurrence_year, df_analysis_inception_year, df_analysis_effective_year
 
                 
-def build_table(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, exposure_column_name='exposure', written_premium_column_name='asif_written_premium_excl_taxes', earned_premium_column_name='asif_earned_premium', occurrence_date_column_name='occurrence_date', full_claims_column_name='asif_total_cost', capped_claims_column_name='asif_total_capped_cost', claim_count_column_name='count_claim', table_for_prediction=True, kpis_list=None, analysis_year_level=None, portfolio_group_by_columns=None, claims_group_by_columns=None, triangle_costs=None, triangle_counts=None, rate_increase_params=None, style_format=False, currency='€', **kwargs):
+def build_table(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_limit, LL_loading, current_comm, new_comm, target_LR_new_comm, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, exposure_column_name='exposure', written_premium_column_name='asif_written_premium_excl_taxes', earned_premium_column_name='asif_earned_premium', occurrence_date_column_name='occurrence_date', full_claims_column_name='asif_total_cost', capped_claims_column_name='asif_total_capped_cost', claim_count_column_name='count_claim', table_for_prediction=True, kpis_list=None, analysis_year_level=None, portfolio_group_by_columns=None, claims_group_by_columns=None, triangle_costs=None, triangle_counts=None, rate_increase_params=None, style_format=False, currency='€', df_portfolio_long=None, long_year_column_name='occurrence_year', policy_index=None, **kwargs):
     """
         Creates a summary profitability table or builds the data set ready for risk modelling    
         Arguments --> portfolio and claims dataframes to work on, the portfolio and claims kpis (exposure, premiums, costs, etc.),   
@@ -161,11 +180,13 @@ def build_table(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_lim
             the rates adjustments to apply to the premiums, it must be a dictionnary with features modalities as keys and adjustments as values   
             example: rates_increases = {'[25-35)': 0.2, 'London’: 0.1}, this will increase all insured age between 25 et 35 by 20% and all insured located in London by 10%   
             the style format (produces a prettier table if set to true ) and currency used (only if style format set to true)   
+            the long table of portfolio amounts per policy and year (derive_yearly_amounts with long_format set to True), only used for the analysis by occurrence year, and the name of its year column   
+            the portfolio policy index (see index_functions.PolicyIndex built with the contract start date), used to link the claims to the policies without merges   
         Returns --> either a summary profitability table or the full dataset ready for risk prediction works 
     """
 
     new_df_portfolio, new_df_claims = deepcopy(df_portfolio), deepcopy(df_claims)
-    new_df_claims = new_df_claims[new_df_claims[policy_id_column_name].isin(new_df_portfolio[policy_id_column_name])]
+    new_df_claims = new_df_claims[new_df_claims[policy_id_column_name].isin(new_df_portfolio[policy_id_column_name]) if policy_index is None else policy_index.contains(new_df_claims[policy_id_column_name])]
 
     new_portfolio_group_by = [] if portfolio_group_by_columns is None else [portfolio_group_by_columns] if isinstance(portfolio_group_by_columns, str) == True else deepcopy(portfolio_group_by_columns)
     new_claims_group_by = [] if claims_group_by_columns is None else [claims_group_by_columns] if isinstance(claims_group_by_columns, str) == True else deepcopy(claims_group_by_columns)
@@ -191,6 +212,9 @@ def build_table(df_portfolio, df_claims, portfolio_kpis, claims_kpis, claims_lim
 
         new_df_portfolio = adjust_rates(new_df_portfolio, start_business_year, extraction_year, written_premium_column_name, earned_premium_column_name, rate_increase_params)
 
+        if df_portfolio_long is not None:
+            df_portfolio_long = adjust_rates_long(df_portfolio_long, df_portfolio, rate_increase_params)
+
     # If by occurrence a special treatment is required as in the portfolio there is no occurrence date
     # The only analysis possible by occurrence year is to work on the columns named like this 'in_{year}'
     if analysis_year_level == 'occurrence':
@@ -202,13 +226,13 @@ Change the argument to table_for_prediction False if you want to build a risk an
                 return
 
         year_group_by = ['occurrence_year']
-        df_policy_claims = prep_data_summary_occurrence_year(new_df_portfolio, new_df_claims, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, occurrence_date_column_name, year_group_by, new_portfolio_group_by, new_claims_group_by, claims_kpis)
+        df_policy_claims = prep_data_summary_occurrence_year(new_df_portfolio, new_df_claims, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, occurrence_date_column_name, year_group_by, new_portfolio_group_by, new_claims_group_by, claims_kpis, df_portfolio_long, long_year_column_name)
                                           
     else:
 
         # Will produce either the full table that will most likely serve for prediction job or a summary table depending on effective/inception year + other variables
         if table_for_prediction == True or analysis_year_level is not None :
-            df_policy_claims, year_group_by = other_prepare_data(new_df_portfolio, new_df_claims, policy_id_column_name, main_column_contract_date, row_per_each_contract_year, table_for_prediction, analysis_year_level, new_portfolio_group_by, new_claims_group_by, portfolio_kpis, claims_kpis)
+            df_policy_claims, year_group_by = other_prepare_data(new_df_portfolio, new_df_claims, policy_id_column_name, main_column_contract_date, row_per_each_contract_year, table_for_prediction, analysis_year_level, new_portfolio_group_by, new_claims_group_by, portfolio_kpis, claims_kpis, policy_index)
                                                                     
         # The summary table will be on figures depending on portfolio features and claims attributes but not on a yearly basis
         else:
@@ -269,8 +293,30 @@ def adjust_rates(df, start_business_year, extraction_year, written_premium_colum
             
     return new_df
 
+
+
+def adjust_rates_long(df_long, df_portfolio, rate_increase_params):
+    """
+        Increase the rates for specific segments in the long table of amounts per policy and year, the same way adjust_rates does on the portfolio   
+        Arguments --> the long table produced by derive_yearly_amounts with long_format set to True, the portfolio df it was derived from   
+            the rates adjustments to apply to the premiums, it must be a dictionnary with features modalities as keys and adjustments as values   
+        Returns --> a new long table with the updated premiums
+    """
+
+    new_df_long = df_long.copy()
+    adjustments = np.ones(df_portfolio.shape[0])
+
+    # The adjustments are first combined at policy level, then spread on the policy years through the row positions
+    for value in rate_increase_params.values():
+        adjustments = np.where(df_portfolio[value[0]] == value[1], adjustments * (1 + value[2]), adjustments)
+
+    premium_columns = [col for col in new_df_long.columns if 'premium' in col]
+    new_df_long[premium_columns] = new_df_long[premium_columns].values * adjustments[new_df_long['policy_row'].values][:, np.newaxis]
+
+    return new_df_long
+
                                     
-def prep_data_summary_occurrence_year(df_portfolio, df_claims, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, occurrence_date_column_name, year_group_by, portfolio_group_by, claims_group_by, claims_kpis):
+def prep_data_summary_occurrence_year(df_portfolio, df_claims, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, occurrence_date_column_name, year_group_by, portfolio_group_by, claims_group_by, claims_kpis, df_portfolio_long=None, long_year_column_name='occurrence_year'):
     """
         Prepares the porfolio and claims dataframes so that they can then be used for a summary risk analysis by occurrence year   
         Arguments --> portfolio and claims dataframes, the business start and data extraction years   
@@ -282,6 +328,7 @@ def prep_data_summary_occurrence_year(df_portfolio, df_claims, start_business_ye
             the segmentation, i.e. on which features the analysis will be performed   
             the claims attributes if the profitability results must be done on specific claims characteristics   
             the claims kpis, e.g. capped costs, inflated amounts, etc.   
+            the long table of portfolio amounts per policy and year, if the portfolio amounts were derived with derive_yearly_amounts long_format option, and the name of its year column   
         Returns --> a merged policies-claims df
     """
 
@@ -291,7 +338,7 @@ def prep_data_summary_occurrence_year(df_portfolio, df_claims, start_business_ye
     merge_on = year_group_by + portfolio_group_by
 
     # Selects the columns associated for each year (e.g. 'premium_in_{year}') and derive their totals
-    df_portfolio_sum = derive_per_occurrence_year(df_portfolio, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, df_portfolio.columns, year_column_name, portfolio_group_by)
+    df_portfolio_sum = derive_per_occurrence_year(df_portfolio, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, df_portfolio.columns, year_column_name, portfolio_group_by, df_long=df_portfolio_long, long_year_column_name=long_year_column_name)
                                                     
     # Aggregates the claims data by the occurrence year and the other variables specified in the arguments
     df_claim_sum[year_column_name] = df_claim_sum[occurrence_date_column_name].dt.year
@@ -303,7 +350,7 @@ def prep_data_summary_occurrence_year(df_portfolio, df_claims, start_business_ye
     return df_policies_claims
 
                             
-def derive_per_occurrence_year(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, written_premium_column_name='asif_written_premium_excl_taxes', columns_to_sum=None, year_column_name=None, df_group_by=None, style_format=False, currency='€'):
+def derive_per_occurrence_year(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', unknown_rows_name='UNKNOWN', row_per_each_contract_year=True, written_premium_column_name='asif_written_premium_excl_taxes', columns_to_sum=None, year_column_name=None, df_group_by=None, style_format=False, currency='€', df_long=None, long_year_column_name='occurrence_year'):
     """
         This function derives the figures by occurrence year and generates a summary table   
         Arguments --> the df, the columns to sum, the business start and extraction years, the contract start date and claim occurrence columns name,   
@@ -313,6 +360,8 @@ def derive_per_occurrence_year(df, start_business_year, extraction_year, main_co
             the written premium column name and the list of columns to sum per occurrence year (e.g. earned premium, exposure)   
             the column name to get the year and the segmentation used, i.e. on which features the analysis will be performed   
             the style format (produces a prettier table if set to true ) and currency used (only if style format set to true)               
+            the long table of amounts per policy and year produced by derive_yearly_amounts with long_format set to True,   
+            if given, its amounts are summed in a single group by instead of the columns per year of the df, and the name of its year column   
         Returns --> a summary table that will display the totals per occurrence year
     """
 
@@ -338,6 +387,26 @@ def derive_per_occurrence_year(df, start_business_year, extraction_year, main_co
 
         return df_sum
 
+    def build_long_aggregation(df, df_long, years, df_group_by, year_column_name, long_year_column_name):
+        # This function sums the long table amounts for all the occurrence years at once
+
+        amount_columns = [col for col in df_long.columns if col not in ['policy_row', long_year_column_name]]
+
+        if len(df_group_by) == 0:
+            # Years without any exposure are kept with nil amounts as in the tables built from the columns per year
+            return df_long.groupby(long_year_column_name)[amount_columns].sum().reindex(years, fill_value=0).rename_axis(None)
+
+        # The segmentation features are retrieved from the df through the row positions stored in the long table
+        df_features = df[df_group_by].take(df_long['policy_row'].values).reset_index(drop=True)
+        df_features[year_column_name] = df_long[long_year_column_name].values
+        df_sum = pd.concat([df_features, df_long[amount_columns]], axis=1).groupby([year_column_name]+df_group_by)[amount_columns].sum()
+
+        # As in the tables built from the columns per year, every group of the df appears every year, with nil amounts when it has no exposure
+        df_groups = df.groupby(df_group_by).size().index.to_frame(index=False)
+        full_index = pd.MultiIndex.from_frame(pd.DataFrame({year_column_name: years}).merge(df_groups, how='cross'))
+
+        return df_sum.reindex(full_index, fill_value=0).reset_index().set_index(year_column_name).rename_axis(None)
+
     df_sum = pd.DataFrame()
     columns_to_sum = df.columns if columns_to_sum is None else [columns_to_sum] if isinstance(columns_to_sum, str) == True else deepcopy(columns_to_sum)
     df_group_by = [] if df_group_by is None else deepcopy(df_group_by) if isinstance(df_group_by, list) == True else [df_group_by]
@@ -355,19 +424,22 @@ def derive_per_occurrence_year(df, start_business_year, extraction_year, main_co
                                                    
     else:
 
-        for year in years:
-            df_intermed_sum = build_aggregation(df, year, df_group_by, year_column_name, columns_to_sum)
-            # Concatenates along the rows ; each year line will be added at the bottom of the df
-            df_sum = pd.concat([df_sum, df_intermed_sum])
+        if df_long is not None:
+            df_sum = build_long_aggregation(df, df_long, years, df_group_by, year_column_name, long_year_column_name)
 
-        df_sum = df_sum.reset_index()
+        else:
+            for year in years:
+                df_intermed_sum = build_aggregation(df, year, df_group_by, year_column_name, columns_to_sum)
+                # Concatenates along the rows ; each year line will be added at the bottom of the df
+                df_sum = pd.concat([df_sum, df_intermed_sum])
+
+        df_sum = df_sum.reset_index().rename(columns={'index': year_column_name})
 
         # Adds the written premium to the df
         if written_premium_column_name in columns_to_sum and row_per_each_contract_year == True:
-            df_written_premium_sum = get_written_premium_occurrence_year(df, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, years=years, year_column_name=year_column_name, df_group_by=df_group_by, alone=False, style_format=style_format, currency=currency)                               
-            df_sum = pd.concat([df_sum, df_written_premium_sum], axis=1)
-
-        df_sum = df_sum.rename(columns={'index': year_column_name})
+            df_written_premium_sum = get_written_premium_occurrence_year(df, main_column_contract_date, policy_id_column_name, unknown_rows_name, row_per_each_contract_year, written_premium_column_name, years=years, year_column_name=year_column_name, df_group_by=df_group_by, alone=True, style_format=style_format, currency=currency)                               
+            # Merged on the year and the features rather than side by side, as some groups may have no contract written in a year
+            df_sum = df_sum.merge(df_written_premium_sum.reset_index(), how='left', on=year_group_by+df_group_by)
 
     # This will do some style formatting to the final df
     if style_format == True:
@@ -445,7 +517,55 @@ def get_written_premium_occurrence_year(df, main_column_contract_date, policy_id
     return df_written_premium_sum
 
 
-def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_column_contract_date, row_per_each_contract_year, table_for_prediction, analysis_year_level, portfolio_group_by, claims_group_by, portfolio_kpis, claims_kpis):
+def build_analysis_cube(df_portfolio, df_claims, portfolio_kpis, claims_kpis, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name='policy_id', row_per_each_contract_year=True, written_premium_column_name='asif_written_premium_excl_taxes', earned_premium_column_name='asif_earned_premium', analysis_year_level=None, features=None, rate_increase_params=None, policy_index=None):
+    """
+        Aggregates the portfolio and claims kpis once at the finest level needed by several summary tables, i.e. by year and by all their features together,   
+        so that each table can then be derived by summing up this aggregation (see roll_up_analysis_cube) instead of going through the full data again   
+        Arguments --> portfolio and claims dataframes to work on, the portfolio and claims kpis (exposure, premiums, costs, etc.), the start and end years of the study,   
+            the contract start and policy columns names, a boolean indicating if the data is aggregated at policy level or if each yearly contract is represented by a new row   
+            the written and earned premiums columns names, the type of year analysis (inception/effective year, or None for no analysis by year)   
+            the features (a list of features names or lists of features names), the rates adjustments to apply to the premiums (see build_table)   
+            and the portfolio policy index (see index_functions.PolicyIndex built with the contract start date)   
+        Returns --> the portfolio and claims aggregated dataframes and the list with the year column name (empty if no analysis by year)
+    """
+
+    features = [feature for feature_or_list in features for feature in ([feature_or_list] if isinstance(feature_or_list, str) == True else feature_or_list)]
+    features = list(dict.fromkeys(features))
+    year_group_by = [] if analysis_year_level is None else [analysis_year_level + '_year']
+
+    new_df_claims = df_claims[df_claims[policy_id_column_name].isin(df_portfolio[policy_id_column_name]) if policy_index is None else policy_index.contains(df_claims[policy_id_column_name])]
+    new_df_portfolio = df_portfolio if rate_increase_params is None else adjust_rates(df_portfolio, start_business_year, extraction_year, written_premium_column_name, earned_premium_column_name, rate_increase_params)
+
+    if len(year_group_by) > 0:
+        if analysis_year_level == 'inception' and row_per_each_contract_year == True:
+            new_df_portfolio, new_df_claims = prepare_inception_data(new_df_portfolio, new_df_claims, policy_id_column_name, main_column_contract_date, portfolio_kpis, policy_index)
+
+        new_df_portfolio = new_df_portfolio.assign(**{year_group_by[0]: new_df_portfolio[main_column_contract_date].dt.year})
+        new_df_claims = new_df_claims.assign(**{year_group_by[0]: new_df_claims[main_column_contract_date].dt.year})
+
+    # The missing features values are kept so that they are still summed when rolling up on the other features
+    df_portfolio_cube = new_df_portfolio.groupby(year_group_by + features, observed=True, dropna=False)[portfolio_kpis].sum().reset_index()
+    df_claims_cube = new_df_claims.groupby(year_group_by + features, observed=True, dropna=False)[claims_kpis].sum().reset_index()
+
+    return df_portfolio_cube, df_claims_cube, year_group_by
+
+
+
+def roll_up_analysis_cube(df_portfolio_cube, df_claims_cube, group_by, portfolio_kpis, claims_kpis):
+    """
+        Sums up the portfolio and claims aggregations built by build_analysis_cube and merges them, as sum_merge_tables does on the full data   
+        Arguments --> the portfolio and claims aggregated dataframes, the variables to aggregate on (year and features), the portfolio and claims kpis   
+        Returns --> A merged df with the kpis summed adequatly
+    """
+
+    df_portfolio_sum = df_portfolio_cube.groupby(group_by)[portfolio_kpis].sum().reset_index()
+    df_claims_sum = df_claims_cube.groupby(group_by)[claims_kpis].sum().reset_index()
+
+    return df_portfolio_sum.merge(df_claims_sum, how='left', on=group_by).set_index(keys=group_by)
+
+
+
+def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_column_contract_date, row_per_each_contract_year, table_for_prediction, analysis_year_level, portfolio_group_by, claims_group_by, portfolio_kpis, claims_kpis, policy_index=None):
     """
         Prepares the porfolio and claims df so that they can then be used to create either a profitability table or the data set for risk modelling   
         Arguments --> portfolio and claims df, the policy id, and contract date columns names   
@@ -453,6 +573,7 @@ def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_colu
             a boolean indicating if the result from this function will be used to produce a summary profitability table or if we are building the database for risk prediction,   
             the lists of the variables used to make the aggregations: year, portfolio features, claims attributes   
             the list of the kpis used in the sommations: portfolio figures like earned premiums, claims figures like costs   
+            and the portfolio policy index (see index_functions.PolicyIndex built with the contract start date) which gives the policies rows without sorting and merging the portfolio   
         Returns --> a merged policies-claims df
     """
 
@@ -469,20 +590,7 @@ def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_colu
         if analysis_year_level == 'inception' and row_per_each_contract_year == True:
             analysis_year_level = 'effective'
 
-            # Firsly, sorts by the effective date in order to retrieve the latest contract amendment date by removing the other previous duplicates
-            df_portfolio = df_portfolio.sort_values(main_column_contract_date)
-            df_portfolio_nodupl_policy = df_portfolio.drop_duplicates(subset=policy_id_column_name, keep='first').drop(columns=portfolio_kpis)
-
-            # Secondly, aggregates per policy and derive the totals. Now the df will be at policy level, i.e. a unique line per policy. But effective dates have been lost due to the sum
-            df_portfolio_sum = df_portfolio.groupby([policy_id_column_name])[portfolio_kpis].sum().reset_index()
-
-            # Thirdly Link back the effective dates to the policies
-            df_portfolio = df_portfolio_nodupl_policy.merge(df_portfolio_sum, how='left', on=policy_id_column_name)
-
-            # Finally we link the same latest effective date for policies that claimed. Because in the claims data, the contract effective date associated to them is not necessarily the latest one
-            df_claims = df_claims.drop(columns=main_column_contract_date).merge(df_portfolio_nodupl_policy[[policy_id_column_name, main_column_contract_date]], how='left', on=policy_id_column_name)
-
-            df_portfolio_nodupl_policy = None
+            df_portfolio, df_claims = prepare_inception_data(df_portfolio, df_claims, policy_id_column_name, main_column_contract_date, portfolio_kpis, policy_index)
 
     # The table for prediction is a table that keeps all the policies features and will be displayed differently than if a summary table is requested
     else:
@@ -498,7 +606,8 @@ def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_colu
 
         # As we will sum on the data, features will be lost (or summed as well, which is not consistent neither). We retrieve the features by creating a new df and keeping only the latest policy features
         sorting_column = main_column_contract_date
-        df_portfolio_nodupl_policy = df_portfolio.sort_values(sorting_column).drop_duplicates(subset=policy_id_column_name, keep='last').drop(columns=portfolio_kpis)
+        df_portfolio_nodupl_policy = df_portfolio.sort_values(sorting_column).drop_duplicates(subset=policy_id_column_name, keep='last').drop(columns=portfolio_kpis) if policy_index is None \
+            else policy_index.get_policy_rows(keep='last', df=df_portfolio).drop(columns=portfolio_kpis)
 
     # Either this is a summary table per inception or effective year, or it is a table for risk prediction keeping each policy with its amendment contract
     if len(year_group_by) > 0:
@@ -514,12 +623,49 @@ def other_prepare_data(df_portfolio, df_claims, policy_id_column_name, main_colu
     return df_policies_claims, year_group_by
 
 
-def sum_merge_tables(df1, df2, policy_id_column_name, df1_group_by, df2_group_by, df1_kpis, df2_kpis, df_no_dupl=None):
+def prepare_inception_data(df_portfolio, df_claims, policy_id_column_name, main_column_contract_date, portfolio_kpis, policy_index=None):
+    """
+        Puts the portfolio at policy level for an analysis by inception year when it has a row per yearly contract   
+        Arguments --> portfolio and claims df, the policy id and contract date columns names, the portfolio kpis to sum per policy   
+            and the portfolio policy index (see index_functions.PolicyIndex built with the contract start date)   
+        Returns --> the portfolio df with a row per policy keeping its first contract start date and features, and the claims df linked to that date
+    """
+
+    if policy_index is None:
+        # Firsly, sorts by the effective date in order to retrieve the latest contract amendment date by removing the other previous duplicates
+        df_portfolio = df_portfolio.sort_values(main_column_contract_date)
+        df_portfolio_nodupl_policy = df_portfolio.drop_duplicates(subset=policy_id_column_name, keep='first').drop(columns=portfolio_kpis)
+
+        # Secondly, aggregates per policy and derive the totals. Now the df will be at policy level, i.e. a unique line per policy. But effective dates have been lost due to the sum
+        df_portfolio_sum = df_portfolio.groupby([policy_id_column_name])[portfolio_kpis].sum().reset_index()
+
+        # Thirdly Link back the effective dates to the policies
+        df_portfolio = df_portfolio_nodupl_policy.merge(df_portfolio_sum, how='left', on=policy_id_column_name)
+
+        # Finally we link the same latest effective date for policies that claimed. Because in the claims data, the contract effective date associated to them is not necessarily the latest one
+        df_claims = df_claims.drop(columns=main_column_contract_date).merge(df_portfolio_nodupl_policy[[policy_id_column_name, main_column_contract_date]], how='left', on=policy_id_column_name)
+
+    else:
+        # Same steps, the policy rows and the sums being taken in the policy index order so that no merge is needed
+        df_portfolio_nodupl_policy = policy_index.get_policy_rows(keep='first', sort=False, df=df_portfolio)
+        df_portfolio_sum = df_portfolio[portfolio_kpis].groupby(policy_index.codes).sum().reindex(range(len(policy_index.policies)))
+        df_portfolio = df_portfolio_nodupl_policy.drop(columns=portfolio_kpis).assign(**{kpi: df_portfolio_sum[kpi].values for kpi in portfolio_kpis}).reset_index(drop=True)
+
+        policy_positions = policy_index.get_positions(df_claims[policy_id_column_name])
+        df_claims = df_claims.drop(columns=main_column_contract_date)
+        df_claims[main_column_contract_date] = np.where(policy_positions >= 0, df_portfolio[main_column_contract_date].values[policy_positions], np.datetime64('NaT'))
+
+    return df_portfolio, df_claims
+
+
+
+def sum_merge_tables(df1, df2, policy_id_column_name, df1_group_by, df2_group_by, df1_kpis, df2_kpis, df_no_dupl=None, policy_index=None):
     """
         Sums separately two dataframes and merge them   
         Arguments --> the two 2 dataframes to sum and merge, the policy id column name   
             the variables to aggregate on in the two dfs, the kpis to derive in the two dfs   
             a df that contains the portfolio features and no policy duplicates. This df will be used when it is the full data for risk prediction that must be obtained   
+            the portfolio policy index (see index_functions.PolicyIndex built with the contract start date), if given instead of the df with no duplicates the latest features of each policy are taken from it   
         Returns --> A merged df with the kpis summed adequatly
     """
     
@@ -543,6 +689,9 @@ def sum_merge_tables(df1, df2, policy_id_column_name, df1_group_by, df2_group_by
     # Merges portfolio and claims data based on the variables that served to aggregate both two df
     df_merged = df1_sum.merge(df2_sum, how='left', on=df1_group_by).set_index(keys=df1_group_by+df2_group_by)
 
+    if df_no_dupl is None and policy_index is not None:
+        df_no_dupl = policy_index.get_policy_rows(keep='last', df=df1).drop(columns=df1_kpis)
+
     #- The steps above have removed the features, we get them back thanks to the df specified in the argument that corresponds to the portfolio data with features and no duplicates
     if df_no_dupl is not None:
         df_merged = df_no_dupl.merge(df_merged, how='left', on=policy_id_column_name).reset_index(drop=True)
@@ -674,51 +823,117 @@ def derive_totals_analysis(df, portfolio_kpis, portfolio_group_by, claims_group_
         Returns --> the modified df with an additional row corresponding to the totals
     """
 
-    # These lines create the last line of the table that is the total sum
     df_reset_index = df.reset_index()
     group_by_length = df_reset_index.shape[1] - df.shape[1]
+    group_by = list(df_reset_index.columns[:group_by_length])
 
-    # Analysis done only on portfolio features or by either occurrence/inception/effective year
-    if (portfolio_group_by is not None and len(portfolio_group_by) > 0) or (group_by_length == 1 and 'year' in df.index.name):
-        # Figures are derived depending on only one portfolio feature
-        if group_by_length == 1:
-            df.loc['Total'] = df.sum()
+    # Analysis done on claims attributes only: the portfolio kpis (exposure, gwp and gep) are the same on all the rows and must not be summed
+    if (portfolio_group_by is None or len(portfolio_group_by) == 0) and not (group_by_length == 1 and df.index.name is not None and 'year' in df.index.name):
+        constant_kpis, constant_group_by = [kpi for kpi in portfolio_kpis if kpi in df.columns], group_by
+    else:
+        constant_kpis, constant_group_by = None, None
 
-        # The summary table is aggregated on multiple variables
-        else:
-            columns = df_reset_index.select_dtypes(include=['category', 'interval']).columns
-            df_reset_index[columns] = df_reset_index[columns].astype(str)
+    df_total = derive_grouping_sets(df_reset_index, group_by, list(df.columns), grouping_sets=[[]], constant_kpis=constant_kpis, constant_group_by=constant_group_by)
 
-            # Takes only the columns corresponding to the variables that served to aggregate
-            columns = df_reset_index.columns[:group_by_length]
-            # Set the value Total at the bottom of each of these columns
-            for column_name in columns:
-                df_reset_index.loc[df.shape[0], column_name] = 'Total'
+    # The variables that served to aggregate must be able to get the Total value
+    for column_name in group_by:
+        df_reset_index[column_name] = _to_total_dtype(df_reset_index[column_name], 'Total')
 
-            # Derives the total sum over the rows and affect it to the columns of the summary table except the ones that initially served for aggregation
-            df_reset_index.loc[df.shape[0], group_by_length:] = df.sum()
+    df_reset_index = pd.concat((df_reset_index, df_total.reset_index()), ignore_index=True)
 
-            # We put back on index the variables that segment out analysis
-            df = df_reset_index.set_index(list(columns))
+    return df_reset_index.set_index(group_by).rename_axis(df.index.names)
 
-    # Analysis done on just one claim attribute. (Code will be improved later to sum the porfolio kpis through many claims attributes)
-    else:
-        # Gets only portfolio kpis (exposure, gwp and gep)
-        df_portfolio_kpis_sum = df.loc[df.index[df.shape[0]-1]][portfolio_kpis]
-        # Sums the claims kpis (reserves, costs)
-        claims_sum = df.iloc[:, len(df_portfolio_kpis_sum):].sum()
-        # Concatenate both totals of porfolio and claims kpis
-        concat = pd.concat((df_portfolio_kpis_sum, claims_sum)).values
-
-        # Resets the index so that we can create a new row as Total
-        df_reset_index = df.reset_index()
-        df_reset_index.loc[df_reset_index.shape[0], claims_group_by] = 'Total'
-        # Sets back the index, otherwise the concat created above will not have the same length
-        df_reset_index = df_reset_index.set_index(claims_group_by)
-        # Affects to the row the concat values, i.e. premiums, costs totals
-        df_reset_index.loc[df_reset_index.index[df_reset_index.shape[0]-1]] = concat
-        df = df_reset_index
 
-    return df
+
+def derive_grouping_sets(df, group_by, kpis=None, grouping_sets=None, constant_kpis=None, constant_group_by=None, total_name='Total'):
+    """
+        Derives the sums of kpis at several levels of a segmentation, as SQL GROUPING SETS does: the data is aggregated once at the finest level   
+        and each level is then derived from this aggregation (from the finest to the coarsest for a rollup), so the subtotals and totals are consistent   
+        Arguments --> the dataframe, the variables of the segmentation (columns or index levels), the kpis to sum (all the other numerical columns if not specified)   
+            the grouping sets, i.e. the list of the lists of variables to derive the sums on, by default the segmentation levels from the finest to the grand total as SQL ROLLUP   
+            the kpis that do not add up along some variables because they are repeated on each of their rows (e.g. the portfolio kpis in a table by claims attributes)   
+            and these variables, the kpis being summed only once per group of the other variables   
+            and the value given to the variables that are rolled up   
+        Returns --> a dataframe indexed by the segmentation variables with a row per group of each grouping set, sorted so that the subtotals come after their groups
+    """
+
+    df = df.reset_index() if len([column for column in group_by if column not in df.columns]) > 0 else df
+    kpis = [column for column in df.select_dtypes('number').columns if column not in group_by] if kpis is None else kpis
+    grouping_sets = [group_by[:length] for length in range(len(group_by), -1, -1)] if grouping_sets is None else grouping_sets
+    constant_kpis = [] if constant_kpis is None else constant_kpis
+    constant_group_by = [] if constant_group_by is None else constant_group_by
+    additive_kpis = [kpi for kpi in kpis if kpi not in constant_kpis]
+
+    # The only pass on the data: the finest level, the constant kpis being the same on all the rows of a group (a single group for the grand total only)
+    df_grouped = df.groupby(group_by, observed=True, dropna=False) if len(group_by) > 0 else df.groupby(np.zeros(len(df), dtype='int64'))
+    df_finest = df_grouped.agg({**{kpi: 'sum' for kpi in additive_kpis}, **{kpi: 'first' for kpi in constant_kpis}}).reset_index(drop=len(group_by) == 0)
+
+    # The constant kpis are taken once per group of the variables along which they do not vary
+    segment_group_by = [column for column in group_by if column not in constant_group_by]
+    levels_sums = {}
+
+    for grouping_set in sorted(grouping_sets, key=len, reverse=True):
+        # Each level is derived from the smallest finer level already derived
+        finer_sets = [finer_set for finer_set in levels_sums.keys() if set(grouping_set) <= set(finer_set)]
+        df_source = levels_sums[min(finer_sets, key=len)] if len(finer_sets) > 0 else df_finest
+
+        df_level = _sum_by(df_source, grouping_set, additive_kpis)
+
+        if len(constant_kpis) > 0:
+            segments_keys = list(dict.fromkeys(grouping_set + segment_group_by))
+            df_segments = df_finest.groupby(segments_keys, observed=True, dropna=False)[constant_kpis].first().reset_index() if len(segments_keys) > 0 else df_finest[constant_kpis].iloc[:1]
+            df_constant = _sum_by(df_segments, grouping_set, constant_kpis)
+            df_level = df_level.merge(df_constant, how='left', on=grouping_set) if len(grouping_set) > 0 else pd.concat((df_level, df_constant), axis=1)
+
+        levels_sums[tuple(grouping_set)] = df_level
+
+    # The levels are stacked, the rolled up variables getting the total value
+    total_dtypes = {column_name: _to_total_dtype(df_finest[column_name].iloc[:0], total_name).dtype for column_name in group_by}
+    df_levels = []
+
+    for grouping_set in grouping_sets:
+        df_level = levels_sums[tuple(grouping_set)].copy()
+
+        for column_name in group_by:
+            df_level[column_name] = _to_total_dtype(df_level[column_name], total_name, df_finest[column_name].dtype) if column_name in grouping_set else pd.Series(total_name, index=df_level.index, dtype=total_dtypes[column_name])
+
+        df_levels.append(df_level[group_by + kpis])
+
+    df_grouping_sets = pd.concat(df_levels, ignore_index=True)
+
+    # Sorts by the segmentation variables, the totals coming after the values they sum up
+    sorting_codes = []
+
+    for column_name in group_by:
+        uniques = pd.Index(np.asarray(pd.factorize(df_finest[column_name], sort=True)[1], dtype=object), dtype=object)
+        level_codes = uniques.get_indexer(df_grouping_sets[column_name].astype(object))
+        level_codes = np.where(level_codes < 0, len(uniques), level_codes)
+        sorting_codes.append(np.where(df_grouping_sets[column_name].astype(object) == total_name, len(uniques) + 1, level_codes))
+
+    df_grouping_sets = df_grouping_sets.iloc[np.lexsort(sorting_codes[::-1])] if len(sorting_codes) > 0 else df_grouping_sets
+
+    return df_grouping_sets.set_index(group_by) if len(group_by) > 0 else df_grouping_sets
+
+
+
+def _sum_by(df, group_by, kpis):
+    """ Sums the kpis by the variables, an empty list of variables giving a one row df with the grand totals"""
+
+    if len(group_by) == 0:
+        return df[kpis].sum().to_frame().T.reset_index(drop=True)
+
+    return df.groupby(group_by, observed=True, dropna=False)[kpis].sum().reset_index()
+
+
+def _to_total_dtype(values, total_name, dtype=None):
+    """ Converts the values of a segmentation variable so that they can take the total value, the categories being kept when they are not intervals"""
+
+    dtype = values.dtype if dtype is None else dtype
+
+    if isinstance(dtype, pd.CategoricalDtype) == True and isinstance(dtype.categories, pd.IntervalIndex) == False:
+        new_dtype = dtype if total_name in dtype.categories else pd.CategoricalDtype(list(dtype.categories) + [total_name], ordered=dtype.ordered)
+        return values.astype(object).astype(new_dtype)
+
+    return values.astype(object)
 
 # %%
@@ -3,6 +3,7 @@ import numpy as np
 from sklearn.feature_selection import RFECV, SelectFromModel
 from sklearn.model_selection import train_test_split
 from sklearn.decomposition import PCA
+from scipy import sparse
 
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -145,10 +146,11 @@ def run_pca(df, features, scalerMethod, n_components=6):
 
 
 
-def run_select_from_model(X, y, model, **params):
+def run_select_from_model(X, y, model, features_names=None, **params):
     """
         Runs the algorithmn SelectFromModel (based on feature importance) and finds the most relevant features   
-        Arguments --> the features, the dependent variable, the model,   
+        Arguments --> the features (dataframe or scipy sparse matrix), the dependent variable, the model,   
+            the names of the sparse matrix columns (only if X is a sparse matrix)   
             and the params for the selectFromModel method like the number max of features to select   
         Returns --> the selector along with the retained features
     """
@@ -157,8 +159,7 @@ def run_select_from_model(X, y, model, **params):
     selector.fit(X, y)
 
     # Gets the features that have been selected
-    new_X = X.drop(columns=X.columns[np.where(selector.get_support() == False)[0]])
-    relevant_features = new_X.columns.tolist()
+    relevant_features = get_selected_features(X, selector.get_support(), features_names)
 
     print('The threshold for selection is {0} and the features that seem to be the most important are: {1}'.format(selector.threshold_, relevant_features))
 
@@ -166,13 +167,14 @@ def run_select_from_model(X, y, model, **params):
 
 
 
-def run_rfe(X, y, model, with_plot_scoring_curve=True, fig_size_scoring=(16, 9), with_plot_features_importance=True, fig_size_importance=(16, 9), **params):
+def run_rfe(X, y, model, with_plot_scoring_curve=True, fig_size_scoring=(16, 9), with_plot_features_importance=True, fig_size_importance=(16, 9), features_names=None, **params):
 
     """
         Performs a recursive feature elimination to select the most important features   
-        Arguments --> the features, the target variable,   
+        Arguments --> the features (dataframe or scipy sparse matrix), the target variable,   
             a boolean indicating if it needs to plot the score curve depending on the number of features kept, its figure size,   
             a boolean indicating if it plots the selected feature importance and the figure size,   
+            the names of the sparse matrix columns (only if X is a sparse matrix)   
             the kwargs are the arguments for the model like the number of folds to use for cross validation, the scoring method ('accuracy', 'explained variance' etc.)   
         Returns --> the rfe along with the retained features
     """
@@ -181,8 +183,9 @@ def run_rfe(X, y, model, with_plot_scoring_curve=True, fig_size_scoring=(16, 9),
     rfecv.fit(X, y)
 
     # Gets the features that have been selected
-    new_X = X.drop(columns=X.columns[np.where(rfecv.get_support() == False)[0]])
-    relevant_features = new_X.columns.tolist()
+    relevant_features = get_selected_features(X, rfecv.get_support(), features_names)
+    # Only the selected features names are needed for the importance plot, which avoids densifying a sparse matrix
+    new_X = pd.DataFrame(columns=relevant_features)
 
     if with_plot_scoring_curve == True:
         plot_scoring_curve(rfecv, figsize=fig_size_scoring)
@@ -196,6 +199,19 @@ def run_rfe(X, y, model, with_plot_scoring_curve=True, fig_size_scoring=(16, 9),
 
 
 
+def get_selected_features(X, support, features_names=None):
+    """
+        Gets the names of the features kept by a selection method   
+        Arguments --> the features (dataframe or scipy sparse matrix), the boolean mask of the features kept, and the names of the sparse matrix columns   
+        Returns --> the list of the features kept
+    """
+
+    features_names = X.columns if sparse.issparse(X) == False else features_names
+
+    return [feature for feature, selected in zip(features_names, support) if selected == True]
+
+
+
 def correlation_from_model(df, features_corr_matrice, model, draws=5, additional_outputs=None, target_column=None, corr_threshold=0.5, figsize=(10,10)):
     """
         Gets the features correlation coeffient for a specific type of relation determined by the model chosen in arguments   
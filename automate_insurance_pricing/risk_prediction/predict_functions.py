@@ -108,9 +108,9 @@ def print_linear_predictor(coefs, names=None, transformer=FunctionTransformer(),
 
 def run_model_predictions(model_name, model, X_train, X_test, y_train, y_test, features, transformer=FunctionTransformer()):
     """ Runs a model   
-        Arguments --> the model name, the model, the train and test independent and target variables   
-            the transformer object which corresponds to the link for a GLM,   
-        Returns --> the results obtained by the model
+        Arguments --> the model name, the model, the train and test independent and target variables (dataframes or scipy sparse matrices)   
+            the features names (for sparse matrices, the names of all their columns), the transformer object which corresponds to the link for a GLM,   
+        Returns --> the results obtained by the model, with the coefficients as a pandas serie (a dataframe with a row per class for multiclass classifiers) or the features importances
     """
 
     results = {}
@@ -123,14 +123,27 @@ def run_model_predictions(model_name, model, X_train, X_test, y_train, y_test, f
 
     results['predictions'] = transformer.inverse_transform(model_fit.predict(X_test))
 
-    if hasattr(model_fit, 'coefs'):
+    if hasattr(model_fit, 'alpha_'):
         results['alpha'] = alpha = round(model_fit.alpha_, 5)
 
-    if hasattr(model_fit, 'coefs'):
-        try:
-            results['coefs'] = pd.Series(model_fit.coef_[0], index = X_train[features].columns)
-        except:
-            results['coefs'] = pd.Series(model_fit.coef_, index = X_train[features].columns)
+    # The model is fitted on all the columns of a dataframe, a sparse matrix (or an array) has no columns so the features names are the ones given in the arguments
+    features_names = X_train.columns if isinstance(X_train, pd.DataFrame) == True else pd.Index(features)
+
+    if hasattr(model_fit, 'coef_') or hasattr(model_fit, 'feature_importances_'):
+        values = model_fit.coef_ if hasattr(model_fit, 'coef_') else model_fit.feature_importances_
+
+        if len(features_names) != np.shape(values)[-1]:
+            raise ValueError('The model has {} coefficients but {} features names were found, the features must name all the columns of a sparse matrix'.format(np.shape(values)[-1], len(features_names)))
+
+    if hasattr(model_fit, 'coef_'):
+        # Multiclass classifiers have a row of coefficients per class, a binary classifier has a single row (the one of the positive class)
+        if np.ndim(model_fit.coef_) > 1 and len(model_fit.coef_) > 1:
+            results['coefs'] = pd.DataFrame(model_fit.coef_, index = getattr(model_fit, 'classes_', None), columns = features_names)
+        else:
+            results['coefs'] = pd.Series(np.ravel(model_fit.coef_), index = features_names)
+
+    elif hasattr(model_fit, 'feature_importances_'):
+        results['features_importances'] = pd.Series(model_fit.feature_importances_, index = features_names)
 
     return results
 
@@ -1,3 +1,6 @@
+import numpy as np
+import pandas as pd
+
 from datetime import date
 
 
@@ -12,6 +15,54 @@ def addYears(d, years):
         return d + (date(d.year + years, 1, 1) - date(d.year, 1, 1))
 
 
+def add_years_to_dates(dates, years):
+    """
+        Gets new dates after adding a number of years to each initial date, the array counterpart of addYears   
+        As in addYears, a February 29 gives a March 1 when the new year is not a leap year   
+        Arguments --> the initial dates (pandas serie or numpy datetime64 array), the number of years to add (integer or array of integers)   
+        Returns --> the new dates, as a pandas serie with the same index if a serie was given, otherwise as a numpy datetime64 array
+    """
+
+    values = to_datetime64(dates)
+    months = values.astype('datetime64[M]')
+    # Going through the month keeps the day and time as an offset, so that February 29 naturally overflows to March 1
+    new_months = months + (np.asarray(years).astype('int64') * 12).astype('timedelta64[M]')
+    new_dates = new_months.astype('datetime64[ns]') + (values - months.astype('datetime64[ns]'))
+
+    if isinstance(dates, pd.Series) == True:
+        return pd.Series(new_dates, index=dates.index, name=dates.name)
+
+    return new_dates
+
+
+def to_datetime64(values):
+    """
+        Converts dates to numpy datetime64 values at nanosecond precision so that they can be used in array calculations   
+        Arguments --> a single date (date, datetime, pandas timestamp) or a collection of dates (pandas serie, array, list)   
+        Returns --> a numpy datetime64 scalar or array
+    """
+
+    if np.ndim(values) == 0:
+        return pd.Timestamp(values).to_datetime64().astype('datetime64[ns]')
+
+    return np.asarray(pd.to_datetime(values), dtype='datetime64[ns]')
+
+
+def days_between(start_dates, end_dates):
+    """
+        Derives the number of full days between two arrays of dates, the same way the days attribute of a python timedelta does (i.e. rounded down)   
+        Arguments --> the start and end dates as numpy datetime64 arrays or scalars   
+        Returns --> a float array with the number of days, NaN when one of the dates is missing
+    """
+
+    differences = np.asarray(end_dates - start_dates)
+    missing = np.isnat(differences)
+    # Missing dates are replaced before the division so that numpy does not raise a warning, then set back to NaN
+    days = np.where(missing, np.timedelta64(0, 'D'), differences) // np.timedelta64(1, 'D')
+
+    return np.where(missing, np.nan, days)
+
+
 def remove_words(word, **kwargs):
     """
         Replaces part of the word by another value  
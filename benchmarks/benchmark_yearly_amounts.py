@@ -0,0 +1,45 @@
+"""
+    Benchmarks the derivation of the yearly exposures, row by row with derive_annual_exposure (as derive_yearly_amounts used to do) against derive_yearly_exposures
+    Run it from the repository root: python -m benchmarks.benchmark_yearly_amounts [number of policies]
+"""
+
+import sys
+import time
+
+import pandas as pd
+import numpy as np
+
+from datetime import datetime
+
+from automate_insurance_pricing.preprocessing.create_functions import *
+
+
+def make_portfolio(number_of_policies, seed=42):
+    """ Builds a random portfolio of annual contracts written over the business years"""
+
+    random_state = np.random.RandomState(seed)
+    start_dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(random_state.randint(0, 6 * 365, number_of_policies), unit='D')
+    end_dates = start_dates + pd.to_timedelta(random_state.randint(30, 3 * 365, number_of_policies), unit='D')
+
+    return pd.DataFrame({'contract_start_date': start_dates, 'contract_end_date': end_dates})
+
+
+def run_benchmark(number_of_policies=100000, start_business_year=2015, extraction_date=datetime(2021, 6, 30)):
+    """ Times both implementations on the same portfolio and checks they give the same exposures"""
+
+    df = make_portfolio(number_of_policies)
+
+    start_time = time.perf_counter()
+    expected = {'exposure_in_{}'.format(year): df.apply(lambda x: derive_annual_exposure(x, year, extraction_date, 'contract_start_date', 'contract_end_date', False), axis=1) for year in range(start_business_year, extraction_date.year + 1)}
+    row_by_row_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    df_exposures = derive_yearly_exposures(df, start_business_year, extraction_date, 'contract_start_date', 'contract_end_date')
+    vectorized_time = time.perf_counter() - start_time
+
+    assert np.allclose(pd.DataFrame(expected).values.astype('float64'), df_exposures.values)
+    print('{} policies over {} years: {:.3f}s row by row, {:.3f}s vectorized ({:.0f}x faster)'.format(number_of_policies, len(expected), row_by_row_time, vectorized_time, row_by_row_time / vectorized_time))
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
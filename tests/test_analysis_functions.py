@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from datetime import datetime
+
+from automate_insurance_pricing.preprocessing.create_functions import *
+from automate_insurance_pricing.preprocessing.index_functions import *
+from automate_insurance_pricing.risk_performance.analysis_functions import *
+
+
+def make_portfolio(number_of_policies=300, seed=0):
+    """ Builds a random portfolio with a region written only in the first years, so that it has no exposure in the last ones"""
+
+    random_state = np.random.RandomState(seed)
+    start_dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(random_state.randint(0, 5 * 365, number_of_policies), unit='D')
+    regions = np.where(random_state.rand(number_of_policies) < 0.5, 'north', 'south')
+    start_dates = start_dates.where(regions != 'north', pd.Timestamp('2015-03-01'))
+    end_dates = start_dates + pd.to_timedelta(364, unit='D')
+
+    return pd.DataFrame({'policy_id': np.arange(number_of_policies), 'region': regions, 'contract_start_date': start_dates, 'contract_end_date': end_dates, 'asif_written_premium_excl_taxes': random_state.uniform(100, 1000, number_of_policies)})
+
+
+@pytest.mark.parametrize('df_group_by', [None, 'region'])
+def test_derive_per_occurrence_year_long_matches_wide(df_group_by):
+    df = make_portfolio()
+    arguments = (2015, datetime(2020, 6, 30), 'contract_start_date', 'contract_end_date')
+
+    df_wide = derive_yearly_amounts(df, *arguments)
+    df_long = derive_yearly_amounts(df, *arguments, long_format=True)
+
+    expected = derive_per_occurrence_year(df_wide, 2015, 2020, 'contract_start_date', columns_to_sum=df_wide.columns, df_group_by=df_group_by)
+    result = derive_per_occurrence_year(df, 2015, 2020, 'contract_start_date', columns_to_sum=df.columns, df_group_by=df_group_by, df_long=df_long)
+
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+
+def make_analysis_data(number_of_policies=120, seed=0):
+    """ Builds a portfolio with a row per yearly contract, a feature with missing values and a categorical one with an unused category, and claims linked to its rows"""
+
+    random_state = np.random.RandomState(seed)
+    policy_ids = np.repeat(np.arange(number_of_policies), random_state.randint(1, 4, number_of_policies))
+    contract_years = pd.Series(policy_ids).groupby(policy_ids).cumcount().values
+    start_dates = pd.Timestamp('2018-01-01') + pd.to_timedelta(random_state.randint(0, 365, number_of_policies)[policy_ids] + 365 * contract_years, unit='D')
+    regions = np.array(['north', 'south', None, 'west'], dtype=object)[random_state.randint(0, 4, number_of_policies)][policy_ids]
+    age_bands = pd.Categorical(np.array(['18-25', '25-40', '40+'])[random_state.randint(0, 3, len(policy_ids))], categories=['18-25', '25-40', '40+', '65+'], ordered=True)
+
+    df_portfolio = pd.DataFrame({'policy_id': policy_ids, 'contract_start_date': start_dates, 'region': regions, 'age_band': age_bands, 'exposure': random_state.uniform(0.2, 1, len(policy_ids)), 'asif_written_premium_excl_taxes': random_state.uniform(100, 500, len(policy_ids))})
+    df_portfolio['asif_earned_premium'] = df_portfolio['asif_written_premium_excl_taxes'] * df_portfolio['exposure']
+
+    for year in range(2018, 2021):
+        df_portfolio['asif_earned_premium_in_{}'.format(year)] = df_portfolio['asif_earned_premium'] / 3
+
+    df_claims = df_portfolio.iloc[random_state.randint(0, len(df_portfolio), 80)][['policy_id', 'contract_start_date', 'region', 'age_band']].reset_index(drop=True)
+    df_claims['asif_total_cost'] = random_state.uniform(100, 5000, len(df_claims))
+    df_claims['asif_total_capped_cost'] = df_claims['asif_total_cost'].clip(upper=3000)
+    df_claims['count_claim'] = 1
+
+    return df_portfolio, df_claims
+
+
+ANALYSIS_ARGUMENTS = (['exposure', 'asif_written_premium_excl_taxes', 'asif_earned_premium'], ['asif_total_cost', 'asif_total_capped_cost', 'count_claim'], 3000, 0.1, 0.2, 0.25, 0.6, 2018, 2020, 'contract_start_date')
+
+
+@pytest.mark.parametrize('analysis_year_level', [None, 'effective', 'inception'])
+@pytest.mark.parametrize('rate_increase_params', [None, {'south_increase': ('region', 'south', 0.1), 'young_increase': ('age_band', '18-25', 0.05)}])
+@pytest.mark.parametrize('use_policy_index', [False, True])
+def test_run_multi_analysis_by_feature_matches_build_table(analysis_year_level, rate_increase_params, use_policy_index):
+    df_portfolio, df_claims = make_analysis_data()
+    policy_index = PolicyIndex(df_portfolio, 'policy_id', 'contract_start_date') if use_policy_index == True else None
+    features = ['region', 'age_band', ['region', 'age_band']]
+
+    results = run_multi_analysis_by_feature(df_portfolio, df_claims, *ANALYSIS_ARGUMENTS, analysis_year_level=analysis_year_level, features=features, rate_increase_params=rate_increase_params, policy_index=policy_index)
+
+    assert list(results.keys()) == ['region', 'age_band', ('region', 'age_band')]
+
+    for feature in features:
+        expected = build_table(df_portfolio, df_claims, *ANALYSIS_ARGUMENTS, table_for_prediction=False, analysis_year_level=analysis_year_level, portfolio_group_by_columns=feature, rate_increase_params=rate_increase_params, policy_index=policy_index)
+        pd.testing.assert_frame_equal(results[tuple(feature) if isinstance(feature, list) == True else feature], expected, check_dtype=False)
+
+
+def make_segments_table():
+    return pd.DataFrame({'region': ['south', 'north', 'south', None, 'north', 'south'], 'formula': ['basic', 'basic', 'premium', 'basic', 'premium', 'basic'], 'exposure': [1.0, 2, 3, 4, 5, 6], 'claims': [10.0, 0, 5, 1, 2, 3]})
+
+
+def test_derive_grouping_sets_rollup_subtotals_and_ordering():
+    df = make_segments_table()
+
+    df_rollup = derive_grouping_sets(df, ['region', 'formula'])
+
+    expected_index = [('north', 'basic'), ('north', 'premium'), ('north', 'Total'), ('south', 'basic'), ('south', 'premium'), ('south', 'Total'), (np.nan, 'basic'), (np.nan, 'Total'), ('Total', 'Total')]
+    assert df_rollup.index.tolist() == expected_index
+    assert df_rollup['exposure'].tolist() == [2, 5, 7, 7, 3, 10, 4, 4, 21]
+    assert df_rollup['claims'].tolist() == [0, 2, 2, 13, 5, 18, 1, 1, 21]
+
+
+def test_derive_grouping_sets_grand_total_and_custom_sets():
+    df = make_segments_table()
+
+    df_grand_total = derive_grouping_sets(df, [], ['exposure', 'claims'])
+    df_sets = derive_grouping_sets(df, ['region', 'formula'], grouping_sets=[['formula'], []])
+
+    assert df_grand_total[['exposure', 'claims']].values.tolist() == [[21, 21]]
+    assert df_sets.index.tolist() == [('Total', 'basic'), ('Total', 'premium'), ('Total', 'Total')]
+    assert df_sets['exposure'].tolist() == [13, 8, 21]
+
+
+def test_derive_grouping_sets_counts_constant_kpis_once_per_segment():
+    # The exposure of a region is repeated on each of its claims attributes rows
+    df = pd.DataFrame({'region': ['north', 'north', 'south', 'south', 'south'], 'guarantee': ['fire', 'theft', 'fire', 'theft', 'water'], 'exposure': [10.0, 10, 30, 30, 30], 'claims': [1.0, 2, 3, 4, 5]})
+
+    df_rollup = derive_grouping_sets(df, ['region', 'guarantee'], constant_kpis=['exposure'], constant_group_by=['guarantee'])
+
+    assert df_rollup.loc[('north', 'Total'), 'exposure'] == 10 and df_rollup.loc[('south', 'Total'), 'exposure'] == 30
+    assert df_rollup.loc[('Total', 'Total'), 'exposure'] == 40 and df_rollup.loc[('Total', 'Total'), 'claims'] == 15
+
+
+def test_derive_totals_analysis_claims_attributes_keeps_portfolio_kpis():
+    df = pd.DataFrame({'guarantee': ['fire', 'theft', 'water'], 'exposure': [100.0, 100, 100], 'claims': [1.0, 2, 3]}).set_index('guarantee')
+
+    df_totals = derive_totals_analysis(df, ['exposure'], [], ['guarantee'])
+
+    assert df_totals.index.tolist() == ['fire', 'theft', 'water', 'Total']
+    assert df_totals.loc['Total'].tolist() == [100, 6]
+
+
+@pytest.mark.parametrize('keys', [[0.5, 0.75, 1.0], pd.cut([20, 30, 50], [18, 25, 40, 80]), pd.Categorical(['young', 'middle', 'old'], categories=['young', 'middle', 'old', 'senior'])])
+def test_derive_totals_analysis_float_interval_and_categorical_keys(keys):
+    df = pd.DataFrame({'exposure': [1.0, 2, 3], 'claims': [0.0, 1, 5]}, index=pd.Index(keys, name='feature'))
+
+    df_totals = derive_totals_analysis(df, ['exposure'], ['feature'], [])
+
+    assert df_totals.index.tolist() == list(df.index) + ['Total']
+    assert df_totals.loc['Total'].tolist() == [6, 6]
+    np.testing.assert_array_equal(df_totals.iloc[:-1].values, df.values)
+
+    # The categories are kept, the total being added to them, whereas intervals can not take another value
+    if isinstance(keys, pd.Categorical) == True and isinstance(keys.categories, pd.IntervalIndex) == False:
+        assert df_totals.index.dtype.categories.tolist() == ['young', 'middle', 'old', 'senior', 'Total']
+
+
+def test_derive_totals_analysis_several_features_with_missing_keys():
+    df = make_segments_table().groupby(['region', 'formula'], dropna=False).sum()
+
+    df_totals = derive_totals_analysis(df, ['exposure'], ['region', 'formula'], [])
+
+    assert df_totals.index[-1] == ('Total', 'Total')
+    assert df_totals.loc[('Total', 'Total')].tolist() == [21, 21]
+    assert len(df_totals) == len(df) + 1
@@ -0,0 +1,220 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from datetime import timedelta
+
+from automate_insurance_pricing.exploration.checks_functions import *
+from automate_insurance_pricing.preprocessing.index_functions import *
+
+
+def check_row_consistency_loop(x, df, policy_id_column_name, main_column_contract_date, claim_occurrence_date, unknown_row_name, number_of_days):
+    """ Row by row version check_row_consistency used to be, kept as reference"""
+
+    row = df.loc[x]
+    policy_id = row[policy_id_column_name]
+    result = 0
+    effective_date = row[main_column_contract_date]
+    effective_dates = df[df[policy_id_column_name]==policy_id][main_column_contract_date]
+
+    if policy_id != unknown_row_name:
+        if effective_date > row[claim_occurrence_date]:
+            result = 1
+        elif effective_date + timedelta(number_of_days) <= row[claim_occurrence_date] and effective_date < effective_dates.max():
+            result = 1
+
+    return result
+
+
+def test_check_row_consistency_matches_row_by_row():
+    random_state = np.random.RandomState(0)
+    start_dates = pd.Timestamp('2018-01-01') + pd.to_timedelta(random_state.randint(0, 3 * 365, 200), unit='D')
+    df = pd.DataFrame({'policy_id': random_state.choice(['A', 'B', 'C', 'D', 'UNKNOWN'], 200), 'contract_start_date': start_dates, 'occurrence_date': start_dates + pd.to_timedelta(random_state.randint(-100, 600, 200), unit='D')})
+    arguments = ('policy_id', 'contract_start_date', 'occurrence_date', 'UNKNOWN', 365)
+
+    expected = [check_row_consistency_loop(x, df, *arguments) for x in df.index]
+
+    assert [check_row_consistency(x, df, *arguments) for x in df.index] == expected
+    assert check_rows_consistency(df, *arguments).tolist() == expected
+
+
+def perform_sense_check_loop(df, new_cell_name=None, **kwargs):
+    """ Concat per rule version perform_sense_check used to be, kept as reference"""
+
+    df_check = pd.DataFrame()
+
+    for value in kwargs.values():
+        compare = df[value[1]] if isinstance(value[1], str) == True else value[1]
+
+        if value[2] == 0:
+            mask = df[value[0]] == compare
+        elif value[2] == 1:
+            mask = df[value[0]] <= compare if len(value) < 4 or value[3] == False else df[value[0]] < compare
+        else:
+            mask = df[value[0]] >= compare if len(value) < 4 or value[3] == False else df[value[0]] > compare
+
+        if new_cell_name is None:
+            df_check = pd.concat((df_check, df[mask]), axis=0).drop_duplicates(keep='first')
+        else:
+            df[new_cell_name] = df[new_cell_name] | mask if new_cell_name in df.columns else mask
+
+    if new_cell_name is None:
+        return df_check
+
+
+def make_policies():
+    random_state = np.random.RandomState(0)
+    df = pd.DataFrame({'age': random_state.randint(16, 90, 300).astype('float64'), 'licence_age': random_state.randint(0, 60, 300), 'vehicle_age': random_state.randint(0, 30, 300)})
+    df.loc[[5, 17], 'age'] = np.nan
+    # Duplicated rows are dropped from the rows flagged
+    df.iloc[[40, 41]] = df.iloc[[30, 30]].values
+
+    return df
+
+
+# Strict and non strict comparisons with numbers and columns, the rules overlapping on many rows
+SENSE_CHECK_RULES = {'too_young': ('age', 18, 1, True), 'licence_before_birth': ('licence_age', 'age', 2), 'young_or_eighteen': ('age', 18, 1), 'old_vehicle': ('vehicle_age', 25, 2, True), 'new_vehicle': ('vehicle_age', 0, 0), 'licence_equal_age': ('licence_age', 'age', 0), 'licence_after_vehicle': ('licence_age', 'vehicle_age', 1, True)}
+
+
+@pytest.mark.parametrize('use_eval', [False, True])
+def test_perform_sense_check_matches_concat_per_rule(use_eval):
+    df = make_policies()
+
+    df_check = perform_sense_check(df, use_eval=use_eval, **SENSE_CHECK_RULES)
+    expected = perform_sense_check_loop(df, **SENSE_CHECK_RULES)
+
+    pd.testing.assert_frame_equal(df_check, expected)
+
+
+@pytest.mark.parametrize('use_eval', [False, True])
+def test_perform_sense_check_flags_rows_as_concat_per_rule(use_eval):
+    df, expected = make_policies(), make_policies()
+
+    perform_sense_check(df, 'inconsistent', use_eval=use_eval, **SENSE_CHECK_RULES)
+    perform_sense_check(df, 'inconsistent', use_eval=use_eval, vehicle_check=('vehicle_age', 10, 0))
+    perform_sense_check_loop(expected, 'inconsistent', **SENSE_CHECK_RULES)
+    perform_sense_check_loop(expected, 'inconsistent', vehicle_check=('vehicle_age', 10, 0))
+
+    pd.testing.assert_series_equal(df['inconsistent'], expected['inconsistent'])
+
+
+def test_sense_check_rules_bitmask_with_more_than_64_rules():
+    df = make_policies()
+    rules = {'vehicle_age_{}'.format(rule_number): ('vehicle_age', rule_number % 30, rule_number % 3, rule_number % 2 == 0) for rule_number in range(150)}
+    sense_check_rules = SenseCheckRules(**rules)
+
+    bitmask = sense_check_rules.evaluate(df)
+    df_flagged = sense_check_rules.flagged_rules(bitmask)
+
+    assert bitmask.shape == (len(df), 3) and bitmask.dtype == np.uint64
+    assert df_flagged.columns.tolist() == list(rules.keys())
+
+    for rule_name, (column, value, comparison, strict) in rules.items():
+        df_expected = df.copy()
+        perform_sense_check_loop(df_expected, 'flag', rule=(column, value, comparison, strict))
+        np.testing.assert_array_equal(df_flagged[rule_name].values, df_expected['flag'].values)
+
+    np.testing.assert_array_equal(sense_check_rules.evaluate(df, use_eval=True), bitmask)
+    pd.testing.assert_frame_equal(perform_sense_check(df, **rules), perform_sense_check_loop(df, **rules))
+
+
+def make_portfolio_and_claims():
+    df_portfolio = pd.DataFrame({'policy_id': [1, 2, 3, 4], 'region': ['north', 'south', 'north', 'south'], 'age': [30, 40, 50, 44], 'premium': [100.0, 200, 300, 400]})
+    df_claims = pd.DataFrame({'claim_id': [10, 11, 12, 13], 'policy_id': [1, 9, 3, 8], 'cost': [50.0, 60, 70, 80]}, index=[5, 6, 7, 8])
+
+    return df_portfolio, df_claims
+
+
+@pytest.mark.parametrize('use_policy_index', [False, True])
+def test_create_unknown_policy(use_policy_index):
+    df_portfolio, df_claims = make_portfolio_and_claims()
+    policy_index = PolicyIndex(df_portfolio) if use_policy_index == True else None
+
+    new_df_portfolio, new_df_claims = create_unknown_policy(df_portfolio, df_claims, ['region', 'age'], policy_index=policy_index)
+
+    # The mode and the average count the last row twice, the last row being duplicated to create the new one
+    assert new_df_portfolio.iloc[-1].tolist() == ['UNKNOWN', 'south', (30 + 40 + 50 + 44 + 44) / 5, 400]
+    pd.testing.assert_frame_equal(new_df_portfolio.iloc[:-1], df_portfolio, check_dtype=False)
+    assert new_df_claims['policy_id'].tolist() == [1, 'UNKNOWN', 3, 'UNKNOWN']
+    pd.testing.assert_frame_equal(new_df_claims.drop(columns='policy_id'), df_claims.drop(columns='policy_id'))
+    assert df_claims['policy_id'].tolist() == [1, 9, 3, 8]
+
+
+def add_back_lines_loop(df, df_removed, main_column_contract_date, claim_id_column_name, claim_occurrence_date_column_name):
+    """ Version add_back_lines used to be, setting the dates after the concatenation, kept as reference"""
+
+    wrongly_removed = df_removed[~df_removed[claim_id_column_name].isin(df[claim_id_column_name])].drop_duplicates(subset=claim_id_column_name, keep='last')
+    new_df = pd.concat((df, wrongly_removed), sort=False).reset_index(drop=True)
+    new_df.loc[new_df.shape[0]-wrongly_removed.shape[0]:, claim_occurrence_date_column_name] = new_df.loc[new_df.shape[0]-wrongly_removed.shape[0]:, main_column_contract_date] + timedelta(days=1)
+
+    return new_df
+
+
+def test_add_back_lines():
+    df = pd.DataFrame({'claim_id': [1, 2], 'contract_start_date': pd.to_datetime(['2019-01-01', '2019-06-01']), 'occurrence_date': pd.to_datetime(['2019-03-01', '2019-07-01']), 'cost': [10.0, 20]})
+    # The claim 2 is still in the data and the claim 3 was removed twice, only its last line being restored
+    df_removed = pd.DataFrame({'claim_id': [2, 3, 3, 4], 'contract_start_date': pd.to_datetime(['2019-06-01', '2020-01-01', '2020-02-01', '2020-05-01']), 'occurrence_date': pd.to_datetime(['2018-01-01', '2019-12-01', '2019-12-15', '2022-01-01']), 'cost': [20.0, 30, 35, 40]}, index=[7, 8, 9, 10])
+
+    new_df = add_back_lines(df, df_removed, 'contract_start_date', 'claim_id', 'occurrence_date')
+
+    pd.testing.assert_frame_equal(new_df, add_back_lines_loop(df, df_removed, 'contract_start_date', 'claim_id', 'occurrence_date'))
+    assert new_df['claim_id'].tolist() == [1, 2, 3, 4] and new_df['cost'].tolist() == [10, 20, 35, 40]
+    assert new_df['occurrence_date'].iloc[2:].tolist() == [pd.Timestamp('2020-02-02'), pd.Timestamp('2020-05-02')]
+
+
+def find_outliers_positions_loop(df, columns, method, z_score_threshold=3, group_by=None):
+    """ Finds the outliers segment by segment, with the bounds the former find_outliers derived on the whole data"""
+
+    outliers_labels = []
+
+    for segment, df_segment in ([(None, df)] if group_by is None else df.groupby(group_by, dropna=False)):
+        kept = pd.Series(True, index=df_segment.index)
+
+        if method == 'interquartile':
+            for column in columns:
+                quantile_25, quantile_75 = df_segment[column].quantile(0.25), df_segment[column].quantile(0.75)
+                interquartile_range = quantile_75 - quantile_25
+                kept &= (df_segment[column] >= quantile_25 - 1.5 * interquartile_range) & (df_segment[column] <= quantile_75 + 1.5 * interquartile_range)
+        else:
+            kept &= (np.abs(stats.zscore(df_segment[columns])) < z_score_threshold).all(axis=1)
+
+        outliers_labels += df_segment.index[~kept].tolist()
+
+    return np.sort(df.index.get_indexer(outliers_labels))
+
+
+def make_claims_amounts():
+    random_state = np.random.RandomState(0)
+    df = pd.DataFrame({'guarantee': random_state.choice(['fire', 'theft', 'water'], 600), 'region': random_state.choice(['north', 'south', None], 600), 'cost': random_state.lognormal(7, 1, 600), 'count_claim': random_state.poisson(1, 600).astype('float64')}, index=np.arange(600) * 3)
+    df.loc[df['guarantee'] == 'fire', 'cost'] *= 10
+
+    return df
+
+
+@pytest.mark.parametrize('method, z_score_threshold', [('interquartile', 3), ('z-score', 3), ('z-score', 2)])
+@pytest.mark.parametrize('group_by', [None, 'guarantee', ['guarantee', 'region']])
+def test_find_outliers_positions_matches_loop_per_segment(method, z_score_threshold, group_by):
+    df = make_claims_amounts()
+
+    outliers_positions = find_outliers_positions(df, ['cost', 'count_claim'], method=method, z_score_threshold=z_score_threshold, group_by=group_by)
+
+    np.testing.assert_array_equal(outliers_positions, find_outliers_positions_loop(df, ['cost', 'count_claim'], method, z_score_threshold, group_by))
+
+
+@pytest.mark.parametrize('columns', ['cost', ['cost', 'count_claim']])
+def test_find_outliers_returns_data_outliers_and_data_without_them(columns):
+    df = make_claims_amounts()
+    # A few outliers only, so that they are removed
+    df_small_outliers = pd.concat((df[df['guarantee'] == 'theft'].assign(cost=100.0, count_claim=1.0), df[df['guarantee'] != 'theft'].iloc[:3]))
+
+    for df_checked in [df, df_small_outliers]:
+        outliers_positions = find_outliers_positions_loop(df_checked, [columns] if isinstance(columns, str) == True else columns, 'interquartile')
+        df_initial, df_outliers, df_without_outliers = find_outliers(df_checked, columns)
+
+        pd.testing.assert_frame_equal(df_initial, df_checked)
+        assert df_initial is not df_checked
+        pd.testing.assert_frame_equal(df_outliers, df_checked.iloc[outliers_positions])
+
+        # The outliers are only removed when they are less than 5% of the data
+        expected = df_checked.drop(index=df_checked.index[outliers_positions]) if len(outliers_positions) / len(df_checked) <= 0.05 else df_checked
+        pd.testing.assert_frame_equal(df_without_outliers, expected)
@@ -0,0 +1,272 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from datetime import datetime
+
+from automate_insurance_pricing.preprocessing.create_functions import *
+from automate_insurance_pricing.preprocessing.sketch_functions import *
+
+
+def make_portfolio(number_of_policies=500, seed=0):
+    """ Builds a random portfolio with leap days, missing end dates and contracts still running at the extraction date"""
+
+    random_state = np.random.RandomState(seed)
+    start_dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(random_state.randint(0, 6 * 365, number_of_policies), unit='D')
+    start_dates = start_dates.where(random_state.rand(number_of_policies) > 0.05, pd.Timestamp('2016-02-29'))
+    end_dates = start_dates + pd.to_timedelta(random_state.randint(1, 4 * 365, number_of_policies), unit='D')
+    end_dates = end_dates.where(random_state.rand(number_of_policies) > 0.1, pd.NaT)
+
+    return pd.DataFrame({'policy_id': np.arange(number_of_policies), 'contract_start_date': start_dates, 'contract_end_date': end_dates, 'asif_written_premium_excl_taxes': random_state.uniform(100, 1000, number_of_policies)})
+
+
+@pytest.mark.parametrize('add_one_day', [False, True])
+def test_derive_yearly_exposures_matches_row_by_row(add_one_day):
+    df = make_portfolio()
+    extraction_date = datetime(2021, 6, 30)
+
+    df_exposures = derive_yearly_exposures(df, 2015, extraction_date, 'contract_start_date', 'contract_end_date', add_one_day)
+
+    for year in range(2015, 2022):
+        expected = df.apply(lambda x: derive_annual_exposure(x, year, extraction_date, 'contract_start_date', 'contract_end_date', add_one_day), axis=1)
+        np.testing.assert_allclose(df_exposures['exposure_in_{}'.format(year)].values, expected.values.astype('float64'))
+
+
+def test_derive_yearly_exposures_missing_end_date_runs_to_extraction_date():
+    df = pd.DataFrame({'contract_start_date': [pd.Timestamp('2020-01-01')], 'contract_end_date': [pd.NaT]})
+
+    df_exposures = derive_yearly_exposures(df, 2020, datetime(2021, 7, 1), 'contract_start_date', 'contract_end_date')
+
+    assert df_exposures['exposure_in_2020'].iloc[0] == 1
+    assert df_exposures['exposure_in_2021'].iloc[0] == 181 / 365
+
+
+@pytest.mark.parametrize('extraction_date', [None, datetime(2019, 6, 30)])
+def test_derive_years_from_two_dates_matches_row_by_row(extraction_date):
+    df = make_portfolio()
+
+    if extraction_date is not None:
+        expected = df.apply(lambda x: (min(extraction_date, x['contract_end_date']) + timedelta(1) - x['contract_start_date']).days / 365, axis=1)
+    else:
+        expected = df.apply(lambda x: (x['contract_end_date'] + timedelta(1) - x['contract_start_date']).days / 365, axis=1)
+
+    np.testing.assert_allclose(derive_years_from_two_dates(df, 'contract_start_date', 'contract_end_date', extraction_date=extraction_date).values, expected.values.astype('float64'))
+
+
+def test_derive_actual_contract_end_date_missing_end_date():
+    df = pd.DataFrame({'contract_end_date': [pd.Timestamp('2019-03-01'), pd.NaT]})
+
+    actual_end_dates = derive_actual_contract_end_date(df, 'contract_end_date', datetime(2020, 1, 1))
+
+    assert actual_end_dates.tolist() == [pd.Timestamp('2019-03-01'), pd.Timestamp('2020-01-01')]
+
+
+@pytest.mark.parametrize('row_per_each_contract_year', [True, False])
+def test_derive_yearly_amounts_long_matches_wide(row_per_each_contract_year):
+    df = make_portfolio()
+    df['written_multiplier'] = np.random.RandomState(1).randint(1, 4, len(df))
+    arguments = (df, 2015, datetime(2021, 6, 30), 'contract_start_date', 'contract_end_date', row_per_each_contract_year)
+
+    df_wide = derive_yearly_amounts(*arguments)
+    df_long = derive_yearly_amounts(*arguments, long_format=True)
+
+    amounts_names = ['exposure', 'asif_earned_premium'] if row_per_each_contract_year == True else ['exposure', 'asif_earned_premium', 'asif_written_premium']
+
+    for year in range(2015, 2022):
+        df_year = df_long[df_long['occurrence_year'] == year]
+
+        for amount_name in amounts_names:
+            expected = np.zeros(len(df))
+            expected[df_year['policy_row'].values] = df_year[amount_name].values
+            np.testing.assert_allclose(expected, df_wide['{}_in_{}'.format(amount_name, year)].values)
+
+
+def test_derive_yearly_amounts_by_chunks_parses_csv_dates(tmp_path):
+    df = make_portfolio()
+    df[['contract_start_date', 'contract_end_date']].apply(lambda x: x.dt.strftime('%d/%m/%Y')).assign(policy_id=df['policy_id'], asif_written_premium_excl_taxes=df['asif_written_premium_excl_taxes']).to_csv(tmp_path / 'portfolio.csv', index=False)
+    arguments = (2015, datetime(2021, 6, 30), 'contract_start_date', 'contract_end_date')
+
+    df_chunks = pd.concat(derive_yearly_amounts_by_chunks(pd.read_csv(tmp_path / 'portfolio.csv', chunksize=120), *arguments), ignore_index=True)
+    number_of_rows = write_yearly_amounts_by_chunks(pd.read_csv(tmp_path / 'portfolio.csv', chunksize=120), tmp_path / 'amounts.csv', *arguments)
+
+    amounts_columns = [column for column in df_chunks.columns if '_in_' in column]
+    expected = derive_yearly_amounts(df, *arguments)
+    pd.testing.assert_frame_equal(df_chunks[amounts_columns], expected[amounts_columns])
+    assert number_of_rows == len(pd.read_csv(tmp_path / 'amounts.csv')) == len(df)
+
+
+def prepare_portfolio(df, extraction_date, row_per_each_contract_year):
+    """ Derives the actual contract end dates, lengths and written multipliers at an extraction date, with the default columns names"""
+
+    df = df.assign(actual_contract_end_date=derive_actual_contract_end_date(df, 'contract_end_date', extraction_date))
+    df['actual_contract_length'] = np.ceil(derive_years_from_two_dates(df, 'contract_start_date', 'contract_end_date', extraction_date=extraction_date))
+    df['written_multiplier'] = derive_premium_multiplier(df, 'contract_start_date', row_per_each_contract_year)
+
+    return df
+
+
+@pytest.mark.parametrize('row_per_each_contract_year', [True, False])
+@pytest.mark.parametrize('add_one_day', [False, True])
+@pytest.mark.parametrize('previous_extraction_date, extraction_date', [(datetime(2020, 6, 30), datetime(2020, 7, 31)), (datetime(2020, 12, 31), datetime(2021, 1, 31)), (datetime(2019, 1, 1), datetime(2021, 6, 30))])
+def test_update_yearly_amounts_matches_full_recompute(row_per_each_contract_year, add_one_day, previous_extraction_date, extraction_date):
+    df = make_portfolio(2000)
+    df = df[df['contract_start_date'] <= extraction_date]
+    df_new_business = df[df['contract_start_date'] > previous_extraction_date]
+    df_previous = df[df['contract_start_date'] <= previous_extraction_date]
+
+    df_previous = derive_yearly_amounts(prepare_portfolio(df_previous, previous_extraction_date, row_per_each_contract_year), 2015, previous_extraction_date, 'contract_start_date', row_per_each_contract_year=row_per_each_contract_year, add_one_day=add_one_day)
+    df_updated = update_yearly_amounts(df_previous, 2015, previous_extraction_date, extraction_date, 'contract_start_date', 'contract_end_date', row_per_each_contract_year=row_per_each_contract_year, add_one_day=add_one_day, df_new_business=prepare_portfolio(df_new_business, extraction_date, row_per_each_contract_year))
+    expected = derive_yearly_amounts(prepare_portfolio(df, extraction_date, row_per_each_contract_year), 2015, extraction_date, 'contract_start_date', row_per_each_contract_year=row_per_each_contract_year, add_one_day=add_one_day)
+
+    pd.testing.assert_frame_equal(df_updated.sort_index(), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('cut_func', ['pd.cut', 'pd.qcut'])
+def test_feature_binner_without_labels_gives_bins_positions(cut_func):
+    df = pd.DataFrame({'age': np.random.RandomState(0).uniform(18, 80, 200)})
+    df_new = pd.DataFrame({'age': [20, 50, np.nan, 79]})
+
+    binner = FeatureBinner(cut_func, bins=4, bins_labels=False).fit(df, 'age')
+
+    np.testing.assert_array_equal(binner.transform(df)['age'].values, eval(cut_func)(df['age'], 4, labels=False).values)
+    np.testing.assert_array_equal(binner.transform(df_new)['age'].values, pd.cut(df_new['age'], binner.edges['age'], labels=False, right=binner.right, include_lowest=True).values)
+
+
+def test_feature_binner_fit_sketches_checks_duplicate_edges():
+    sketches = {'claims_amount': QuantileSketch().update(np.concatenate((np.zeros(700), np.arange(1, 301))))}
+
+    with pytest.raises(ValueError):
+        FeatureBinner('pd.qcut', bins=5).fit_sketches(sketches)
+
+    with pytest.raises(ValueError):
+        FeatureBinner('pd.qcut', bins=5, bins_labels=['a', 'b', 'c', 'd', 'e'], duplicates='drop').fit_sketches(sketches)
+
+    binner = FeatureBinner('pd.qcut', bins=5, bins_labels=['low', 'high'], duplicates='drop').fit_sketches(sketches)
+    assert binner.transform_column(np.array([0, 250]), 'claims_amount').tolist() == ['low', 'high']
+
+
+@pytest.mark.parametrize('extraction_date', [datetime(2019, 12, 31), datetime(2021, 6, 30)])
+def test_derive_yearly_written_amounts_matches_row_by_row(extraction_date):
+    df = make_portfolio()
+    df = prepare_portfolio(df[df['contract_start_date'] <= extraction_date], extraction_date, False)
+    # The row by row version needs integer multipliers to add years to the dates
+    df['written_multiplier'] = df['written_multiplier'].astype('int64')
+    df.loc[df.index[:5], 'written_multiplier'] = 0
+    arguments = (extraction_date, 'contract_start_date', 'asif_written_premium_excl_taxes')
+
+    for contract_end_date in ['actual_contract_end_date', 'contract_end_date']:
+        df_written_amounts = derive_yearly_written_amounts(df, 2015, *arguments, contract_end_date, 'written_multiplier')
+
+        for year in range(2015, extraction_date.year + 1):
+            expected = df.apply(lambda x: derive_yearly_amount(x, year, *arguments, contract_end_date, 'written_multiplier'), axis=1)
+            np.testing.assert_allclose(df_written_amounts['asif_written_premium_in_{}'.format(year)].values, expected.values.astype('float64'))
+
+
+def derive_length_row_by_row(row, contract_start_date_column_name, actual_contract_length_column_name='actual_contract_length', actual_contract_end_date_column_name='actual_contract_end_date'):
+    """ Row by row version derive_premium_multiplier used to apply, kept as reference"""
+
+    contract_length = row[actual_contract_length_column_name]
+    derived_end = addYears(row[contract_start_date_column_name], contract_length - 1)
+
+    if contract_length == 0 or row[actual_contract_end_date_column_name] == row[contract_start_date_column_name]:
+        return 0
+    else:
+        return contract_length if derived_end < row[actual_contract_end_date_column_name] else max(1, contract_length - 1)
+
+
+def test_derive_premium_multiplier_matches_row_by_row():
+    df = prepare_portfolio(make_portfolio(), datetime(2021, 6, 30), False)
+    df['actual_contract_length'] = df['actual_contract_length'].astype('int64')
+    # Contracts ending on their start date or on an anniversary (including February 29 starts) are the edge cases of the length
+    df.loc[df.index[:10], 'actual_contract_end_date'] = df.loc[df.index[:10], 'contract_start_date']
+    df.loc[df.index[10:20], 'actual_contract_end_date'] = add_years_to_dates(df.loc[df.index[10:20], 'contract_start_date'], 2)
+    df.loc[df.index[10:20], 'actual_contract_length'] = 3
+
+    expected = df.apply(lambda x: derive_length_row_by_row(x, 'contract_start_date'), axis=1)
+
+    pd.testing.assert_series_equal(derive_premium_multiplier(df, 'contract_start_date', row_per_each_contract_year=False), expected)
+
+
+def count_policy_rows(df, policy_id_column_name='policy_id'):
+    """ Step only right when all the rows of a policy are in the same partition"""
+
+    return df.groupby(policy_id_column_name)[policy_id_column_name].transform('count')
+
+
+def tag_partition(df):
+    """ Step giving to each row the first index label of its partition"""
+
+    return pd.Series(df.index.min(), index=df.index)
+
+
+def test_run_steps_in_parallel_matches_sequential_chain():
+    df = make_portfolio(400)
+    # A policy has several rows and the index is not the default one
+    df['policy_id'] = df['policy_id'] % 150
+    df.index = np.arange(len(df))[::-1] * 7 + 3
+    steps = [(derive_actual_contract_end_date, {'end_date': 'contract_end_date', 'extraction_date': datetime(2021, 6, 30)}, 'actual_contract_end_date'),
+        (derive_years_from_two_dates, {'start_date': 'contract_start_date', 'end_date': 'actual_contract_end_date'}, 'actual_contract_length'),
+        (count_policy_rows, {}, 'policy_rows')]
+
+    df_parallel = run_steps_in_parallel(df, steps + [(tag_partition, {}, 'partition')], n_jobs=2)
+    expected = df
+    for function, kwargs, column_name in steps:
+        expected = expected.assign(**{column_name: function(expected, **kwargs)})
+
+    pd.testing.assert_frame_equal(df_parallel.drop(columns='partition'), expected)
+    assert df_parallel.index.equals(df.index)
+    assert (df_parallel.groupby('policy_id')['partition'].nunique() == 1).all() == True and df_parallel['partition'].nunique() == 2
+
+
+def check_create_datetime_apply(df, column, format='%d/%m/%Y'):
+    """ Version check_create_datetime used to be, parsing each value with pd.to_datetime, kept as reference"""
+
+    try:
+        check = df[column].dt.year
+        return df[column]
+    except:
+        return df[column].apply(pd.to_datetime, format=format)
+
+
+def make_dates_frames():
+    df_portfolio = pd.DataFrame({'contract_start_date': ['01/02/2020', None, '29/02/2020', '01/02/2020', '15/07/2019'], 'contract_end_date': ['31/01/2021', '31/12/2020', np.nan, '31/01/2021', '14/07/2020']}, index=[10, 4, 7, 1, 3])
+    df_claims = pd.DataFrame({'occurrence_date': ['03/03/2020', pd.Timestamp('2020-08-01'), None, '03/03/2020'], 'contract_start_date': pd.to_datetime(['2020-02-01', '2019-07-15', '2020-02-29', '2020-02-01'])})
+    df_missing = pd.DataFrame({'occurrence_date': pd.Series([None, np.nan], dtype='object')})
+
+    return [df_portfolio, df_claims, df_missing]
+
+
+def test_check_create_datetimes_matches_apply_to_datetime():
+    dfs = make_dates_frames()
+    columns = ['contract_start_date', 'contract_end_date', 'occurrence_date']
+
+    new_dfs = check_create_datetimes(dfs, columns)
+
+    for df, new_df in zip(dfs, new_dfs):
+        assert new_df.columns.tolist() == df.columns.tolist()
+
+        for column in [column for column in columns if column in df.columns]:
+            expected = check_create_datetime_apply(df, column)
+            expected = expected if pd.api.types.is_datetime64_any_dtype(df[column]) else expected.astype('datetime64[ns]')
+            pd.testing.assert_series_equal(new_df[column], expected)
+            pd.testing.assert_series_equal(check_create_datetime(df, column), expected)
+
+    # A column already in a datetime format is kept as it is
+    pd.testing.assert_series_equal(new_dfs[1]['contract_start_date'], dfs[1]['contract_start_date'])
+
+
+@pytest.mark.parametrize('dates', [['01/02/2020', '31/02/2020'], ['01/02/2020', '2020-02-01'], ['not a date']])
+def test_parse_dates_raises_on_invalid_strings(dates):
+    df = pd.DataFrame({'occurrence_date': dates})
+
+    with pytest.raises(ValueError):
+        check_create_datetime_apply(df, 'occurrence_date')
+
+    with pytest.raises(ValueError):
+        parse_dates(df['occurrence_date'])
+
+    with pytest.raises(ValueError):
+        check_create_datetime(df, 'occurrence_date')
+
+    with pytest.raises(ValueError):
+        check_create_datetimes([make_dates_frames()[0], df], ['contract_start_date', 'occurrence_date'])
@@ -0,0 +1,74 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from automate_insurance_pricing.preprocessing.descriptive_functions import *
+
+
+def derive_termination_rate_year_by_loop(df, start_business_year, extraction_year, main_column_contract_date, policy_id_column_name, column_to_sum_name):
+    """ The year by year implementation derive_termination_rate_year replaced, used as reference"""
+
+    df_previous_year = df[df[main_column_contract_date].dt.year == start_business_year].drop_duplicates(subset=policy_id_column_name, keep='first')
+    policies_previous_year = df_previous_year[policy_id_column_name]
+    termination_rates = {}
+    gwp_year = df_previous_year[column_to_sum_name].sum()
+    total_gwp = gwp_year
+    weighted_rates = 0
+
+    for year in range(start_business_year+1, extraction_year+1):
+        df_next_year = df[df[main_column_contract_date].dt.year == year].drop_duplicates(subset=policy_id_column_name, keep='first')
+        policies_next_year = df_next_year[policy_id_column_name]
+        policies_from_previous_year = df_next_year[df_next_year[policy_id_column_name].isin(policies_previous_year)]
+
+        termination_rate = (len(policies_previous_year) - len(policies_from_previous_year)) / len(policies_previous_year)
+        termination_rates[year-1] = termination_rate
+
+        weighted_rates += termination_rate * gwp_year
+        gwp_year = df_next_year[column_to_sum_name].sum()
+        total_gwp += gwp_year
+        policies_previous_year = policies_next_year
+
+    termination_rates['weighted_average'] = weighted_rates / total_gwp
+
+    return termination_rates
+
+
+def make_portfolio(number_of_policies=400, seed=0):
+    """ Builds a random portfolio with a row per yearly contract, some policies leaving and coming back and a few amendments in a same year"""
+
+    random_state = np.random.RandomState(seed)
+    policies = random_state.randint(0, number_of_policies, 3 * number_of_policies)
+    start_dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(random_state.randint(0, 6 * 365, len(policies)), unit='D')
+
+    return pd.DataFrame({'policy_id': policies, 'contract_start_date': start_dates, 'written_premium': random_state.uniform(100, 1000, len(policies))})
+
+
+def test_derive_termination_rate_year_matches_loop():
+    df = make_portfolio()
+
+    termination_rates = derive_termination_rate_year(df, 2015, 2020, 'contract_start_date', 'policy_id', 'written_premium')
+    expected = derive_termination_rate_year_by_loop(df, 2015, 2020, 'contract_start_date', 'policy_id', 'written_premium')
+
+    assert termination_rates.keys() == expected.keys()
+    np.testing.assert_allclose(list(termination_rates.values()), list(expected.values()))
+
+
+def test_derive_termination_rate_year_ignores_missing_policy_ids():
+    df = make_portfolio()
+    df_missing_ids = pd.concat([df, df.iloc[:20].assign(policy_id=np.nan)], ignore_index=True)
+
+    termination_rates = derive_termination_rate_year(df_missing_ids, 2015, 2020, 'contract_start_date', 'policy_id', 'written_premium')
+    expected = derive_termination_rate_year_by_loop(df, 2015, 2020, 'contract_start_date', 'policy_id', 'written_premium')
+
+    np.testing.assert_allclose(list(termination_rates.values()), list(expected.values()))
+
+
+def test_derive_retention_cohorts_first_year_retention():
+    df = make_portfolio()
+
+    df_retention, weighted_retention = derive_retention_cohorts(df, 2015, 2020, 'contract_start_date', 'policy_id', 'written_premium')
+
+    assert (df_retention[0] == 1).all()
+    assert weighted_retention[0] == 1
+    # The cohort of the last year cannot be observed after its first year
+    assert df_retention.loc[2020, 1:].isna().all()
@@ -0,0 +1,119 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from automate_insurance_pricing.preprocessing.encoding_functions import *
+
+
+def make_quotes():
+    """ Builds a small quotes dataframe with categorical and numerical features"""
+
+    return pd.DataFrame({'region': ['north', 'south', 'east', 'south', 'north', 'west'], 'vehicle': ['a', 'b', 'a', 'c', 'b', 'a'], 'age': [25, 40, 33, 61, 52, 19]})
+
+
+def test_encoding_pipeline_transform_chunks_keeps_the_chunks():
+    df = make_quotes()
+    chunks = [df.iloc[:3].copy(), df.iloc[3:].copy()]
+    pipeline = EncodingPipeline(label_features='vehicle', hot_features='region', scale_features='age').fit(df)
+
+    df_encoded = pd.concat(pipeline.transform_chunks(chunks))
+
+    pd.testing.assert_frame_equal(df_encoded, pipeline.transform(df))
+    assert all('region' in chunk.columns for chunk in chunks)
+
+
+def test_hot_encode_sparse_output_matches_dense():
+    from sklearn.preprocessing import OneHotEncoder
+
+    df = make_quotes()
+    features = ['region', 'vehicle']
+    features_hot_encoded = [feature + '_' + value for feature in features for value in np.unique(df[feature].astype('str'))]
+
+    df_dense, dense_encoder = hot_encode(df, features, features_hot_encoded, OneHotEncoder(sparse_output=False))
+    df_sparse, sparse_encoder, (matrix, columns, dropped_columns) = hot_encode(df, features, features_hot_encoded, OneHotEncoder(sparse_output=False), sparse_output=True)
+
+    assert sparse.issparse(matrix) == True
+    assert dropped_columns == {'region': 'region_north', 'vehicle': 'vehicle_a'}
+    np.testing.assert_array_equal(matrix.toarray(), df_dense[columns].values)
+    pd.testing.assert_frame_equal(df_sparse, df_dense.drop(columns=columns))
+    assert [list(categories) for categories in sparse_encoder.categories_] == [list(categories) for categories in dense_encoder.categories_]
+
+
+def test_hash_encode_is_the_same_across_calls_and_chunks():
+    df = make_quotes()
+
+    matrix = hash_encode(df, ['region', 'vehicle'], n_features=64)
+
+    assert matrix.shape == (len(df), 64)
+    np.testing.assert_array_equal(matrix.toarray(), hash_encode(df, ['region', 'vehicle'], n_features=64).toarray())
+    np.testing.assert_array_equal(sparse.vstack([hash_encode(df.iloc[:2], ['region', 'vehicle'], n_features=64), hash_encode(df.iloc[2:], ['region', 'vehicle'], n_features=64)]).toarray(), matrix.toarray())
+    np.testing.assert_array_equal(hash_encode(df.iloc[[4, 1]], ['region', 'vehicle'], n_features=64).toarray(), matrix[[4, 1]].toarray())
+    np.testing.assert_array_equal(hash_encode(df, ['region', 'vehicle'], n_features=64, categorize=False).toarray(), matrix.toarray())
+
+
+def test_hash_encode_separates_features_and_signs_values():
+    df = pd.DataFrame({'region': ['a', 'b', 'c', None], 'vehicle': ['a', 'b', 'c', None]})
+
+    matrix = hash_encode(df, ['region', 'vehicle'], n_features=2**20)
+    signed_matrix = hash_encode(df, ['region', 'vehicle'], n_features=2**20, alternate_sign=True)
+
+    # The same value in two features goes to two columns, a row having one entry per feature
+    assert (matrix.getnnz(axis=1) == 2).all() == True and (matrix.sum(axis=1) == 2).all() == True
+    assert (hash_encode(df, 'region', n_features=2**20).indices != hash_encode(df, 'vehicle', n_features=2**20).indices).all() == True
+
+    np.testing.assert_array_equal(np.abs(signed_matrix.toarray()), matrix.toarray())
+    assert set(np.unique(signed_matrix.data)) <= {-1.0, 1.0}
+
+    # Across many values, both signs are used
+    df_values = pd.DataFrame({'region': np.arange(200).astype('str')})
+    assert set(np.unique(hash_encode(df_values, 'region', n_features=2**20, alternate_sign=True).data)) == {-1.0, 1.0}
+
+
+def target_encode_per_fold(df, feature, target_column, weight_column, n_splits, smoothing, random_state):
+    """ Out-of-fold encodings derived fold by fold with groupby, with the folds split as target_encode does"""
+
+    folds = np.random.RandomState(random_state).permutation(df.shape[0]) % n_splits
+    weights = df[weight_column] if weight_column is not None else pd.Series(1.0, index=df.index)
+    encoded = pd.Series(np.nan, index=df.index)
+
+    for fold in range(n_splits):
+        in_fold = folds == fold
+        df_other_folds, other_folds_weights = df[~in_fold], weights[~in_fold]
+        prior = df_other_folds[target_column].sum() / other_folds_weights.sum()
+
+        level_targets = df_other_folds.groupby(feature)[target_column].sum()
+        level_weights = other_folds_weights.groupby(df_other_folds[feature]).sum()
+        level_encodings = (level_targets + smoothing * prior) / (level_weights + smoothing)
+
+        encoded[in_fold] = df.loc[in_fold, feature].map(level_encodings).fillna(prior).values
+
+    return encoded.values
+
+
+@pytest.mark.parametrize('weight_column, smoothing', [(None, 0), (None, 10), ('exposure', 0), ('exposure', 5)])
+def test_target_encode_matches_per_fold_groupby(weight_column, smoothing):
+    random_state = np.random.RandomState(0)
+    df = pd.DataFrame({'region': random_state.choice(['north', 'south', 'east', None, 'rare'], 400, p=[0.4, 0.3, 0.2, 0.095, 0.005]), 'vehicle': random_state.choice(['a', 'b', 'c'], 400), 'exposure': random_state.uniform(0.1, 1, 400)})
+    df['claims_count'] = random_state.poisson(df['exposure'] * np.where(df['vehicle'] == 'a', 0.5, 0.1))
+
+    df_encoded, encodings = target_encode(df, ['region', 'vehicle'], 'claims_count', weight_column, n_splits=4, smoothing=smoothing, random_state=3)
+
+    for feature in ['region', 'vehicle']:
+        np.testing.assert_allclose(df_encoded[feature + '_target_enc'].values, target_encode_per_fold(df, feature, 'claims_count', weight_column, 4, smoothing, 3))
+
+    # The encodings kept for new data are derived on the whole data
+    weights = df[weight_column] if weight_column is not None else pd.Series(1.0, index=df.index)
+    overall_mean = df['claims_count'].sum() / weights.sum()
+    expected = (df.groupby('region')['claims_count'].sum() + smoothing * overall_mean) / (weights.groupby(df['region']).sum() + smoothing)
+
+    pd.testing.assert_series_equal(encodings['region'][0].sort_index(), expected.sort_index(), check_names=False)
+    assert encodings['region'][1] == pytest.approx(overall_mean)
+
+
+def test_apply_target_encoding_gives_overall_mean_to_unseen_and_missing_values():
+    df = pd.DataFrame({'region': ['north', 'south', 'north', 'south'], 'claims_count': [1.0, 0, 3, 0]})
+    df_encoded, encodings = target_encode(df, 'region', 'claims_count', n_splits=2, smoothing=1)
+
+    df_new = apply_target_encoding(pd.DataFrame({'region': ['north', 'west', None, 'south']}), encodings)
+
+    assert df_new['region_target_enc'].tolist() == pytest.approx([(4 + 1) / 3, 1, 1, (0 + 1) / 3])
@@ -0,0 +1,33 @@
+import pandas as pd
+import numpy as np
+
+from automate_insurance_pricing.preprocessing.index_functions import *
+
+
+def make_portfolio():
+    return pd.DataFrame({'policy_id': [3, 1, 3, np.nan, 2, 1], 'contract_start_date': pd.to_datetime(['2019-01-01', '2020-05-01', '2020-01-01', '2020-02-01', '2018-03-01', '2019-05-01']), 'premium': [100, 200, 110, 50, 300, 190]})
+
+
+def test_get_policy_rows_matches_sort_and_drop_duplicates():
+    df = make_portfolio()
+    policy_index = PolicyIndex(df, 'policy_id', 'contract_start_date')
+
+    for keep in ['first', 'last']:
+        expected = df.dropna(subset=['policy_id']).sort_values('contract_start_date').drop_duplicates('policy_id', keep=keep)
+        pd.testing.assert_frame_equal(policy_index.get_policy_rows(df, keep=keep), expected)
+
+
+def test_policy_index_does_not_keep_the_portfolio():
+    policy_index = PolicyIndex(make_portfolio(), 'policy_id', 'contract_start_date')
+
+    assert not any(isinstance(value, pd.DataFrame) for value in vars(policy_index).values())
+
+
+def test_get_latest_effective_dates():
+    df = make_portfolio()
+
+    latest_effective_dates = PolicyIndex(df, 'policy_id', 'contract_start_date').get_latest_effective_dates([1, 4, 3])
+    empty_latest_effective_dates = PolicyIndex(df.iloc[:0], 'policy_id', 'contract_start_date').get_latest_effective_dates([1, 4])
+
+    assert pd.DatetimeIndex(latest_effective_dates).equals(pd.DatetimeIndex(['2020-05-01', 'NaT', '2020-01-01']))
+    assert pd.isna(empty_latest_effective_dates).all() == True and len(empty_latest_effective_dates) == 2
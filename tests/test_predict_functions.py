@@ -0,0 +1,58 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from scipy import sparse
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.tree import DecisionTreeRegressor
+
+from automate_insurance_pricing.risk_prediction.predict_functions import *
+
+
+@pytest.mark.parametrize('model, result_name', [(LinearRegression(), 'coefs'), (DecisionTreeRegressor(random_state=0), 'features_importances')])
+def test_run_model_predictions_names_sparse_features(model, result_name):
+    random_state = np.random.RandomState(0)
+    X = sparse.random(200, 4, density=0.5, format='csr', random_state=random_state)
+    y = X @ np.array([1.0, 0.0, 2.0, -1.0]) + random_state.normal(0, 0.01, 200)
+    features = ['age', 'region_south', 'region_west', 'vehicle_b']
+
+    results = run_model_predictions('model', model, X[:150], X[150:], y[:150], y[150:], features)
+
+    assert results[result_name].index.tolist() == features
+
+
+@pytest.mark.parametrize('model, result_name', [(LinearRegression(), 'coefs'), (DecisionTreeRegressor(random_state=0), 'features_importances')])
+def test_run_model_predictions_names_dense_columns_with_features_subset(model, result_name):
+    random_state = np.random.RandomState(0)
+    X = pd.DataFrame(random_state.normal(size=(200, 4)), columns=['age', 'region_south', 'region_west', 'vehicle_b'])
+    y = X.values @ np.array([1.0, 0.0, 2.0, -1.0])
+
+    # The model is fitted on all the columns, whatever the features given
+    results = run_model_predictions('model', model, X[:150], X[150:], y[:150], y[150:], ['age', 'region_west'])
+
+    assert results[result_name].index.tolist() == X.columns.tolist()
+
+    if result_name == 'coefs':
+        np.testing.assert_allclose(results['coefs'].values, [1.0, 0.0, 2.0, -1.0], atol=1e-8)
+
+
+def test_run_model_predictions_checks_sparse_features_names():
+    X = sparse.random(200, 4, density=0.5, format='csr', random_state=0)
+    y = X @ np.array([1.0, 0.0, 2.0, -1.0])
+
+    with pytest.raises(ValueError):
+        run_model_predictions('model', LinearRegression(), X[:150], X[150:], y[:150], y[150:], ['age', 'region_west'])
+
+
+def test_run_model_predictions_keeps_all_classes_coefficients():
+    random_state = np.random.RandomState(0)
+    X = pd.DataFrame(random_state.normal(size=(300, 3)), columns=['age', 'bonus_malus', 'vehicle_age'])
+    y_multiclass = np.digitize(X['age'].values, [-0.5, 0.5])
+    y_binary = (X['age'].values > 0).astype('int64')
+
+    results_multiclass = run_model_predictions('model', LogisticRegression(), X[:200], X[200:], y_multiclass[:200], y_multiclass[200:], X.columns)
+    results_binary = run_model_predictions('model', LogisticRegression(), X[:200], X[200:], y_binary[:200], y_binary[200:], X.columns)
+
+    assert results_multiclass['coefs'].shape == (3, 3) and results_multiclass['coefs'].index.tolist() == [0, 1, 2]
+    assert results_multiclass['coefs'].columns.tolist() == X.columns.tolist()
+    assert isinstance(results_binary['coefs'], pd.Series) == True and results_binary['coefs'].index.tolist() == X.columns.tolist()
@@ -0,0 +1,47 @@
+import pandas as pd
+import numpy as np
+
+from automate_insurance_pricing.exploration.profile_functions import *
+
+
+def make_chunks():
+    """ Builds chunks as pd.read_csv can give them: a column of integers, floats once it has missing values, and object once it has a typo"""
+
+    random_state = np.random.RandomState(0)
+    claims_amounts = [random_state.normal(1000, 100, 300).round() for chunk_number in range(3)]
+    claims_amounts[0][[0, 1]] = [5000, -3000]
+
+    return [pd.DataFrame({'claims_amount': claims_amounts[0].astype('int64')}),
+        pd.DataFrame({'claims_amount': np.append(claims_amounts[1], np.nan)}),
+        pd.DataFrame({'claims_amount': pd.Series(claims_amounts[2], dtype='object').where(np.arange(300) != 0, 'unknown')})]
+
+
+def test_profile_data_coerces_chunks_with_another_dtype():
+    chunks = make_chunks()
+    df = pd.concat(chunks, ignore_index=True)
+    numbers = pd.to_numeric(df['claims_amount'], errors='coerce')
+
+    df_summary = profile_data(chunks).df_summary
+
+    assert df_summary.loc['claims_amount', 'min'] == numbers.min()
+    assert df_summary.loc['claims_amount', 'max'] == numbers.max()
+    np.testing.assert_allclose(df_summary.loc['claims_amount', 'mean'], numbers.mean())
+    assert abs(df_summary.loc['claims_amount', 'number_of_uniques'] - df['claims_amount'].nunique()) <= 0.05 * df['claims_amount'].nunique()
+
+
+def test_profile_data_counts_missing_values_as_outliers_as_find_outliers():
+    chunks = make_chunks()
+    df = pd.DataFrame({'claims_amount': pd.to_numeric(pd.concat(chunks, ignore_index=True)['claims_amount'], errors='coerce')})
+
+    for method in ['interquartile', 'z-score']:
+        df_summary = profile_data(chunks, method=method).df_summary
+        assert df_summary.loc['claims_amount', 'outliers_count'] == len(find_outliers_positions(df, 'claims_amount', method=method))
+
+
+def test_profile_data_adds_columns_getting_numbers_in_a_later_chunk():
+    chunks = [pd.DataFrame({'vehicle_age': pd.Series([None, None], dtype='object')}), pd.DataFrame({'vehicle_age': [3.0, 5.0]})]
+
+    df_summary = profile_data(chunks).df_summary
+
+    assert (df_summary.loc['vehicle_age', 'min'], df_summary.loc['vehicle_age', 'max']) == (3, 5)
+    assert df_summary.loc['vehicle_age', 'outliers_count'] == 2
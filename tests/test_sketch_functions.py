@@ -0,0 +1,100 @@
+import pandas as pd
+import numpy as np
+
+from automate_insurance_pricing.preprocessing.sketch_functions import *
+from automate_insurance_pricing.preprocessing.descriptive_functions import *
+
+
+def test_distinct_count_sketch_ignores_chunks_dtypes():
+    values = np.arange(1000)
+
+    sketch = DistinctCountSketch().update(pd.Series(values)).update(pd.Series(values, dtype='float64')).update(pd.Series(pd.Categorical(values))).update(pd.Series(values, dtype='Int64')).update(pd.Series(values, dtype='object'))
+
+    assert abs(sketch.count() - 1000) <= 30
+
+
+def test_create_df_unique_values_approximate_with_mixed_dtypes_chunks():
+    # pd.read_csv gives floats to the chunks with missing values and integers to the other ones
+    chunks = [pd.DataFrame({'vehicle_age': np.arange(500)}), pd.DataFrame({'vehicle_age': np.append(np.arange(500, dtype='float64'), np.nan)})]
+
+    df_unique_values = create_df_unique_values(chunks, 'vehicle_age', approximate=True)
+
+    assert abs(df_unique_values['number_of_uniques'].iloc[0] - 500) <= 15
+
+
+def check_rank_error(sketch, values, quantiles):
+    """ Checks that the true rank of each quantile returned by the sketch is within the rank error bound of the quantile asked"""
+
+    sorted_values = np.sort(values)
+    sketch_quantiles = sketch.quantile(quantiles)
+    lower_ranks = np.searchsorted(sorted_values, sketch_quantiles, side='left') / len(values)
+    upper_ranks = np.searchsorted(sorted_values, sketch_quantiles, side='right') / len(values)
+    bound = sketch.rank_error_bound()
+
+    assert (lower_ranks - bound <= quantiles + 1e-12).all() == True and (upper_ranks + bound >= quantiles - 1e-12).all() == True
+
+
+QUANTILES = np.linspace(0, 1, 41)
+
+
+def test_quantile_sketch_rank_error_within_bound():
+    values = np.random.RandomState(0).lognormal(7, 1.5, 100000)
+
+    sketch = QuantileSketch(k=100).update(values)
+
+    assert 0 < sketch.rank_error_bound() < 0.1
+    check_rank_error(sketch, values, QUANTILES)
+    assert (sketch.quantile(0), sketch.quantile(1)) == (values.min(), values.max())
+    assert abs(sketch.rank(np.median(values)) - len(values) / 2) <= sketch.rank_error_bound() * len(values)
+
+
+def test_quantile_sketch_merge_of_chunks_matches_single_sketch():
+    values = np.random.RandomState(1).normal(1000, 200, 60000)
+    values[::7] = np.nan
+
+    single_sketch = QuantileSketch(k=100).update(values)
+    chunks_sketches = [QuantileSketch(k=100, random_state=seed).update(chunk) for seed, chunk in enumerate(np.array_split(values, 6))]
+    merged_sketch = chunks_sketches[0]
+
+    for sketch in chunks_sketches[1:]:
+        merged_sketch.merge(sketch)
+
+    known_values = values[~np.isnan(values)]
+    assert merged_sketch.count == single_sketch.count == len(known_values)
+    check_rank_error(merged_sketch, known_values, QUANTILES)
+
+    # Both sketches are within their bounds of the true ranks, so within the sum of the bounds of each other
+    sorted_values = np.sort(known_values)
+    ranks_gap = np.abs(np.searchsorted(sorted_values, merged_sketch.quantile(QUANTILES)) - np.searchsorted(sorted_values, single_sketch.quantile(QUANTILES))) / len(known_values)
+    assert (ranks_gap <= merged_sketch.rank_error_bound() + single_sketch.rank_error_bound() + 1 / len(known_values)).all() == True
+
+
+def test_create_quantile_sketches_survives_pickle():
+    import pickle
+
+    df = pd.DataFrame({'cost': np.random.RandomState(2).exponential(1000, 20000), 'age': np.random.RandomState(3).randint(18, 90, 20000)})
+    sketches = create_quantile_sketches([df.iloc[:8000], df.iloc[8000:]], ['cost', 'age'], k=50)
+
+    unpickled_sketches = pickle.loads(pickle.dumps(sketches))
+
+    for column in ['cost', 'age']:
+        np.testing.assert_array_equal(unpickled_sketches[column].quantile(QUANTILES), sketches[column].quantile(QUANTILES))
+        assert unpickled_sketches[column].rank_error_bound() == sketches[column].rank_error_bound()
+
+    # The random state is kept as well, so that both sketches go on the same way
+    new_values = np.random.RandomState(4).exponential(1000, 5000)
+    np.testing.assert_array_equal(unpickled_sketches['cost'].update(new_values).quantile(QUANTILES), sketches['cost'].update(new_values).quantile(QUANTILES))
+
+
+def test_feature_binner_fit_sketches_edges_close_to_qcut():
+    from automate_insurance_pricing.preprocessing.create_functions import FeatureBinner
+
+    df = pd.DataFrame({'cost': np.random.RandomState(5).lognormal(7, 1, 50000)})
+    sketches = create_quantile_sketches([df.iloc[start:start + 10000] for start in range(0, len(df), 10000)], 'cost')
+
+    binner = FeatureBinner('pd.qcut', bins=5).fit_sketches(sketches)
+    qcut_edges = pd.qcut(df['cost'], 5, retbins=True)[1]
+
+    edges_ranks = np.searchsorted(np.sort(df['cost'].values), binner.edges['cost']) / len(df)
+    np.testing.assert_allclose(edges_ranks[1:-1], np.linspace(0, 1, 6)[1:-1], atol=sketches['cost'].rank_error_bound())
+    assert (binner.edges['cost'][0], binner.edges['cost'][-1]) == (qcut_edges[0], qcut_edges[-1])
@@ -0,0 +1,15 @@
+import pandas as pd
+import numpy as np
+
+from automate_insurance_pricing.standard_functions import *
+
+
+def test_add_years_to_dates_matches_add_years():
+    random_state = np.random.RandomState(0)
+    dates = pd.Series(pd.Timestamp('2015-01-01') + pd.to_timedelta(random_state.randint(0, 8 * 365, 300), unit='D') + pd.to_timedelta(random_state.randint(0, 24, 300), unit='h'))
+    dates.iloc[:20] = pd.Timestamp('2016-02-29 10:00')
+    years = random_state.randint(-3, 5, len(dates))
+
+    for years_to_add in [1, 4, years]:
+        expected = [addYears(date, number_of_years) for date, number_of_years in zip(dates, np.broadcast_to(years_to_add, len(dates)))]
+        assert add_years_to_dates(dates, years_to_add).tolist() == expected